@@ -0,0 +1,44 @@
+import streamlit as st
+import kpis
+import storage
+
+# Page of the delivery KPIs (see kpis.py)
+
+SOURCES = {'Xe máy': 'moto', 'Ô tô': 'truck'}
+
+
+def display_analysis():
+    st.title("Phân tích dữ liệu giao hàng")
+
+    storage.init_db()
+    kpis.refresh_kpis()
+
+    selected_sources = st.multiselect("Nguồn dữ liệu", list(SOURCES), default=list(SOURCES))
+    sources = [SOURCES[name] for name in selected_sources]
+    if not sources:
+        st.write("Chọn ít nhất một nguồn dữ liệu.")
+        return
+    months = kpis.kpi_months(sources)
+    if not months:
+        st.write("Chưa có dữ liệu giao hàng.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        start_month = st.selectbox("Từ tháng", months, index=0)
+    with col2:
+        end_month = st.selectbox("Đến tháng", months, index=len(months) - 1)
+
+    st.header("Khách hàng")
+    customers = kpis.kpi_totals('customer', sources, start_month, end_month)
+    top = st.slider("Số khách hàng hiển thị", 5, 100, 20)
+    st.dataframe(customers.head(top))
+
+    st.header("Cơ cấu sản phẩm theo tháng")
+    st.bar_chart(kpis.kpi_trend('product', sources, start_month, end_month))
+
+    st.header("Tỉ lệ vỏ về theo sản phẩm")
+    st.dataframe(kpis.kpi_totals('product', sources, start_month, end_month))
+
+    st.header("Năng suất người chở")
+    st.dataframe(kpis.kpi_totals('driver', sources, start_month, end_month))
@@ -1,12 +1,13 @@
+import importlib
+import pandas as pd
 import streamlit as st
-import moto
-import attendance
-import truck
-import analysis
-import salary
-import data_prepare
-import inventory
-import customer_pricing
+import storage
+from datetime import datetime
+
+# The loaded delivery frames are shared by every session and rerun. With copy-on-write a frame derived
+# from them (a filter, a page, an added column) never writes back into them, and pandas only copies
+# data when the derived frame is actually modified.
+pd.set_option('mode.copy_on_write', True)
 
 urls_moto = [
     'https://docs.google.com/spreadsheets/d/e/2PACX-1vQjF-vOUyngQKPRXkYvKwIDMAAoK5Jm_RGblSz2FLJsRDmu8IwfwJpfgcPgAY16FmXMN3tBKIPslHem/pub?gid=568267471&single=true&output=csv',
@@ -16,41 +17,52 @@ urls_truck = [
     'https://docs.google.com/spreadsheets/d/e/2PACX-1vQjF-vOUyngQKPRXkYvKwIDMAAoK5Jm_RGblSz2FLJsRDmu8IwfwJpfgcPgAY16FmXMN3tBKIPslHem/pub?gid=63454759&single=true&output=csv'
     ]
 
-raw_data_moto = data_prepare.load_data_from_urls_moto(urls_moto)
-raw_data_truck = data_prepare.load_data_from_urls_truck(urls_truck) 
-
-st.sidebar.title("Chọn chức năng muốn thao tác")
-option = st.sidebar.selectbox('Chức năng',['Truy xuất dữ liệu xe máy', 'Truy xuất dữ liệu ô tô','Quản lý công nợ hàng hoá',
-                                                               'Quản lý giá cả khách hàng','Bảng chấm công','Bảng tính lương','Công nợ khách hàng','Quản lý Nhân Viên'])
+# Seconds before the sheets are downloaded again; stale data keeps being served while it reloads
+DATA_TTL_SECONDS = 300
 
-if option == 'Truy xuất dữ liệu xe máy':
-    st.header("Thông tin xe máy")
-    moto.display_moto_data(raw_data_moto)
+# Menu entry -> (module, function, datasets passed to the function, header). A page module is only
+# imported when its page is opened, and the delivery sheets are only loaded for the pages that use them.
+PAGES = {
+    'Truy xuất dữ liệu xe máy': ('moto', 'display_moto_data', ('moto',), "Thông tin xe máy"),
+    'Truy xuất dữ liệu ô tô': ('truck', 'display_truck_data', ('truck',), "Thông tin ô tô"),
+    'Quản lý công nợ hàng hoá': ('inventory', 'run_inventory_management_app', ('moto', 'truck'), None),
+    'Quản lý giá cả khách hàng': ('customer_pricing', 'run_pricing_app', ('moto', 'truck'), "Quản lý giá cả khách hàng"),
+    'Bảng chấm công': ('attendance', 'display_time_tracking', (), "Bảng chấm công"),
+    'Bảng tính lương': ('salary', 'display_payroll', (), None),
+    'Công nợ khách hàng': ('receivables', 'display_receivables', (), None),
+    'Quản lý Nhân Viên': ('attendance', 'display_employee_form', (), None),
+    'Phân tích': ('analysis', 'display_analysis', (), None),
+}
 
-elif option == 'Bảng chấm công':
-    st.header("Bảng chấm công")
-    attendance.display_time_tracking()
 
+def load_datasets():
+    """ {'moto': DataFrame, 'truck': DataFrame} of the delivery sheets, with the load status in the sidebar """
+    import data_prepare
 
-elif option == 'Quản lý công nợ hàng hoá':
-    inventory. run_inventory_management_app(raw_data_moto,raw_data_truck)
+    if st.sidebar.button("Làm mới dữ liệu"):
+        data_prepare.invalidate_cache()
 
-elif option == 'Quản lý giá cả khách hàng':
-    st.header("Quản lý giá cả khách hàng")
-    customer_pricing.run_pricing_app(raw_data_moto,raw_data_truck)
+    raw_data_moto, raw_data_truck, load_report = data_prepare.get_delivery_data(urls_moto, urls_truck, ttl=DATA_TTL_SECONDS)
+    for url, url_report in load_report.items():
+        if not url_report['ok']:
+            st.sidebar.warning(f"Không tải được dữ liệu từ {url}: {url_report['error']}")
+        elif url_report.get('unparsed_dates'):
+            st.sidebar.warning(f"{url_report['unparsed_dates']} dòng có ngày không đúng định dạng trong {url}")
+    loaded_at = data_prepare.cache_loaded_at(data_prepare.delivery_cache_key(urls_moto, urls_truck))
+    if loaded_at is not None:
+        st.sidebar.caption(f"Dữ liệu cập nhật lúc {datetime.fromtimestamp(loaded_at).strftime('%H:%M:%S %d/%m/%Y')}")
+    return {'moto': raw_data_moto, 'truck': raw_data_truck}
 
-elif option == 'Quản lý Nhân Viên':
-    attendance.display_employee_form()
-
-elif option == 'Truy xuất dữ liệu ô tô':
-    st.header("Thông tin ô tô")
-    truck.display_truck_data(raw_data_truck)
 
+# Create or upgrade the database schema; this only does work on the first run of the process
+storage.init_db()
 
+st.sidebar.title("Chọn chức năng muốn thao tác")
+option = st.sidebar.selectbox('Chức năng', list(PAGES))
 
-# elif option == 'Phân tích':
-#     st.header("Thông tin Phân tích")
-#     analysis.display_car_data()
-# elif option == 'Lương':
-#     st.header("Thông tin ô tô")
-#     salary.display_car_data()
+module_name, function_name, dataset_names, header = PAGES[option]
+datasets = load_datasets() if dataset_names else {}
+if header:
+    st.header(header)
+page = getattr(importlib.import_module(module_name), function_name)
+page(*[datasets[name] for name in dataset_names])
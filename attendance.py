@@ -1,130 +1,201 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
+from functools import lru_cache
 import calendar
+import threading
+import formatting
+import storage
 
-# Kết nối cơ sở dữ liệu SQLite
+# Kết nối cơ sở dữ liệu chung của ứng dụng (kết nối dùng chung trong pool, trả lại khi hết khối with)
 def connect_db():
-    return sqlite3.connect('company.db')
-
-# Tạo bảng nhân viên
-def create_employee_table():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS employees (
-            employee_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            employee_name TEXT NOT NULL,
-            base_salary REAL NOT NULL,
-            allowance REAL NOT NULL,
-            insurance REAL NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Tạo bảng chấm công
-def create_attendance_table():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            employee_id INTEGER,
-            date TEXT,
-            presence REAL,
-            FOREIGN KEY (employee_id) REFERENCES employees (employee_id),
-            UNIQUE(employee_id, date)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    return storage.connection()
+
+# Bảng tổng hợp chấm công theo (năm, tháng), xóa mỗi khi nhân viên hoặc chấm công thay đổi
+_month_summaries = {}
+_month_summaries_lock = threading.Lock()
+
+def clear_month_summaries():
+    with _month_summaries_lock:
+        _month_summaries.clear()
 
 # Thêm nhân viên
 def insert_employee(name, base_salary, allowance, insurance):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO employees (employee_name, base_salary, allowance, insurance)
-        VALUES (?, ?, ?, ?)
-    ''', (name, base_salary, allowance, insurance))
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute('''
+            INSERT INTO employees (employee_name, base_salary, allowance, insurance)
+            VALUES (?, ?, ?, ?)
+        ''', (name, base_salary, allowance, insurance))
+    clear_month_summaries()
 
 # Cập nhật thông tin nhân viên
 def update_employee(employee_id, name, base_salary, allowance, insurance):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE employees
-        SET employee_name = ?, base_salary = ?, allowance = ?, insurance = ?
-        WHERE employee_id = ?
-    ''', (name, base_salary, allowance, insurance, employee_id))
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute('''
+            UPDATE employees
+            SET employee_name = ?, base_salary = ?, allowance = ?, insurance = ?
+            WHERE employee_id = ?
+        ''', (name, base_salary, allowance, insurance, employee_id))
+    clear_month_summaries()
 
 # Xóa nhân viên
 def delete_employee(employee_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM employees WHERE employee_id = ?', (employee_id,))
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute('DELETE FROM employees WHERE employee_id = ?', (employee_id,))
+    clear_month_summaries()
+
+# Thêm hoặc cập nhật chấm công hàng loạt: rows là các bộ (employee_id, date, presence),
+# ghi trong một giao dịch duy nhất
+def upsert_attendance_batch(rows):
+    rows = list(rows)
+    with storage.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO attendance (employee_id, date, presence)
+            VALUES (?, ?, ?)
+            ON CONFLICT(employee_id, date)
+            DO UPDATE SET presence=excluded.presence
+        ''', rows)
+    clear_month_summaries()
+    return len(rows)
 
 # Thêm hoặc cập nhật thông tin chấm công
 def upsert_attendance(employee_id, date, presence):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO attendance (employee_id, date, presence)
-        VALUES (?, ?, ?)
-        ON CONFLICT(employee_id, date)
-        DO UPDATE SET presence=excluded.presence
-    ''', (employee_id, date, presence))
-    conn.commit()
-    conn.close()
+    upsert_attendance_batch([(employee_id, date, presence)])
+
+# Đọc bảng chấm công tháng từ file CSV hoặc Excel
+def read_attendance_grid(uploaded_file):
+    if uploaded_file.name.lower().endswith(('.xlsx', '.xls')):
+        # Đọc Excel cần thư viện openpyxl (.xlsx) hoặc xlrd (.xls)
+        return pd.read_excel(uploaded_file)
+    return pd.read_csv(uploaded_file)
+
+# Chuyển bảng chấm công tháng thành các dòng chấm công.
+# Cột đầu tiên là tên nhân viên, các cột còn lại là ngày trong tháng ('dd/mm' hoặc số ngày).
+# Trả về (các dòng chấm công, tên nhân viên không tìm thấy, cột không phải ngày trong tháng)
+def grid_to_attendance_rows(grid, year, month, employee_dict):
+    days_in_month = calendar.monthrange(year, month)[1]
+    day_columns = {}
+    unknown_columns = []
+    for column in grid.columns[1:]:
+        label = str(column).strip()
+        parts = label.split('/')
+        day = parts[0]
+        same_month = len(parts) == 1 or (len(parts) == 2 and parts[1].isdigit() and int(parts[1]) == month)
+        if day.isdigit() and 1 <= int(day) <= days_in_month and same_month:
+            day_columns[column] = f"{year:04d}-{month:02d}-{int(day):02d}"
+        else:
+            unknown_columns.append(label)
+
+    names = grid.iloc[:, 0].astype(str).str.strip()
+    known = names.isin(list(employee_dict.keys()))
+    unknown_employees = sorted(set(names[~known]))
+
+    long = grid[known].assign(employee_id=names[known].map(employee_dict)).melt(
+        id_vars='employee_id', value_vars=list(day_columns), var_name='day', value_name='presence')
+    long['presence'] = pd.to_numeric(long['presence'], errors='coerce')
+    long = long[long['presence'].notna()]
+    rows = list(zip(long['employee_id'].astype(int).tolist(), long['day'].map(day_columns).tolist(),
+                    long['presence'].astype(float).tolist()))
+    return rows, unknown_employees, unknown_columns
 
 # Lấy tên nhân viên
 def get_employee_names():
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT employee_id, employee_name FROM employees")
-    employees = cursor.fetchall()
-    conn.close()
-    return employees
+    with connect_db() as conn:
+        return conn.execute("SELECT employee_id, employee_name FROM employees").fetchall()
 
 # Lấy tất cả thông tin nhân viên
 def get_all_employee_info():
-    conn = connect_db()
     query = "SELECT * FROM employees"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    with connect_db() as conn:
+        return pd.read_sql_query(query, conn)
+
+# Dữ liệu chấm công của một khoảng ngày [từ ngày, đến trước ngày), tìm theo chỉ mục idx_attendance_date
+MONTH_ENTRIES_QUERY = '''
+    SELECT employees.employee_name, attendance.date, attendance.presence
+    FROM attendance
+    JOIN employees ON attendance.employee_id = employees.employee_id
+    WHERE attendance.date >= ? AND attendance.date < ?
+'''
+
+# Ngày đầu tháng và ngày đầu tháng sau ('YYYY-MM-DD')
+def month_range(year, month):
+    year, month = int(year), int(month)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
 
 # Lấy dữ liệu chấm công theo tháng
 def get_month_entries(year, month):
-    conn = connect_db()
-    query = '''
-        SELECT employees.employee_name, attendance.date, attendance.presence
-        FROM attendance
-        JOIN employees ON attendance.employee_id = employees.employee_id
-        WHERE strftime('%Y', attendance.date) = ? AND strftime('%m', attendance.date) = ?
-    '''
-    df = pd.read_sql_query(query, conn, params=(year, month))
-    conn.close()
-    return df
-
-# Định dạng số với dấu phân cách hàng nghìn
-def format_currency(value):
-    return f"{value:,.0f}"
+    with connect_db() as conn:
+        return pd.read_sql_query(MONTH_ENTRIES_QUERY, conn, params=month_range(year, month))
+
+# Lịch của một tháng, tính một lần cho mỗi tháng: (các ngày 'dd/mm', các ngày chủ nhật 'dd/mm',
+# số ngày làm việc không tính chủ nhật)
+@lru_cache(maxsize=None)
+def month_calendar(year, month):
+    first_weekday, days_in_month = calendar.monthrange(year, month)
+    days = tuple(f"{day:02d}/{month:02d}" for day in range(1, days_in_month + 1))
+    sundays = tuple(day for offset, day in enumerate(days) if (first_weekday + offset) % 7 == calendar.SUNDAY)
+    return days, sundays, days_in_month - len(sundays)
+
+# Tổng chấm công theo nhân viên và ngày trong một khoảng ngày [từ ngày, đến trước ngày);
+# nhóm theo thứ tự của chỉ mục idx_attendance_date nên không cần sắp xếp thêm
+MONTH_SUMMARY_QUERY = '''
+    SELECT attendance.employee_id, employees.employee_name,
+           CAST(substr(attendance.date, 9, 2) AS INTEGER) AS day, SUM(attendance.presence) AS presence
+    FROM attendance
+    JOIN employees ON attendance.employee_id = employees.employee_id
+    WHERE attendance.date >= ? AND attendance.date < ?
+    GROUP BY attendance.date, attendance.employee_id
+'''
+
+def _build_month_summary(year, month):
+    days, sundays, work_days = month_calendar(year, month)
+    with connect_db() as conn:
+        rows = conn.execute(MONTH_SUMMARY_QUERY, month_range(year, month)).fetchall()
+
+    if not rows:
+        return pd.DataFrame(), pd.DataFrame(), work_days
+
+    employee_ids, names, day_numbers, presence = zip(*rows)
+    employees = sorted(set(zip(names, employee_ids)))
+    position = {employee_id: i for i, (_, employee_id) in enumerate(employees)}
+    matrix = np.zeros((len(employees), len(days)))
+    matrix[[position[employee_id] for employee_id in employee_ids], np.array(day_numbers) - 1] = presence
+
+    # Chỉ hiển thị những ngày đã có chấm công
+    has_entry = np.zeros(len(days), dtype=bool)
+    has_entry[np.array(day_numbers) - 1] = True
+    entry_days = [day for day, entered in zip(days, has_entry) if entered]
+    employee_names = pd.Index([name for name, _ in employees], name='employee_name')
+    pivot_table = pd.DataFrame(matrix[:, has_entry], index=employee_names, columns=entry_days)
+
+    work_days_count = len([day for day in entry_days if day not in sundays])
+    employee_summary = pd.DataFrame({
+        'employee_name': employee_names,
+        'presence': matrix.sum(axis=1),
+        'total_work_days': work_days_count,
+    })
+    return pivot_table, employee_summary, work_days_count
+
+# Bảng chấm công của một tháng: (bảng nhân viên x ngày, tổng ngày công mỗi nhân viên, số ngày công),
+# tính từ một truy vấn tổng hợp và giữ lại cho đến khi dữ liệu chấm công thay đổi
+def get_month_summary(year, month):
+    key = (int(year), int(month))
+    with _month_summaries_lock:
+        summary = _month_summaries.get(key)
+    if summary is None:
+        summary = _build_month_summary(*key)
+        with _month_summaries_lock:
+            _month_summaries[key] = summary
+    return summary
 
 # Hiển thị giao diện nhập thông tin nhân viên
 def display_employee_form():
     st.title("Quản lý Nhân Viên")
 
-    # Tạo bảng nhân viên nếu chưa có
-    create_employee_table()
+    # Tạo các bảng nếu chưa có
+    storage.init_db()
 
     st.header("Nhập thông tin nhân viên")
     employee_name = st.text_input("Tên nhân viên")
@@ -143,11 +214,8 @@ def display_employee_form():
     selected_employee_id = st.selectbox("Chọn nhân viên", employee_ids, format_func=lambda x: dict(employees)[x])
 
     if selected_employee_id:
-        conn = connect_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM employees WHERE employee_id = ?", (selected_employee_id,))
-        employee = cursor.fetchone()
-        conn.close()
+        with connect_db() as conn:
+            employee = conn.execute("SELECT * FROM employees WHERE employee_id = ?", (selected_employee_id,)).fetchone()
 
         if employee:
             new_name = st.text_input("Tên nhân viên", value=employee[1])
@@ -165,17 +233,17 @@ def display_employee_form():
 
     st.header("Danh sách nhân viên")
     employees_df = get_all_employee_info()
-    employees_df['base_salary'] = employees_df['base_salary'].apply(format_currency)
-    employees_df['allowance'] = employees_df['allowance'].apply(format_currency)
-    employees_df['insurance'] = employees_df['insurance'].apply(format_currency)
+    employees_df['base_salary'] = employees_df['base_salary'].apply(formatting.format_currency)
+    employees_df['allowance'] = employees_df['allowance'].apply(formatting.format_currency)
+    employees_df['insurance'] = employees_df['insurance'].apply(formatting.format_currency)
     st.write(employees_df)
 
 # Hiển thị giao diện chấm công
 def display_time_tracking():
     st.title("Chấm Công")
 
-    # Tạo bảng chấm công nếu chưa có
-    create_attendance_table()
+    # Tạo các bảng nếu chưa có
+    storage.init_db()
 
     # Chọn nhân viên
     employees = get_employee_names()
@@ -191,37 +259,22 @@ def display_time_tracking():
     # Hiển thị bảng chấm công của tháng được chọn
     st.header(f"Bảng chấm công tháng {calendar.month_name[selected_month]} năm {selected_year}")
 
-    # Tạo bảng với ngày trong tháng
+    # Ngày trong tháng và các ngày chủ nhật
     start_date = datetime(selected_year, selected_month, 1)
-    end_date = (start_date + timedelta(days=calendar.monthrange(selected_year, selected_month)[1])).replace(day=1) - timedelta(days=1)
-
-    days = [(start_date + timedelta(days=i)).strftime('%d/%m') for i in range((end_date - start_date).days + 1)]
+    days, sundays_str, _ = month_calendar(selected_year, selected_month)
 
-    # Xác định các ngày chủ nhật
-    sundays = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1) if (start_date + timedelta(days=i)).weekday() == 6]
-    sundays_str = [d.strftime('%d/%m') for d in sundays]
+    # Bảng chấm công và tổng số ngày công của tháng
+    pivot_table, employee_summary, work_days_count = get_month_summary(selected_year, selected_month)
 
-    # Lấy dữ liệu chấm công theo tháng
-    month_entries = get_month_entries(str(selected_year), f"{selected_month:02d}")
-
-    # Xử lý dữ liệu chấm công
-    if not month_entries.empty:
-        month_entries['date'] = pd.to_datetime(month_entries['date'])
-        pivot_table = month_entries.pivot(index='employee_name', columns='date', values='presence').fillna(0)
-        pivot_table.columns = [d.strftime('%d/%m') for d in pivot_table.columns]
+    if not pivot_table.empty:
         st.write(pivot_table)
 
         # Tổng số ngày công
-        work_days_count = len([d for d in pivot_table.columns if d not in sundays_str])
-        employee_summary = month_entries.groupby('employee_name')['presence'].sum().reset_index()
-        employee_summary['presence'] = employee_summary['presence'].apply(lambda x: f"{x:.2f}")
-        employee_summary['total_work_days'] = work_days_count
-
+        employee_summary = employee_summary.assign(presence=employee_summary['presence'].map(lambda x: f"{x:.2f}"))
         st.write("Tổng số ngày công:")
         st.write(employee_summary)
     else:
         st.write("Chưa có dữ liệu chấm công cho tháng này.")
-        work_days_count = len([d for d in days if d not in sundays_str])
         st.write("Tổng số ngày công:")
         st.write(pd.DataFrame({'employee_name': [selected_employee_name], 'presence': [0.0], 'total_work_days': [work_days_count]}))
 
@@ -235,8 +288,27 @@ def display_time_tracking():
         data[day] = st.number_input(f"{day}", min_value=0.0, max_value=1.0, step=0.25, value=default_value, format="%.2f")
 
     if st.button("Lưu dữ liệu"):
-        for day in days:
-            date = start_date.replace(day=int(day.split('/')[0])).strftime('%Y-%m-%d')
-            presence = data[day]
-            upsert_attendance(selected_employee_id, date, presence)
-        st.success("Dữ liệu đã được lưu thành công!")
\ No newline at end of file
+        rows = [(selected_employee_id, start_date.replace(day=int(day.split('/')[0])).strftime('%Y-%m-%d'), data[day])
+                for day in days]
+        upsert_attendance_batch(rows)
+        st.success("Dữ liệu đã được lưu thành công!")
+
+    # Nhập bảng chấm công cả tháng cho nhiều nhân viên từ file
+    st.header(f"Nhập bảng chấm công tháng {calendar.month_name[selected_month]} năm {selected_year} từ file")
+    st.write("Cột đầu tiên là tên nhân viên, mỗi cột tiếp theo là một ngày trong tháng (dd/mm hoặc số ngày).")
+    uploaded_file = st.file_uploader("Chọn file CSV hoặc Excel", type=['csv', 'xlsx', 'xls'])
+    if uploaded_file is not None and st.button("Nhập từ file"):
+        try:
+            grid = read_attendance_grid(uploaded_file)
+        except ImportError as e:
+            st.error(f"Không đọc được file Excel (cần cài openpyxl cho .xlsx, xlrd cho .xls): {e}")
+        except Exception as e:
+            st.error(f"Không đọc được file: {e}")
+        else:
+            rows, unknown_employees, unknown_columns = grid_to_attendance_rows(grid, selected_year, selected_month, employee_dict)
+            saved = upsert_attendance_batch(rows)
+            st.success(f"Đã lưu {saved} dòng chấm công!")
+            if unknown_employees:
+                st.warning(f"Không tìm thấy nhân viên: {', '.join(unknown_employees)}")
+            if unknown_columns:
+                st.warning(f"Bỏ qua các cột không phải ngày trong tháng: {', '.join(unknown_columns)}")
@@ -0,0 +1,187 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import data_prepare
+import filter_index
+import snapshot
+
+# Benchmarks for the delivery data hot paths: python bench_data_prepare.py [rows]
+
+
+def synthetic_dates(rows, seed=0):
+    """ d/m/Y and d/m/y strings mixed the way the sheets mix them, plus a few broken values """
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 5 * 365, rows), unit='D')
+    long_year = pd.Series(dates.strftime('%-d/%-m/%Y'))
+    short_year = pd.Series(dates.strftime('%d/%m/%y'))
+    values = long_year.where(rng.random(rows) < 0.5, short_year)
+    values[rng.random(rows) < 0.001] = 'không rõ'
+    return values
+
+
+def parse_dates_multi_pass(values):
+    """ the previous implementation: one full pd.to_datetime pass per format """
+    parsed = values.astype(str)
+    for fmt in ['%d/%m/%Y', '%d/%m/%y']:
+        parsed = pd.to_datetime(parsed, format=fmt, errors='coerce')
+        if parsed.notna().all():
+            break
+    return parsed
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_dates(rows):
+    values = synthetic_dates(rows)
+    old, old_seconds = timed(parse_dates_multi_pass, values)
+    (new, unparsed), new_seconds = timed(data_prepare.parse_dates, values)
+    print(f"{rows:,} rows")
+    print(f"  multi-pass  : {old_seconds:.3f}s, {old.notna().sum():,} dates parsed")
+    print(f"  single-pass : {new_seconds:.3f}s, {new.notna().sum():,} dates parsed, {unparsed:,} unparsed")
+
+
+def synthetic_deliveries(rows, seed=0):
+    """ a truck-like delivery frame with the compact types of data_prepare.apply_schema """
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'Ngày': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 5 * 365, rows), unit='D'),
+        'Khách hàng ( Hoặc số địa chỉ)': [f'KH {i}' for i in rng.integers(0, 2000, rows)],
+        'Loại sản phẩm': rng.choice(['A350', 'A500', 'A1_5', 'O350', 'NV', 'PN'], rows),
+        'Loại bình': rng.choice(['19L', '20L'], rows),
+        'Số lượng Giao': rng.integers(0, 50, rows),
+        'Vỏ về': rng.integers(0, 50, rows),
+        'Thanh Toán': rng.choice([0, 50000, 120000, 500000], rows),
+        'Phương Thức Thanh Toán': rng.choice(['Tiền mặt', 'Chuyển khoản', 'Nợ'], rows),
+        'Người chở 1': rng.choice(['Hùng', 'Dũng', 'Nam', 'Tuấn'], rows),
+        'Người chở 2': rng.choice(['Hùng', 'Dũng', 'Nam', 'Tuấn', None], rows),
+    }).sort_values('Ngày', ascending=False, ignore_index=True)
+    return data_prepare.apply_schema(data)
+
+
+def bench_filters(rows):
+    data = synthetic_deliveries(rows)
+    columns = ['Khách hàng ( Hoặc số địa chỉ)', 'Loại sản phẩm', 'Loại bình', 'Phương Thức Thanh Toán',
+               'Người chở 1', 'Người chở 2']
+    index, build_seconds = timed(filter_index.FilterIndex, data, columns)
+    date_range = (pd.Timestamp('2022-01-01'), pd.Timestamp('2022-12-31'))
+    filters = {'Loại sản phẩm': ['A350', 'NV'], 'Phương Thức Thanh Toán': ['Nợ'], 'Người chở 1': ['Hùng', 'Nam']}
+
+    def chained_masks():
+        filtered = data[(data['Ngày'] >= date_range[0]) & (data['Ngày'] <= date_range[1])]
+        for column, selected in filters.items():
+            filtered = filtered[filtered[column].isin(selected)]
+        return filtered
+
+    expected, mask_seconds = timed(chained_masks)
+    rows_found, index_seconds = timed(index.rows, date_range, filters)
+    customer, customer_seconds = timed(index.rows, None, {'Khách hàng ( Hoặc số địa chỉ)': ['KH 7']})
+    assert np.array_equal(rows_found, expected.index.to_numpy())
+    print(f"{rows:,} rows, index built in {build_seconds:.3f}s")
+    print(f"  chained masks : {mask_seconds * 1000:.1f}ms")
+    print(f"  filter index  : {index_seconds * 1000:.1f}ms for {len(rows_found):,} rows, "
+          f"{customer_seconds * 1000:.2f}ms for one customer ({len(customer):,} rows)")
+
+
+def bench_snapshot(rows):
+    data = synthetic_deliveries(rows)
+    if not snapshot.available():
+        print("snapshot: pyarrow is not installed")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'deliveries.csv')
+        data.to_csv(csv_path, index=False)
+        _, write_seconds = timed(snapshot.write_snapshot, 'bench', {'deliveries': data}, directory)
+        from_csv, csv_seconds = timed(lambda: data_prepare.apply_schema(pd.read_csv(csv_path, parse_dates=['Ngày'])))
+        frames, snapshot_seconds = timed(snapshot.read_snapshot, 'bench', ['deliveries'], directory)
+        size = os.path.getsize(snapshot.snapshot_path('bench', 'deliveries', directory))
+    assert frames['deliveries'].equals(data)
+    print(f"{rows:,} rows, snapshot of {size / 1e6:.1f} MB written in {write_seconds:.3f}s")
+    print(f"  csv + schema  : {csv_seconds:.3f}s")
+    print(f"  snapshot      : {snapshot_seconds:.3f}s")
+
+
+def synthetic_moto_csv(path, rows, seed=0):
+    """ a motorbike delivery sheet as the sheets export it: text dates, street names and blank payments """
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        'Ngày': synthetic_dates(rows, seed),
+        'Khách hàng ( Hoặc số địa chỉ)': [f'{i}/{j}' for i, j in zip(rng.integers(1, 400, rows), rng.integers(1, 5, rows))],
+        'Tên đường': rng.choice(['Lê Lợi', 'Nguyễn Huệ', 'Trần Phú', 'Hai Bà Trưng'], rows),
+        'Loại sản phẩm': rng.choice(['A350', 'A500', 'A1_5', 'O350', 'NV'], rows),
+        'Số lượng Giao': rng.integers(0, 50, rows),
+        'Vỏ về': rng.integers(0, 50, rows),
+        'Thanh Toán': np.where(rng.random(rows) < 0.5, '', rng.choice(['50,000', '120000', '500000'], rows)),
+        'Phương Thức Thanh Toán': rng.choice(['Tiền mặt', 'Chuyển khoản', 'Nợ'], rows),
+    }).to_csv(path, index=False)
+
+
+# Run in a fresh process so the peak is that of one step only. The anonymous resident memory is sampled
+# because the database is read through a memory map (db.py), whose file pages also count in VmRSS.
+INGEST_SCRIPT = """
+import re, sys, threading, time, urllib.request
+import pandas as pd
+import data_prepare
+peak_kb = 0
+def sample():
+    global peak_kb
+    while True:
+        status = open('/proc/self/status').read()
+        peak_kb = max(peak_kb, int(re.search(r'RssAnon:\\s+(\\d+)', status).group(1)))
+        time.sleep(0.01)
+threading.Thread(target=sample, daemon=True).start()
+started = time.perf_counter()
+if sys.argv[1] == 'whole':
+    # The sheet parsed in one piece and given the compact types afterwards, as before the chunked sync
+    with urllib.request.urlopen(sys.argv[2]) as response:
+        moto, _ = data_prepare.normalize_dates(pd.read_csv(response))
+    moto = data_prepare.add_customer_label(moto)
+    moto = data_prepare.apply_schema(moto.dropna(subset=['Ngày']).sort_values(by='Ngày', ascending=False, ignore_index=True))
+    rows = len(moto)
+elif sys.argv[1] == 'sync':
+    rows = data_prepare.sync_sheets([sys.argv[2]], [])[sys.argv[2]]['rows']
+else:
+    moto, _ = data_prepare.load_from_store([sys.argv[2]], [])
+    rows = len(moto)
+print(rows, time.perf_counter() - started, peak_kb)
+"""
+
+# Row counts of the ingestion sweep, as fractions of the rows given on the command line
+INGEST_FRACTIONS = (0.05, 0.2, 0.6, 1.0)
+
+
+def bench_ingest(row_counts):
+    """ time and peak memory of each ingestion step against the length of the sheet. The sync (download,
+    chunked store, KPIs and ledger) levels off once the SQLite page caches are full; loading the stored rows
+    back grows with them, as the frame it builds does. """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    steps = (('whole', 'whole sheet'), ('sync', 'first sync'), ('sync', 'resync'), ('load', 'load store'))
+    print(f"{'rows':>10} {'sheet':>8}" + ''.join(f" {label:>20}" for _, label in steps))
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'moto.csv')
+            synthetic_moto_csv(csv_path, rows)
+            cells = []
+            # The resync finds every chunk already stored, as a refresh of an unchanged sheet does
+            for mode, _ in steps:
+                result = subprocess.run([sys.executable, '-c', INGEST_SCRIPT, mode, 'file://' + csv_path],
+                                        cwd=directory, env={**os.environ, 'PYTHONPATH': repo},
+                                        capture_output=True, text=True, check=True)
+                _, seconds, peak_kb = result.stdout.split()[-3:]
+                cells.append(f"{float(seconds):7.2f}s {int(peak_kb) / 1024:7.0f} MB")
+            print(f"{rows:>10,} {os.path.getsize(csv_path) / 1e6:6.1f}MB" + ''.join(f" {cell:>20}" for cell in cells))
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bench_dates(rows)
+    bench_filters(rows * 3)
+    bench_snapshot(rows)
+    bench_ingest([int(rows * fraction) for fraction in INGEST_FRACTIONS])
@@ -1,146 +1,128 @@
 import pandas as pd
-import sqlite3
+import numpy as np
 from datetime import datetime
 import streamlit as st
+import customers
+import formatting
+import storage
 
-# Database Setup
-def create_and_init_db():
-    conn = sqlite3.connect('customer_pricing.db')
-    cursor = conn.cursor()
-
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            customer_id INTEGER PRIMARY KEY,
-            customer_name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY,
-            product_name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prices (
-            price_id INTEGER PRIMARY KEY,
-            customer_id INTEGER,
-            product_name TEXT,
-            price REAL,
-            last_updated TIMESTAMP,
-            FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
-            UNIQUE (customer_id, product_name)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inventory (
-            product_id INTEGER PRIMARY KEY,
-            quantity INTEGER,
-            FOREIGN KEY (product_id) REFERENCES products (product_id)
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-# Initialize the database
-create_and_init_db()
-
-# Database Connection
-def create_db_connection(db_name='customer_pricing.db'):
-    try:
-        conn = sqlite3.connect(db_name)
-        print("Database connection successful")
-        return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
+# Database Connection (borrowed from the shared pool until the with block ends)
+def create_db_connection():
+    return storage.connection()
 
 def get_customers():
-    conn = create_db_connection()
-    df = pd.read_sql_query('SELECT * FROM customers', conn)
-    conn.close()
-    return df
+    with create_db_connection() as conn:
+        return pd.read_sql_query('SELECT * FROM customers', conn)
 
 def get_products():
-    conn = create_db_connection('delivery_data.db')
-    df = pd.read_sql_query('SELECT * FROM products', conn)
-    conn.close()
-    return df
+    with create_db_connection() as conn:
+        return pd.read_sql_query('SELECT * FROM products', conn)
 
 def get_prices():
-    conn = create_db_connection()
-    prices_df = pd.read_sql_query('''
-        SELECT pr.product_name, c.customer_name, pr.price, pr.last_updated
-        FROM prices pr
-        JOIN customers c ON pr.customer_id = c.customer_id
-    ''', conn)
-    conn.close()
-    return prices_df
-
-def insert_or_update_price(customer_name, product_name, price):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    # Check if customer exists
-    customer_id = cursor.execute('SELECT customer_id FROM customers WHERE customer_name = ?', (customer_name,)).fetchone()
-
-    if customer_id:
-        customer_id = customer_id[0]
-
-        # Insert or update price
-        cursor.execute('''
-            INSERT INTO prices (customer_id, product_name, price, last_updated)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(customer_id, product_name) DO UPDATE SET
-            price = excluded.price,
-            last_updated = excluded.last_updated
-        ''', (customer_id, product_name, price, datetime.now()))
-
-        conn.commit()
-        st.success(f"Price updated successfully for customer '{customer_name}' and product '{product_name}'.")
-    else:
+    with create_db_connection() as conn:
+        return pd.read_sql_query('''
+            SELECT p.product_name, c.customer_name, pr.price, pr.last_updated
+            FROM prices pr
+            JOIN customers c ON pr.customer_id = c.customer_id
+            JOIN products p ON pr.product_id = p.product_id
+        ''', conn)
+
+def get_price_history():
+    with create_db_connection() as conn:
+        return pd.read_sql_query('''
+            SELECT p.product_name, c.customer_name, h.effective_from, h.price, h.recorded_at
+            FROM price_history h
+            JOIN customers c ON h.customer_id = c.customer_id
+            JOIN products p ON h.product_id = p.product_id
+            ORDER BY c.customer_name, p.product_name, h.effective_from
+        ''', conn)
+
+# Record the price of a product for a customer from effective_from ('YYYY-MM-DD', today by default) on.
+# Earlier prices stay in price_history for the deliveries before that date; the prices view shows the one in effect today.
+def insert_or_update_price(customer_name, product_name, price, effective_from=None):
+    effective_from = effective_from or datetime.now().strftime('%Y-%m-%d')
+    written = 0
+    with storage.transaction() as conn:
+        cursor = conn.cursor()
+
+        # Check if customer exists
+        customer_id = cursor.execute('SELECT customer_id FROM customers WHERE customer_name = ?', (customer_name,)).fetchone()
+
+        if customer_id:
+            customer_id = customer_id[0]
+            now = datetime.now()
+
+            # Nothing is written when the product does not exist
+            written = cursor.execute('''
+                INSERT INTO price_history (customer_id, product_id, effective_from, price, recorded_at)
+                SELECT ?, product_id, ?, ?, ? FROM products WHERE product_name = ?
+                ON CONFLICT(customer_id, product_id, effective_from) DO UPDATE SET
+                price = excluded.price,
+                recorded_at = excluded.recorded_at
+            ''', (customer_id, effective_from, price, now, product_name)).rowcount
+
+    if not customer_id:
         st.error(f"Customer not found. Customer ID: {customer_id}")
-    
-    conn.close()
+    elif not written:
+        st.error(f"Product '{product_name}' not found.")
+    else:
+        st.success(f"Price updated successfully for customer '{customer_name}' and product '{product_name}'.")
+
+# Price of every delivery on its own date: the latest price_history row of its customer (the one its customer
+# name is an alias of) and product with effective_from on or before the delivery date (NaN when there is none).
+# Returns a Series aligned with deliveries.
+def price_deliveries(deliveries, customer_column='Khách hàng', product_column='Loại sản phẩm', date_column='Ngày'):
+    history = get_price_history()
+    # Prices from before the history existed start at '0001-01-01', earlier than any Timestamp
+    history['effective_from'] = pd.to_datetime(history['effective_from'], format='%Y-%m-%d', errors='coerce').fillna(pd.Timestamp.min)
+
+    names = deliveries[customer_column].astype(object)
+    keys = pd.DataFrame({
+        'customer_name': names.map(customers.resolve_names(names)).astype(object),
+        'product_name': deliveries[product_column].astype(object),
+        'date': pd.to_datetime(deliveries[date_column]),
+        'position': np.arange(len(deliveries)),
+    })
+    keys = keys[keys['date'].notna()].sort_values('date', kind='stable')
+    priced = pd.merge_asof(keys, history[['customer_name', 'product_name', 'effective_from', 'price']].sort_values('effective_from'),
+                           left_on='date', right_on='effective_from', by=['customer_name', 'product_name'],
+                           direction='backward')
+
+    prices = np.full(len(deliveries), np.nan)
+    prices[priced['position'].to_numpy()] = priced['price'].to_numpy(dtype=float)
+    return pd.Series(prices, index=deliveries.index, name='price')
+
+# Deliveries of one customer, under any name that is an alias of it, with their price and amount as of their date
+def customer_deliveries(xe_may_df, oto_df, customer_name):
+    frames = []
+    for data, customer_column in ((xe_may_df, 'Khách hàng'), (oto_df, 'Khách hàng ( Hoặc số địa chỉ)')):
+        names = [name for name, customer in customers.resolve_names(data[customer_column].unique()).items()
+                 if customer == customer_name]
+        deliveries = data.loc[data[customer_column].isin(names), ['Ngày', customer_column, 'Loại sản phẩm', 'Số lượng Giao']]
+        frames.append(deliveries.rename(columns={customer_column: 'Khách hàng'})
+                      .astype({'Khách hàng': object, 'Loại sản phẩm': object, 'Số lượng Giao': float}))
+    deliveries = pd.concat(frames, ignore_index=True).sort_values('Ngày', ascending=False, ignore_index=True)
+    deliveries['price'] = price_deliveries(deliveries)
+    deliveries['amount'] = deliveries['Số lượng Giao'] * deliveries['price']
+    return deliveries
 
 def load_and_process_data(xe_may_df, oto_df):
     # Check input data types
     if not isinstance(xe_may_df, pd.DataFrame) or not isinstance(oto_df, pd.DataFrame):
         raise ValueError("Input data must be pandas DataFrame.")
-    
-    # Process data
-    if 'Khách hàng ( Hoặc số địa chỉ)' in xe_may_df.columns and 'Tên đường' in xe_may_df.columns:
-        xe_may_df['Khách hàng'] = xe_may_df['Khách hàng ( Hoặc số địa chỉ)'] + ' - ' + xe_may_df['Tên đường']
-    else:
-        raise KeyError("Required columns are missing in xe_may_df.")
 
-    if 'Khách hàng ( Hoặc số địa chỉ)' in oto_df.columns:
-        oto_df['Khách hàng'] = oto_df['Khách hàng ( Hoặc số địa chỉ)']
-    else:
+    if 'Khách hàng ( Hoặc số địa chỉ)' not in xe_may_df.columns or 'Tên đường' not in xe_may_df.columns:
+        raise KeyError("Required columns are missing in xe_may_df.")
+    if 'Khách hàng ( Hoặc số địa chỉ)' not in oto_df.columns:
         raise KeyError("Required columns are missing in oto_df.")
 
-    # Combine data
-    combined_df = pd.concat([xe_may_df[['Khách hàng']], oto_df[['Khách hàng']]])
-
-    # Remove duplicates and save to database
-    unique_customers = combined_df['Khách hàng'].unique()
-
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    for customer in unique_customers:
-        cursor.execute('INSERT OR IGNORE INTO customers (customer_name) VALUES (?)', (customer,))
-    
-    conn.commit()
-    conn.close()
+    # Add the customers not known yet (nothing to do while the data is unchanged)
+    customers.sync_customers(customers.customer_labels(xe_may_df, oto_df))
 
 def run_pricing_app(xe_may_df, oto_df):
     st.title("Customer Pricing Management")
 
-    # Load products from delivery_data.db
+    # Load products
     products_df = get_products()
     print("Products DataFrame:")
     print(products_df)
@@ -168,10 +150,10 @@ def run_pricing_app(xe_may_df, oto_df):
         return
     
     new_price = st.number_input("Enter Price", min_value=0.0, format="%.2f")
+    effective_from = st.date_input("Effective From", value=datetime.now())
 
     if st.button("Update Price"):
-        insert_or_update_price(selected_customer, selected_product, new_price)
-        st.success(f"Price for customer '{selected_customer}' and product '{selected_product}' updated successfully")
+        insert_or_update_price(selected_customer, selected_product, new_price, effective_from.strftime('%Y-%m-%d'))
 
     # Filters
     st.subheader("Filter Prices")
@@ -192,3 +174,24 @@ def run_pricing_app(xe_may_df, oto_df):
     else:
         st.write(prices_df)
 
+    # What the selected customer's deliveries come to at the price of their own date
+    st.subheader("Priced Deliveries")
+    if filter_customer == 'All':
+        st.write("Select a customer to see its deliveries priced as of their date.")
+    else:
+        deliveries = customer_deliveries(xe_may_df, oto_df, filter_customer)
+        if filter_product != 'All':
+            deliveries = deliveries[deliveries['Loại sản phẩm'] == filter_product]
+        st.metric("Total Amount", formatting.format_currency(deliveries['amount'].sum()))
+        if deliveries['price'].isna().any():
+            st.warning("Some deliveries have no price for their date and are not included in the total.")
+        st.write(deliveries)
+
+    # Every dated price of the selected customer and product
+    st.subheader("Price History")
+    history_df = get_price_history()
+    if filter_customer != 'All':
+        history_df = history_df[history_df['customer_name'] == filter_customer]
+    if filter_product != 'All':
+        history_df = history_df[history_df['product_name'] == filter_product]
+    st.write(history_df)
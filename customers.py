@@ -0,0 +1,99 @@
+import hashlib
+import json
+import threading
+import unicodedata
+import pandas as pd
+import frame_cache
+import storage
+
+# Customer master shared by the pricing and inventory pages. Names from the delivery sheets are matched on
+# a normalized key (no diacritics, case or repeated whitespace), so the spelling variants of one customer
+# all point to the same customers row through customer_aliases instead of being stored as new customers.
+
+# Digest of the last set of names synced by this process
+_synced_digest = None
+_sync_lock = threading.Lock()
+
+
+def normalize_name(name):
+    """ the key customer names are matched on: 'Chị  Lan - Lê Lợi ' and 'chi lan - le loi' give the same key """
+    decomposed = unicodedata.normalize('NFKD', str(name).replace('đ', 'd').replace('Đ', 'D'))
+    return ' '.join(''.join(ch for ch in decomposed if not unicodedata.combining(ch)).split()).casefold()
+
+
+def customer_join(name_sql, customer='c'):
+    """ SQL joining the customers row (as customer) that the delivery sheet name name_sql is an alias of;
+    its columns are NULL when the name has not been synced yet. Receivables and prices resolve names through it. """
+    return (f'LEFT JOIN customer_aliases {customer}_alias ON {customer}_alias.alias = {name_sql} '
+            f'LEFT JOIN customers {customer} ON {customer}.customer_id = {customer}_alias.customer_id')
+
+
+def resolve_names(names):
+    """ {name: customer name} for names from the delivery sheets; a name that has not been synced yet
+    resolves to itself """
+    names = [str(name) for name in pd.unique(pd.Series(names, dtype=object).dropna())]
+    with storage.connection() as conn:
+        resolved = dict(conn.execute(f'SELECT n.value, c.customer_name FROM json_each(?) n {customer_join("n.value")}',
+                                     (json.dumps(names),)))
+    return {name: resolved.get(name) or name for name in names}
+
+
+def _display_name(name):
+    return ' '.join(str(name).split())
+
+
+def _frame_labels(data, source):
+    if source == 'moto':
+        labels = data['Khách hàng'] if 'Khách hàng' in data.columns else \
+            data['Khách hàng ( Hoặc số địa chỉ)'].astype(object) + ' - ' + data['Tên đường'].astype(object)
+    else:
+        labels = data['Khách hàng ( Hoặc số địa chỉ)']
+    return pd.unique(labels.astype(object).dropna())
+
+
+def customer_labels(moto_data, truck_data):
+    """ the distinct customer names of the delivery frames, as receivables and prices use them:
+    '<customer> - <street>' for motorbike deliveries, the customer alone for truck deliveries """
+    moto = frame_cache.get_or_build(moto_data, 'customer_labels', lambda: _frame_labels(moto_data, 'moto'))
+    truck = frame_cache.get_or_build(truck_data, 'customer_labels', lambda: _frame_labels(truck_data, 'truck'))
+    return pd.unique(pd.Series([*moto, *truck], dtype=object))
+
+
+def sync_customers(names):
+    """ add the names not seen before: a new customer when no existing customer has the same normalized
+    name, otherwise an alias of that customer. Skipped when names are the same as the last call.
+    Returns the number of customers added. """
+    global _synced_digest
+    names = [str(name) for name in names]
+    digest = hashlib.sha1('\n'.join(sorted(names)).encode()).hexdigest()
+    with _sync_lock:
+        if digest == _synced_digest:
+            return 0
+
+    with storage.transaction() as conn:
+        known = {alias for (alias,) in conn.execute('SELECT alias FROM customer_aliases')}
+        new_names = [name for name in names if name not in known]
+        added = []
+        if new_names:
+            # The first customer with a key keeps it
+            customer_ids = {}
+            for customer_id, customer_name in conn.execute('SELECT customer_id, customer_name FROM customers ORDER BY customer_id'):
+                customer_ids.setdefault(normalize_name(customer_name), customer_id)
+            keys = {name: normalize_name(name) for name in new_names}
+            # A new customer is stored under the first spelling of it in names
+            new_customers = {}
+            for name, key in keys.items():
+                if key not in customer_ids:
+                    new_customers.setdefault(key, _display_name(name))
+            added = list(new_customers.values())
+            conn.executemany('INSERT OR IGNORE INTO customers (customer_name) VALUES (?)', [(name,) for name in added])
+            if added:
+                for customer_id, customer_name in conn.execute(
+                        f"SELECT customer_id, customer_name FROM customers WHERE customer_name IN ({', '.join('?' * len(added))})", added):
+                    customer_ids.setdefault(normalize_name(customer_name), customer_id)
+            conn.executemany('INSERT OR IGNORE INTO customer_aliases (alias, customer_id) VALUES (?, ?)',
+                             [(name, customer_ids[key]) for name, key in keys.items()])
+
+    with _sync_lock:
+        _synced_digest = digest
+    return len(added)
@@ -1,81 +1,399 @@
-import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
+import functools
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import delivery_store
+import snapshot
+import kpis
+import ledger
 
+# How long (in seconds) a loaded copy of the sheets is served before it is considered stale
+CACHE_TTL_SECONDS = 300
 
-def load_data_from_urls_moto(urls_moto):
-    dataframes = []
-    for url in urls_moto:
+# Network settings for downloading a published sheet
+FETCH_TIMEOUT_SECONDS = 30
+FETCH_RETRIES = 3
+FETCH_BACKOFF_SECONDS = 1.0
+FETCH_MAX_WORKERS = 8
+# A download is kept in memory up to this size and spooled to a temporary file beyond it
+DOWNLOAD_SPOOL_BYTES = 8 * 1024 * 1024
+# Rows parsed and stored at a time when a sheet is synced, and read at a time from the store
+CHUNK_ROWS = 50_000
+
+# Loaded datasets keyed by loader and URLs: {'data': ..., 'loaded_at': ..., 'refreshing': ...}
+_cache = {}
+_cache_lock = threading.Lock()
+# One lock per key, held by whichever loader runs for it, in the foreground or in the background
+_load_locks = {}
+# Bumped by invalidate_cache so that a refresh started before the invalidation is discarded
+_cache_generation = 0
+# Keys whose initial copy was already tried; it is only served on the first load of a key, not after invalidate_cache
+_initial_tried = set()
+
+
+def download(url, timeout=FETCH_TIMEOUT_SECONDS, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF_SECONDS):
+    """ download one published sheet into a temporary file, retrying network errors with exponential backoff.
+    The file stays in memory while it is small and moves to disk beyond DOWNLOAD_SPOOL_BYTES.
+    Returns (file positioned at its start, number of attempts); the caller closes the file. """
+    attempt = 0
+    while True:
+        attempt += 1
+        content = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES)
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                shutil.copyfileobj(response, content)
+            content.seek(0)
+            return content, attempt
+        except urllib.error.HTTPError as e:
+            content.close()
+            # Client errors (bad link, unpublished sheet) will not fix themselves
+            if e.code < 500 or attempt > retries:
+                raise
+        except OSError:
+            content.close()
+            if attempt > retries:
+                raise
+        time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def download_all(urls, timeout=FETCH_TIMEOUT_SECONDS, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF_SECONDS):
+    """ download every URL at the same time without parsing it.
+    Returns ({url: file} for the sheets that downloaded, {url: report}) where each report holds
+    'ok', 'rows', 'attempts', 'seconds' and 'error'; 'rows' is None until the sheet is read. """
+    def run(url):
+        started = time.time()
         try:
-            df = pd.read_csv(url, sep=',', header=0)
-            
-            # Convert the date column to string first
-            df['Ngày'] = df['Ngày'].astype(str)
-            
-            # Try multiple date formats
-            date_formats = ['%d/%m/%Y', '%d/%m/%y']
-            for fmt in date_formats:
-                df['Ngày'] = pd.to_datetime(df['Ngày'], format=fmt, errors='coerce')
-                if df['Ngày'].notna().all():
-                    break
-            
-            # Combine customer and street name
-            df['Khách hàng'] = df['Khách hàng ( Hoặc số địa chỉ)'] + ' - ' + df['Tên đường']
-            
-            dataframes.append(df)
+            content, attempts = download(url, timeout, retries, backoff)
+            return url, content, {'ok': True, 'rows': None, 'attempts': attempts,
+                                  'seconds': time.time() - started, 'error': None}
         except Exception as e:
-            print(f"Error loading data from {url}: {e}")
-    
-    combined_data = pd.concat(dataframes,ignore_index=True)
-    combined_data.dropna(subset=['Ngày'], inplace=True)
-    combined_data.reset_index(drop=True, inplace=True)  
-    combined_data = combined_data.sort_values(by='Ngày', ascending=False).reset_index(drop=True)
-    # Check for missing dates and handle them
-    missing_dates = combined_data['Ngày'].isna().sum()
-    if missing_dates > 0:
-        print(f"Warning: {missing_dates} rows have missing or improperly formatted dates.")
-        # Investigate rows with missing dates
-        missing_date_rows = combined_data[combined_data['Ngày'].isna()]
-        print("Rows with missing dates:")
-        print(missing_date_rows)
-        
-        # Optionally fill missing dates with a specific value or handle them as needed
-        # combined_data['Ngày'].fillna(pd.Timestamp('1900-01-01'), inplace=True)
-    print(combined_data)
-    return combined_data
-
-
-def load_data_from_urls_truck(urls_truck):
-    dataframes = []
-    for url in urls_truck:
+            return url, None, {'ok': False, 'rows': 0, 'attempts': None,
+                               'seconds': time.time() - started, 'error': str(e)}
+
+    downloads = {}
+    report = {}
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return downloads, report
+    with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(unique_urls))) as executor:
+        for url, content, url_report in executor.map(run, unique_urls):
+            report[url] = url_report
+            if content is not None:
+                downloads[url] = content
+    return downloads, report
+
+
+def parse_dates(values):
+    """ parse day/month/year text where the year may have four or two digits (5/10/2023, 05/10/23).
+    Delivery dates repeat a lot, so only the distinct strings are parsed: the format of each one is
+    picked from the length of its year part and every group is parsed exactly once.
+    Returns (datetime Series, number of non-empty values that could not be parsed). """
+    codes, uniques = pd.factorize(values.astype(str).str.strip())
+    text = pd.Series(uniques)
+    year_length = text.str.len() - text.str.rfind('/') - 1
+
+    parsed = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    for length, fmt in ((4, '%d/%m/%Y'), (2, '%d/%m/%y')):
+        mask = (year_length == length).to_numpy()
+        if mask.any():
+            parsed[mask] = pd.to_datetime(text[mask], format=fmt, errors='coerce')
+
+    dates = pd.Series(parsed.to_numpy()[codes], index=values.index)
+    unparsed = int((dates.isna() & values.notna() & (text.to_numpy()[codes] != '')).sum())
+    return dates, unparsed
+
+
+def normalize_dates(df):
+    """ (df with the 'Ngày' text replaced by datetimes, number of rows whose date could not be parsed) """
+    dates, unparsed = parse_dates(df['Ngày'])
+    if unparsed > 0:
+        print(f"Warning: {unparsed} rows have improperly formatted dates.")
+    return df.assign(**{'Ngày': dates}), unparsed
+
+
+def add_customer_label(moto_data):
+    # Combine customer and street name
+    return moto_data.assign(**{'Khách hàng': moto_data['Khách hàng ( Hoặc số địa chỉ)'] + ' - ' + moto_data['Tên đường']})
+
+
+# Compact in-memory types of the delivery frames
+CATEGORY_COLUMNS = ['Khách hàng', 'Khách hàng ( Hoặc số địa chỉ)', 'Tên đường', 'Loại sản phẩm', 'Loại bình',
+                    'Phương Thức Thanh Toán', 'Người chở 1', 'Người chở 2']
+QUANTITY_COLUMNS = ['Số lượng Giao', 'Vỏ về']
+MONEY_COLUMNS = ['Thanh Toán']
+# Version of the frames apply_schema and load_from_store build; bump it when their columns or types change,
+# so that the snapshots of the older frames are not read back
+SCHEMA_VERSION = 1
+
+
+def _to_quantity(values):
+    numbers = pd.to_numeric(values, errors='coerce')
+    present = numbers.dropna()
+    if (present % 1 != 0).any():
+        # Fractional quantities cannot be stored as integers
+        return numbers.astype('float64')
+    if present.empty or present.abs().max() < 2 ** 15:
+        return numbers.astype('Int16')
+    return numbers.astype('Int32')
+
+
+def _to_money(values):
+    if values.dtype == object:
+        # Amounts typed with thousands separators, e.g. 120,000
+        values = values.str.replace(r'[,\s]', '', regex=True)
+    return pd.to_numeric(values, errors='coerce').astype('float64')
+
+
+def apply_schema(df):
+    """ cast low-cardinality text to category, quantities to small nullable integers and money to float64 """
+    columns = {}
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            columns[column] = df[column].astype('category')
+        elif column in QUANTITY_COLUMNS:
+            columns[column] = _to_quantity(df[column])
+        elif column in MONEY_COLUMNS:
+            columns[column] = _to_money(df[column])
+        else:
+            columns[column] = df[column]
+    return pd.DataFrame(columns, index=df.index)
+
+
+def read_sheet_chunks(content):
+    """ the rows of a downloaded sheet as text, CHUNK_ROWS rows at a time """
+    return pd.read_csv(content, sep=',', header=0, dtype=str, chunksize=CHUNK_ROWS)
+
+
+def prepare_sheet_chunk(chunk, url_report):
+    """ a chunk from read_sheet_chunks with its dates parsed and only the columns of the sheet itself (columns
+    derived from them are added when the data is read from the store). The quantity and money columns are
+    converted to float64, so all chunks have the same types whatever their values. Only money may carry
+    thousands separators; a quantity that is not a plain number is left missing. Unparsed dates are added
+    to url_report['unparsed_dates']. """
+    numbers = {column: pd.to_numeric(chunk[column], errors='coerce').astype('float64')
+               for column in QUANTITY_COLUMNS if column in chunk.columns}
+    numbers.update({column: _to_money(chunk[column]) for column in MONEY_COLUMNS if column in chunk.columns})
+    chunk, unparsed = normalize_dates(chunk.assign(**numbers))
+    url_report['unparsed_dates'] += unparsed
+    return chunk
+
+
+def _print_failures(report):
+    for url, url_report in report.items():
+        if not url_report['ok']:
+            print(f"Error loading data from {url}: {url_report['error']}")
+
+
+def concat_compact(frames):
+    """ pd.concat of frames returned by apply_schema. Category columns are combined with union_categoricals,
+    so they stay categories when the frames have different categories. """
+    if len(frames) == 1:
+        return frames[0]
+    columns = {}
+    for column in frames[0].columns:
+        parts = [frame[column] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[column] = pd.Series(union_categoricals(parts), name=column)
+        else:
+            columns[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _load_compact(source, urls, name, prepare=None):
+    """ the stored rows of one source read CHUNK_ROWS at a time, each chunk given the compact types before
+    the next is read """
+    chunks = []
+    for chunk in delivery_store.iter_orders(source, urls, CHUNK_ROWS):
+        if prepare is not None:
+            chunk = prepare(chunk)
+        chunks.append(apply_schema(chunk))
+    data = concat_compact(chunks)
+    # Only the compact frame is measured: measuring the text chunks as well made the load about 15% slower
+    print(f"Memory {name}: {data.memory_usage(index=False, deep=True).sum() / 1e6:.2f} MB")
+    return data
+
+
+def load_from_store(urls_moto, urls_truck):
+    """ (moto DataFrame, truck DataFrame) read from the local Orders copy of the given sheets """
+    return (_load_compact('moto', urls_moto, 'moto', add_customer_label),
+            _load_compact('truck', urls_truck, 'truck'))
+
+
+def sync_sheets(urls_moto, urls_truck, timeout=FETCH_TIMEOUT_SECONDS, retries=FETCH_RETRIES,
+                backoff=FETCH_BACKOFF_SECONDS):
+    """ download every sheet and write only the changed rows into the local store, then bring the analytics
+    KPIs and the receivables ledger up to date with them. Each sheet is read and stored CHUNK_ROWS rows at a
+    time, so memory use while syncing does not grow with the length of the sheet, and only the chunks that
+    changed since the last sync are prepared. A sheet that fails to download keeps its last synced rows.
+    Returns {url: report}; the report of a synced sheet also carries 'unparsed_dates' (in the chunks that
+    changed) and the 'inserted', 'updated', 'deleted', 'skipped' and 'rows' results of
+    delivery_store.sync_sheet_chunks. """
+    delivery_store.init_store()
+    downloads, report = download_all(list(urls_moto) + list(urls_truck), timeout, retries, backoff)
+    try:
+        for source, urls in (('moto', urls_moto), ('truck', urls_truck)):
+            for url in urls:
+                if url not in downloads:
+                    continue
+                try:
+                    report[url]['unparsed_dates'] = 0
+                    prepare = functools.partial(prepare_sheet_chunk, url_report=report[url])
+                    report[url].update(delivery_store.sync_sheet_chunks(source, url, read_sheet_chunks(downloads[url]),
+                                                                        prepare))
+                except Exception as e:
+                    report[url].update(ok=False, error=f"Error syncing data: {e}")
+    finally:
+        for content in downloads.values():
+            content.close()
+    _print_failures(report)
+    kpis.refresh_kpis()
+    ledger.post_receivables()
+    return report
+
+
+def sync_and_load(urls_moto, urls_truck, timeout=FETCH_TIMEOUT_SECONDS, retries=FETCH_RETRIES,
+                  backoff=FETCH_BACKOFF_SECONDS, previous=None):
+    """ sync_sheets and read the data back from the store.
+    previous, the (moto DataFrame, truck DataFrame) last read from the store for the same sheets, is returned
+    as is when no sheet changed instead of reading the whole store again.
+    Returns (moto DataFrame, truck DataFrame, {url: report}). """
+    report = sync_sheets(urls_moto, urls_truck, timeout, retries, backoff)
+    # A sheet that failed to download or sync left its stored rows as they were
+    if previous is not None and all(not url_report['ok'] or url_report['skipped'] for url_report in report.values()):
+        moto_data, truck_data = previous
+    else:
+        moto_data, truck_data = load_from_store(urls_moto, urls_truck)
+    return moto_data, truck_data, report
+
+
+def _load_lock(key):
+    with _cache_lock:
+        return _load_locks.setdefault(key, threading.Lock())
+
+
+def _store_entry(key, loader):
+    generation = _cache_generation
+    data = loader()
+    with _cache_lock:
+        if generation == _cache_generation:
+            _cache[key] = {'data': data, 'loaded_at': time.time(), 'refreshing': False}
+    return data
+
+
+def _refresh_in_background(key, loader):
+    def run():
         try:
-            df = pd.read_csv(url, sep=',', header=0)
-            
-            # Convert the date column to string first
-            df['Ngày'] = df['Ngày'].astype(str)
-            
-            # Try multiple date formats
-            date_formats = ['%d/%m/%Y', '%d/%m/%y']
-            for fmt in date_formats:
-                df['Ngày'] = pd.to_datetime(df['Ngày'], format=fmt, errors='coerce')
-                if df['Ngày'].notna().all():
-                    break
-            
-            dataframes.append(df)
+            with _load_lock(key):
+                _store_entry(key, loader)
         except Exception as e:
-            print(f"Error loading data from {url}: {e}")
-    
-    combined_data = pd.concat(dataframes, ignore_index=True)
-    combined_data.dropna(subset=['Ngày'], inplace=True)
-    combined_data.reset_index(drop=True, inplace=True)  
-    combined_data = combined_data.sort_values(by='Ngày', ascending=False).reset_index(drop=True)
-    # Check for missing dates and handle them
-    missing_dates = combined_data['Ngày'].isna().sum()
-    if missing_dates > 0:
-        print(f"Warning: {missing_dates} rows have missing or improperly formatted dates.")
-        # Investigate rows with missing dates
-        missing_date_rows = combined_data[combined_data['Ngày'].isna()]
-        print("Rows with missing dates:")
-        print(missing_date_rows)
-        
-    print(combined_data)
-    return combined_data
+            print(f"Error refreshing cached data {key}: {e}")
+            with _cache_lock:
+                if key in _cache:
+                    _cache[key]['refreshing'] = False
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_cached(key, loader, ttl=CACHE_TTL_SECONDS, stale_while_revalidate=True, initial=None):
+    """ return the cached result of loader(), reloading it once it is older than ttl seconds.
+    With stale_while_revalidate the expired copy is returned immediately and the reload
+    runs in a background thread, so only the very first load waits on the network.
+    initial, if given, is tried on that first load: when it returns something other than None
+    it is served as an already expired copy while loader() runs in the background. After invalidate_cache
+    the next load waits for loader() instead. """
+    if stale_while_revalidate and initial is not None:
+        with _load_lock(key):
+            with _cache_lock:
+                try_initial = key not in _cache and key not in _initial_tried
+                _initial_tried.add(key)
+            if try_initial:
+                data = initial()
+                if data is not None:
+                    with _cache_lock:
+                        _cache[key] = {'data': data, 'loaded_at': 0, 'refreshing': True}
+                    _refresh_in_background(key, loader)
+                    return data
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            if time.time() - entry['loaded_at'] < ttl:
+                return entry['data']
+            if stale_while_revalidate:
+                if not entry['refreshing']:
+                    entry['refreshing'] = True
+                    _refresh_in_background(key, loader)
+                return entry['data']
+
+    # Only one loader runs for a key at a time, a background refresh included; the others pick up its result
+    with _load_lock(key):
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and time.time() - entry['loaded_at'] < ttl:
+                return entry['data']
+        return _store_entry(key, loader)
+
+
+def invalidate_cache():
+    """ drop every cached dataset so the next request reloads from the sheets """
+    global _cache_generation
+    with _cache_lock:
+        _cache.clear()
+        _cache_generation += 1
+
+
+def cache_loaded_at(key):
+    """ time.time() of the last successful load for key, or None if it is not cached or only holds the
+    initial copy """
+    with _cache_lock:
+        entry = _cache.get(key)
+    # The initial copy is cached with loaded_at 0 until its first load finishes
+    if entry is None or not entry['loaded_at']:
+        return None
+    return entry['loaded_at']
+
+
+def delivery_cache_key(urls_moto, urls_truck):
+    return ('delivery', tuple(urls_moto), tuple(urls_truck))
+
+
+def get_delivery_data(urls_moto, urls_truck, ttl=CACHE_TTL_SECONDS, stale_while_revalidate=True):
+    """ cached (moto DataFrame, truck DataFrame, {url: report}) for the given sheet URLs.
+    On a cold start the last snapshot (or else the rows already in the local store) is served while the
+    sheets sync; every sync writes a new snapshot. A snapshot is only served while the store still holds
+    what it was written from (delivery_store.sync_state), e.g. not after a sync whose snapshot failed to write. """
+    key = delivery_cache_key(urls_moto, urls_truck)
+    name = snapshot.snapshot_name('delivery', key, SCHEMA_VERSION)
+    urls = list(urls_moto) + list(urls_truck)
+
+    def loader():
+        with _cache_lock:
+            entry = _cache.get(key)
+        previous = entry['data'][:2] if entry is not None else None
+        moto_data, truck_data, report = sync_and_load(urls_moto, urls_truck, previous=previous)
+        state = delivery_store.sync_state(urls)
+        unchanged = previous is not None and moto_data is previous[0] and truck_data is previous[1]
+        if unchanged and snapshot.has_snapshot(name, ['moto', 'truck'], state=state):
+            return moto_data, truck_data, report
+        try:
+            snapshot.write_snapshot(name, {'moto': moto_data, 'truck': truck_data}, state=state)
+        except Exception as e:
+            print(f"Error writing snapshot {name}: {e}")
+        return moto_data, truck_data, report
+
+    def initial():
+        delivery_store.init_store()
+        frames = snapshot.read_snapshot(name, ['moto', 'truck'], state=delivery_store.sync_state(urls))
+        if frames is not None:
+            return frames['moto'], frames['truck'], {}
+        if not (delivery_store.has_orders('moto', urls_moto) and delivery_store.has_orders('truck', urls_truck)):
+            return None
+        return load_from_store(urls_moto, urls_truck) + ({},)
+
+    return get_cached(key, loader, ttl, stale_while_revalidate, initial)
@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Shared SQLite connections for every module. Opening a connection, setting it up and closing it
+# again costs more than most of the queries the pages run, so connections are kept open in a small
+# pool per database file and lent out to one thread at a time.
+
+PRAGMAS = {
+    'journal_mode': 'WAL',       # readers do not block the writer and the writer does not block readers
+    'synchronous': 'NORMAL',     # with WAL: fsync at checkpoints only, still safe against corruption
+    'cache_size': -16000,        # page cache of about 16 MB per connection
+    'mmap_size': 268435456,      # read the database through a 256 MB memory map
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,        # wait up to 5s for a lock held by another connection
+}
+# Prepared statements kept per connection (sqlite3 reuses them for identical SQL text)
+CACHED_STATEMENTS = 256
+# Idle connections kept per database file
+POOL_SIZE = 4
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def open_connection(db_file):
+    """ a new connection to db_file with PRAGMAS applied. It may be used from any thread, but by one at a time. """
+    conn = sqlite3.connect(db_file, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def _acquire(db_file):
+    with _pools_lock:
+        idle = _pools.setdefault(db_file, [])
+        if idle:
+            return idle.pop()
+    return open_connection(db_file)
+
+
+def _release(db_file, conn):
+    # Never hand out a connection with a transaction left open by its previous user
+    if conn.in_transaction:
+        conn.rollback()
+    with _pools_lock:
+        idle = _pools.setdefault(db_file, [])
+        if len(idle) < POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+@contextmanager
+def connection(db_file):
+    """ borrow a pooled connection to db_file for the duration of the with block.
+    Changes that are not committed inside the block are rolled back. """
+    conn = _acquire(db_file)
+    try:
+        yield conn
+    except BaseException:
+        conn.close()
+        raise
+    else:
+        _release(db_file, conn)
+
+
+@contextmanager
+def transaction(db_file):
+    """ borrow a pooled connection and run the with block as one transaction: committed at the end,
+    rolled back if the block raises """
+    with connection(db_file) as conn:
+        with conn:
+            yield conn
+
+
+def close_all():
+    """ close every idle pooled connection """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for idle in pools:
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+PERIODS = ['day', 'week', 'month', 'quarter', 'year']
+
+# pandas period frequency of each period choice; weeks run Monday to Sunday
+PERIOD_FREQUENCIES = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'quarter': 'Q-DEC', 'year': 'Y-DEC'}
+
+SUM_COLUMNS = ['Số lượng Giao', 'Thanh Toán']
+METHOD_COLUMN = 'Phương Thức Thanh Toán'
+
+
+def period_codes(dates, period):
+    """ integer period ordinals of a datetime Series (rows without a date get -1) and the frequency used """
+    if period not in PERIOD_FREQUENCIES:
+        raise ValueError("Unsupported period type specified.")
+    frequency = PERIOD_FREQUENCIES[period]
+    codes = dates.dt.to_period(frequency).array.asi8.copy()
+    codes[dates.isna().to_numpy()] = -1
+    return codes, frequency
+
+
+def compute_statistics(data, period, row_counts=None):
+    """ delivered quantity, payment total and number of rows per payment method for every period.
+    data is either delivery rows or a rollup cube, whose row_counts say how many deliveries each
+    cube row stands for. Groups on integer period ordinals without adding columns to data; the
+    result is indexed by pd.Period, newest first. """
+    codes, frequency = period_codes(data['Ngày'], period)
+    has_date = codes >= 0
+    keys = codes[has_date]
+
+    sums = pd.DataFrame({column: data[column].array[has_date] for column in SUM_COLUMNS}).groupby(keys).sum()
+    methods = pd.Series(np.asarray(data[METHOD_COLUMN])[has_date])
+    has_method = methods.notna().to_numpy()
+    if has_method.any():
+        if row_counts is None:
+            counts = pd.crosstab(keys[has_method], methods[has_method].to_numpy())
+        else:
+            counts = pd.crosstab(keys[has_method], methods[has_method].to_numpy(),
+                                 values=np.asarray(row_counts)[has_date][has_method], aggfunc='sum')
+        counts = counts.rename_axis(index=None, columns=None)
+        stats = sums.join(counts).fillna({column: 0 for column in counts.columns})
+        stats[list(counts.columns)] = stats[list(counts.columns)].astype('int64')
+    else:
+        stats = sums
+
+    stats = stats.sort_index(ascending=False)
+    stats.index = pd.PeriodIndex.from_ordinals(stats.index.to_numpy(dtype='int64'), freq=frequency, name='Period')
+    return stats
+
+
+def format_statistics(stats, period):
+    """ compute_statistics output with a readable 'Period' label column, for display """
+    if period == 'day':
+        labels = stats.index.start_time.strftime('%d/%m/%Y')
+    else:
+        labels = stats.index.start_time.strftime('%d/%m/%Y') + ' - ' + stats.index.end_time.strftime('%d/%m/%Y')
+    return stats.reset_index(drop=True).set_axis(labels, axis=0).rename_axis('Period').reset_index()
+
+
+def display_statistics(data, period, row_counts=None):
+    return format_statistics(compute_statistics(data, period, row_counts), period)
@@ -0,0 +1,228 @@
+import hashlib
+import json
+from datetime import datetime
+import pandas as pd
+import storage
+
+# Sheet column -> Orders column
+ORDER_COLUMNS = {
+    'Ngày': 'date',
+    'Khách hàng ( Hoặc số địa chỉ)': 'customer_code',
+    'Tên đường': 'street_name',
+    'Loại sản phẩm': 'product_type',
+    'Loại bình': 'bottle_type',
+    'Số lượng Giao': 'quantity_delivered',
+    'Vỏ về': 'bottle_returned',
+    'Thanh Toán': 'amount_paid',
+    'Phương Thức Thanh Toán': 'payment_method',
+    'Người chở 1': 'driver_1',
+    'Người chở 2': 'driver_2',
+}
+
+# The other columns of a sheet are kept in Orders.extra as {sheet column: value} of the values that are present
+
+# Separates the sheet column names stored in SheetSync.columns
+SHEET_COLUMNS_SEPARATOR = '|'
+
+
+def create_db_connection():
+    return storage.connection()
+
+
+def init_store():
+    """ create the app database, with its Orders and SheetSync tables, if it does not exist yet """
+    storage.init_db()
+
+
+def _to_order_rows(df, extra_columns):
+    """ map a prepared sheet onto the Orders columns, extra_columns into 'extra'; values are converted to
+    plain Python types """
+    orders = pd.DataFrame(index=df.index)
+    for sheet_column, order_column in ORDER_COLUMNS.items():
+        orders[order_column] = df[sheet_column] if sheet_column in df.columns else None
+    orders['date'] = orders['date'].dt.strftime('%Y-%m-%d')
+    orders = orders.astype(object).where(orders.notna(), None)
+    orders['extra'] = None
+    if extra_columns:
+        extra = df[extra_columns].astype(object).where(df[extra_columns].notna(), None)
+        orders['extra'] = [json.dumps({column: value for column, value in zip(extra_columns, row) if value is not None},
+                                      ensure_ascii=False, default=str) if any(value is not None for value in row) else None
+                           for row in extra.itertuples(index=False, name=None)]
+    return orders.reset_index(drop=True)
+
+
+def _chunk_hash(chunk):
+    """ hex digest of the column names and values of a chunk of sheet rows """
+    digest = hashlib.sha1('\x1f'.join(map(str, chunk.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(chunk, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def sync_sheet_chunks(source, url, chunks, prepare=None):
+    """ bring the Orders copy of one sheet up to date. The sheet is given as consecutive chunks of rows
+    in their original order (e.g. from pd.read_csv(..., chunksize=n)), so the row position identifies a sheet row.
+    prepare, if given, turns a chunk as read into the prepared rows; it is only called for a chunk whose hash
+    differs from the one it was last synced with (SheetChunks), so an unchanged chunk costs a hash and one lookup.
+    Each changed chunk is written in its own transaction, so a long sheet never holds the write lock for longer
+    than one chunk takes; a sync that stops part way is picked up by the next one, whose hashes still differ for
+    the rest. Only one chunk and the stored hashes of its rows are in memory at a time.
+    Only rows whose content hash changed are written; an unchanged sheet is reported as skipped.
+    Returns {'inserted': n, 'updated': n, 'deleted': n, 'skipped': bool, 'rows': n}. """
+    result = {'inserted': 0, 'updated': 0, 'deleted': 0, 'skipped': False, 'rows': 0}
+    digest = hashlib.sha1()
+    sheet_columns = []
+    with storage.connection() as conn:
+        for chunk in chunks:
+            first_row = result['rows']
+            result['rows'] += len(chunk)
+            sheet_columns = chunk.columns
+            chunk_hash = _chunk_hash(chunk)
+            digest.update(chunk_hash.encode())
+            stored_chunk = conn.execute('SELECT row_count, chunk_hash FROM SheetChunks WHERE sheet_url = ? AND first_row = ?',
+                                        (url, first_row)).fetchone()
+            if stored_chunk == (len(chunk), chunk_hash):
+                continue
+
+            df = prepare(chunk) if prepare is not None else chunk
+            extra_columns = [column for column in df.columns if column not in ORDER_COLUMNS]
+            orders = _to_order_rows(df, extra_columns)
+            # A sheet without other columns keeps the row hashes it had before there was an extra column
+            hashed = orders if extra_columns else orders.drop(columns='extra')
+            orders['row_hash'] = pd.util.hash_pandas_object(hashed, index=False).to_numpy().astype('int64').tolist()
+            orders['sheet_row'] = range(first_row, result['rows'])
+            # Rows whose date could not be parsed keep their position but are not stored
+            orders = orders[orders['date'].notna()]
+
+            with conn:
+                # sqlite3 would only begin the transaction at the first write, after the stored hashes are read
+                conn.execute('BEGIN')
+                cursor = conn.cursor()
+                stored = dict(cursor.execute(
+                    'SELECT sheet_row, row_hash FROM Orders WHERE sheet_url = ? AND sheet_row >= ? AND sheet_row < ?',
+                    (url, first_row, result['rows'])).fetchall())
+                _write_changes(cursor, source, url, orders, stored, result)
+                # Chunks recorded with other boundaries no longer describe these rows
+                cursor.execute('DELETE FROM SheetChunks WHERE sheet_url = ? AND first_row < ? AND first_row + row_count > ?',
+                               (url, result['rows'], first_row))
+                cursor.execute('INSERT INTO SheetChunks (sheet_url, first_row, row_count, chunk_hash) VALUES (?, ?, ?, ?)',
+                               (url, first_row, len(chunk), chunk_hash))
+
+        with conn:
+            conn.execute('BEGIN')
+            cursor = conn.cursor()
+            # Rows past the end of the sheet were removed from it
+            result['deleted'] += cursor.execute('DELETE FROM Orders WHERE sheet_url = ? AND sheet_row >= ?',
+                                                (url, result['rows'])).rowcount
+            cursor.execute('DELETE FROM SheetChunks WHERE sheet_url = ? AND first_row + row_count > ?', (url, result['rows']))
+            sheet_hash = digest.hexdigest()
+            state = cursor.execute('SELECT sheet_hash FROM SheetSync WHERE sheet_url = ?', (url,)).fetchone()
+            if state is not None and state[0] == sheet_hash:
+                result['skipped'] = True
+                return result
+            last_date = cursor.execute('SELECT MAX(date) FROM Orders WHERE sheet_url = ?', (url,)).fetchone()[0]
+            _record_sync(cursor, source, url, result['rows'], last_date, sheet_hash, sheet_columns)
+    return result
+
+
+def _write_changes(cursor, source, url, orders, stored, result):
+    """ insert, update and delete the Orders rows of one chunk given the {sheet_row: row_hash} stored for
+    its row range; counts are added to result """
+    is_new = ~orders['sheet_row'].isin(stored.keys())
+    is_changed = ~is_new & (orders['row_hash'] != orders['sheet_row'].map(stored))
+    incoming_rows = set(orders['sheet_row'])
+    removed = [(url, sheet_row) for sheet_row in stored if sheet_row not in incoming_rows]
+
+    columns = list(ORDER_COLUMNS.values()) + ['extra', 'row_hash']
+    new_rows = orders.loc[is_new, columns + ['sheet_row']].itertuples(index=False, name=None)
+    cursor.executemany(f'''
+        INSERT INTO Orders ({', '.join(columns)}, sheet_row, source, sheet_url)
+        VALUES ({', '.join('?' * (len(columns) + 1))}, ?, ?)
+    ''', [row + (source, url) for row in new_rows])
+    changed_rows = orders.loc[is_changed, columns + ['sheet_row']].itertuples(index=False, name=None)
+    cursor.executemany(f'''
+        UPDATE Orders SET {', '.join(f'{column} = ?' for column in columns)}
+        WHERE sheet_row = ? AND source = ? AND sheet_url = ?
+    ''', [row + (source, url) for row in changed_rows])
+    cursor.executemany('DELETE FROM Orders WHERE sheet_url = ? AND sheet_row = ?', removed)
+
+    result['inserted'] += int(is_new.sum())
+    result['updated'] += int(is_changed.sum())
+    result['deleted'] += len(removed)
+
+
+def _record_sync(cursor, source, url, row_count, last_date, sheet_hash, sheet_columns):
+    cursor.execute('''
+        INSERT INTO SheetSync (sheet_url, source, row_count, last_date, sheet_hash, columns, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(sheet_url) DO UPDATE SET
+        source = excluded.source,
+        row_count = excluded.row_count,
+        last_date = excluded.last_date,
+        sheet_hash = excluded.sheet_hash,
+        columns = excluded.columns,
+        synced_at = excluded.synced_at
+    ''', (url, source, row_count, last_date, sheet_hash,
+          SHEET_COLUMNS_SEPARATOR.join(sheet_columns),
+          datetime.now()))
+
+
+def _source_filter(source, urls):
+    condition = 'source = ?'
+    params = [source]
+    if urls is not None:
+        condition += f" AND sheet_url IN ({', '.join('?' * len(urls))})"
+        params += list(urls)
+    return condition, params
+
+
+def iter_orders(source, urls=None, chunksize=None):
+    """ stored rows of one source ('moto' or 'truck') with the sheet column names, newest first, as consecutive
+    frames of at most chunksize rows (a single frame when chunksize is None). urls limits the result to those sheets.
+    Only the columns the synced sheets actually have are returned, those kept in Orders.extra after the others.
+    At least one frame is returned, empty when nothing is stored. """
+    condition, params = _source_filter(source, urls)
+    with create_db_connection() as conn:
+        sheet_columns = ['Ngày']
+        for (columns,) in conn.execute(f'SELECT columns FROM SheetSync WHERE {condition}', params):
+            sheet_columns += [column for column in (columns or '').split(SHEET_COLUMNS_SEPARATOR)
+                              if column and column not in sheet_columns]
+        query = f'''
+            SELECT {', '.join(ORDER_COLUMNS.values())}, extra
+            FROM Orders
+            WHERE {condition}
+            ORDER BY date DESC, sheet_url, sheet_row
+        '''
+        chunks = pd.read_sql_query(query, conn, params=params, chunksize=chunksize)
+        empty = True
+        for orders in ([chunks] if chunksize is None else chunks):
+            empty = False
+            yield _to_sheet_columns(orders, sheet_columns)
+        if empty:
+            yield _to_sheet_columns(pd.DataFrame(columns=list(ORDER_COLUMNS.values()) + ['extra']), sheet_columns)
+
+
+def _to_sheet_columns(orders, sheet_columns):
+    data = orders.rename(columns={order_column: sheet_column for sheet_column, order_column in ORDER_COLUMNS.items()})
+    data['Ngày'] = pd.to_datetime(data['Ngày'], format='%Y-%m-%d')
+    columns = [column for column in ORDER_COLUMNS if column in sheet_columns]
+    extra_columns = [column for column in sheet_columns if column not in ORDER_COLUMNS]
+    if not extra_columns:
+        return data[columns]
+    extra = pd.DataFrame([json.loads(values) if values else {} for values in data['extra']],
+                         columns=extra_columns, index=data.index)
+    return pd.concat([data[columns], extra], axis=1)
+
+
+def has_orders(source, urls=None):
+    condition, params = _source_filter(source, urls)
+    with create_db_connection() as conn:
+        return conn.execute(f'SELECT 1 FROM Orders WHERE {condition} LIMIT 1', params).fetchone() is not None
+
+
+def sync_state(urls):
+    """ the sheet hash each of urls was last synced with, as one string; it changes whenever a sync of one of
+    them completes with different rows """
+    with create_db_connection() as conn:
+        synced = conn.execute(f"SELECT sheet_url, sheet_hash FROM SheetSync WHERE sheet_url IN ({', '.join('?' * len(urls))})",
+                              list(urls)).fetchall()
+    return json.dumps(sorted(synced), ensure_ascii=False)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import frame_cache
+
+
+class FilterIndex:
+    """ row lookups for the sidebar filters of one delivery frame, built once per data load.
+
+    Dates are kept sorted so a date range is two binary searches. Every filtered column is
+    factorized into integer codes plus a list of row positions grouped by value, so the rows of the
+    selected values can be read straight off without scanning the frame. """
+
+    def __init__(self, data, columns, date_column='Ngày'):
+        self.size = len(data)
+        self._dates = data[date_column].to_numpy(dtype='datetime64[ns]')
+        self._date_order = np.argsort(self._dates, kind='stable')
+        self._sorted_dates = self._dates[self._date_order]
+
+        self._codes = {}
+        self._values = {}
+        self._row_ids = {}
+        self._offsets = {}
+        for column in columns:
+            codes, values = pd.factorize(data[column], sort=True)
+            codes = codes.astype(np.min_scalar_type(-len(values) - 1))
+            # Row positions ordered by value; rows without a value (code -1) come first and are skipped
+            order = np.argsort(codes, kind='stable').astype(np.int64)
+            counts = np.bincount(codes[codes >= 0], minlength=len(values))
+            missing = self.size - counts.sum()
+            self._codes[column] = codes
+            self._values[column] = values
+            self._row_ids[column] = order[missing:]
+            self._offsets[column] = np.concatenate(([0], np.cumsum(counts)))
+
+    def options(self, column):
+        """ the distinct values of column, sorted, for a multiselect """
+        return list(self._values[column])
+
+    def _selected_codes(self, column, selected):
+        codes = self._values[column].get_indexer(list(selected))
+        return codes[codes >= 0]
+
+    def rows(self, date_range=None, filters=None):
+        """ sorted positions of the rows inside date_range (start, end), both ends included, whose
+        values are among the selected ones for every column of filters ({column: [values]}).
+        Returns None when nothing restricts the rows. """
+        # Candidate sets as (size, kind, rows): kind 'block' with a slice of positions,
+        # 'dates' with sorted positions, or ('column', name) with the (begin, end) runs of _row_ids
+        sets = []
+        if date_range:
+            start, end = np.datetime64(date_range[0], 'ns'), np.datetime64(date_range[1], 'ns')
+            low = np.searchsorted(self._sorted_dates, start, side='left')
+            high = np.searchsorted(self._sorted_dates, end, side='right')
+            in_range = self._date_order[low:high]
+            if len(in_range) and in_range.max() - in_range.min() + 1 == len(in_range):
+                # The frames come sorted by date, so a range usually is one block of rows
+                sets.append((len(in_range), 'block', slice(in_range.min(), in_range.max() + 1)))
+            else:
+                sets.append((len(in_range), 'dates', np.sort(in_range, kind='stable')))
+
+        wanted = {}
+        for column, selected in (filters or {}).items():
+            if not selected:
+                continue
+            codes = self._selected_codes(column, selected)
+            offsets = self._offsets[column]
+            # One extra False at the end, picked by code -1 (no value)
+            wanted[column] = np.zeros(len(self._values[column]) + 1, dtype=bool)
+            wanted[column][codes] = True
+            runs = [(offsets[code], offsets[code + 1]) for code in codes]
+            sets.append((sum(end_run - begin for begin, end_run in runs), ('column', column), runs))
+
+        if not sets:
+            return None
+
+        # Start from the smallest candidate set and check every other filter on it in one pass
+        size, kind, candidate_rows = min(sets, key=lambda candidate_set: candidate_set[0])
+        if size == 0:
+            return np.empty(0, dtype=np.int64)
+        block = candidates = None
+        if kind == 'block':
+            block = candidate_rows
+        elif kind == 'dates':
+            candidates = candidate_rows
+        else:
+            row_ids = self._row_ids[kind[1]]
+            candidates = np.sort(np.concatenate([row_ids[begin:end_run] for begin, end_run in candidate_rows]),
+                                 kind='stable')
+            del wanted[kind[1]]
+
+        keep = None
+        if date_range and candidates is not None and kind != 'dates':
+            dates = self._dates[candidates]
+            keep = (dates >= start) & (dates <= end)
+        for column, column_wanted in wanted.items():
+            codes = self._codes[column][block if block is not None else candidates]
+            keep = column_wanted[codes] if keep is None else keep & column_wanted[codes]
+
+        if block is not None:
+            return block.start + np.flatnonzero(keep) if keep is not None else np.arange(block.start, block.stop)
+        return candidates[keep] if keep is not None else candidates
+
+
+def get_filter_index(data, columns, date_column='Ngày'):
+    """ the FilterIndex of data for columns, built on first use and reused for as long as data lives """
+    return frame_cache.get_or_build(data, ('filter_index', tuple(columns), date_column),
+                                    lambda: FilterIndex(data, columns, date_column))
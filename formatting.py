@@ -0,0 +1,6 @@
+# Number formats shared by the pages
+
+
+def format_currency(value):
+    """ value with thousands separators and no decimals, e.g. 1,250,000 """
+    return f"{value:,.0f}"
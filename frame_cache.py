@@ -0,0 +1,21 @@
+import threading
+import weakref
+
+# Structures derived from a loaded frame, keyed by (id of the frame, key); an entry goes away with its frame
+_built = {}
+_built_lock = threading.Lock()
+
+
+def get_or_build(data, key, build):
+    """ build() for data the first time key is asked for, the same object afterwards for as long as data lives """
+    cache_key = (id(data), key)
+    with _built_lock:
+        entry = _built.get(cache_key)
+        if entry is not None and entry[0]() is data:
+            return entry[1]
+
+    built = build()
+    with _built_lock:
+        _built[cache_key] = (weakref.ref(data), built)
+    weakref.finalize(data, _built.pop, cache_key, None)
+    return built
@@ -1,189 +1,127 @@
-import sqlite3
 import pandas as pd
 import streamlit as st
-from sqlalchemy import create_engine
-from datetime import datetime
+import customers
+import rollup
+import storage
 
-# Create SQLite database connection
+# Create SQLite database connection (borrowed from the shared pool until the with block ends)
 def create_db_connection():
-    return sqlite3.connect('delivery_data.db')
-
-# Initialize database
-def init_db():
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            customer_id INTEGER PRIMARY KEY,
-            customer_name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY,
-            product_name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prices (
-            price_id INTEGER PRIMARY KEY,
-            customer_id INTEGER,
-            product_id INTEGER,
-            price REAL,
-            last_updated TIMESTAMP,
-            FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
-            FOREIGN KEY (product_id) REFERENCES products (product_id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inventory (
-            inventory_id INTEGER PRIMARY KEY,
-            product_id INTEGER,
-            quantity INTEGER,
-            last_updated TIMESTAMP,
-            FOREIGN KEY (product_id) REFERENCES products (product_id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sales (
-            sale_id INTEGER PRIMARY KEY,
-            product_id INTEGER,
-            quantity INTEGER,
-            sale_date DATE,
-            FOREIGN KEY (product_id) REFERENCES products (product_id)
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-# Populate customers table
-def populate_customers(unique_customers):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    for customer in unique_customers:
-        cursor.execute('INSERT OR IGNORE INTO customers (customer_name) VALUES (?)', (customer,))
-
-    conn.commit()
-    conn.close()
+    return storage.connection()
 
 # Insert or update product
 def insert_or_update_product(product_name):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('INSERT OR IGNORE INTO products (product_name) VALUES (?)', (product_name,))
-    conn.commit()
-    conn.close()
-
-# Insert sales data from provided dataframes
-def insert_sales_data(data):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    product_names = cursor.execute('SELECT product_name FROM products').fetchall()
-    product_names = [p[0] for p in product_names]
-
-    for _, row in data.iterrows():
-        product_name = row['Loại sản phẩm']
-        if product_name in product_names:
-            product_id = cursor.execute('SELECT product_id FROM products WHERE product_name = ?', (product_name,)).fetchone()[0]
-            cursor.execute('''
-                INSERT INTO sales (product_id, quantity, sale_date)
-                VALUES (?, ?, ?)
-            ''', (product_id, row['Số lượng Giao'], row['Ngày']))
-    
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO products (product_name) VALUES (?)', (product_name,))
+
+# Bring the sales of one source ('moto' or 'truck') up to date with its deliveries in Orders (see delivery_store.py).
+# Each sale is keyed on the sheet row it comes from ('<sheet_url>#<sheet_row>'), so inserting again adds the new rows,
+# updates the sales whose row changed and removes those whose row is gone; triggers keep stock_movements in step.
+# Legacy sales (without a key) of a product on a date the deliveries have it on are replaced by them. Returns {'inserted', 'updated', 'removed', 'skipped'}, skipped being the deliveries of an unknown product.
+def insert_sales_data(source):
+    with storage.transaction() as conn:
+        # Opened here so the temp table is rolled back with the rest if anything fails
+        conn.execute('BEGIN')
+        conn.execute('''
+            CREATE TEMP TABLE sales_import AS
+            SELECT p.product_id, o.quantity_delivered AS quantity, o.bottle_returned AS returned, o.date AS sale_date,
+                   o.sheet_url || '#' || o.sheet_row AS source_key
+            FROM Orders o
+            JOIN products p ON p.product_name = o.product_type
+            WHERE o.source = ? AND o.sheet_url IS NOT NULL
+        ''', (source,))
+        conn.execute('CREATE UNIQUE INDEX temp.idx_sales_import_key ON sales_import (source_key)')
+        deliveries = conn.execute('SELECT COUNT(*) FROM Orders WHERE source = ? AND sheet_url IS NOT NULL', (source,)).fetchone()[0]
+
+        # rowcounts leave out the stock movements written by the triggers
+        removed = conn.execute('''
+            DELETE FROM sales
+            WHERE source_key IS NULL
+              AND (product_id, sale_date) IN (SELECT product_id, sale_date FROM sales_import)
+        ''').rowcount
+        removed += conn.execute('''
+            DELETE FROM sales
+            WHERE EXISTS (SELECT 1 FROM SheetSync s
+                          WHERE s.source = ? AND substr(sales.source_key, 1, length(s.sheet_url) + 1) = s.sheet_url || '#')
+              AND source_key NOT IN (SELECT source_key FROM sales_import)
+        ''', (source,)).rowcount
+        updated = conn.execute('''
+            UPDATE sales SET product_id = i.product_id, quantity = i.quantity, returned = i.returned, sale_date = i.sale_date
+            FROM sales_import i
+            WHERE sales.source_key = i.source_key
+              AND (sales.product_id, sales.quantity, sales.returned, sales.sale_date) IS NOT (i.product_id, i.quantity, i.returned, i.sale_date)
+        ''').rowcount
+        inserted = conn.execute('''
+            INSERT INTO sales (product_id, quantity, returned, sale_date, source_key)
+            SELECT product_id, quantity, returned, sale_date, source_key FROM sales_import i
+            WHERE NOT EXISTS (SELECT 1 FROM sales s WHERE s.source_key = i.source_key)
+        ''').rowcount
+        imported = conn.execute('SELECT COUNT(*) FROM sales_import').fetchone()[0]
+        conn.execute('DROP TABLE sales_import')
+    return {'inserted': inserted, 'updated': updated, 'removed': removed, 'skipped': deliveries - imported}
 
 def get_products():
-    conn = create_db_connection()
-    product_df = pd.read_sql_query("SELECT * FROM products", conn)
-    conn.close()
-    return product_df
+    with create_db_connection() as conn:
+        return pd.read_sql_query("SELECT * FROM products", conn)
 
 def get_inventory():
-    conn = create_db_connection()
-    inventory_df = pd.read_sql_query('''
-        SELECT p.product_name, i.quantity, i.last_updated
-        FROM inventory i
-        JOIN products p ON i.product_id = p.product_id
-    ''', conn)
-    conn.close()
-    return inventory_df
+    with create_db_connection() as conn:
+        return pd.read_sql_query('''
+            SELECT p.product_name, i.quantity, i.last_updated
+            FROM inventory i
+            JOIN products p ON i.product_id = p.product_id
+        ''', conn)
 
 def update_inventory(product_id, inventory_quantity):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT INTO inventory (product_id, quantity, last_updated)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(product_id) DO UPDATE SET
-        quantity = excluded.quantity,
-        last_updated = excluded.last_updated
-    ''', (product_id, inventory_quantity))
-    conn.commit()
-    conn.close()
-
+    with storage.transaction() as conn:
+        conn.execute('''
+            INSERT INTO inventory (product_id, quantity, last_updated)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(product_id) DO UPDATE SET
+            quantity = excluded.quantity,
+            last_updated = excluded.last_updated
+        ''', (int(product_id), inventory_quantity))
+
+# Remaining stock of one product, read from its maintained balance (see storage._create_stock_tables)
 def calculate_remaining_inventory(product_id):
-    conn = create_db_connection()
-    cursor = conn.cursor()
-
-    # Calculate total sales for the product
-    sales_df = pd.read_sql_query('''
-        SELECT SUM(quantity) as total_sales
-        FROM sales
-        WHERE product_id = ?
-    ''', conn, params=(product_id,))
-    
-    # Check if the DataFrame is empty
-    if sales_df.empty or sales_df['total_sales'].isnull().values[0]:
-        total_sales = 0
-    else:
-        total_sales = sales_df['total_sales'].values[0]
-
-    # Get current inventory for the product
-    current_inventory_df = pd.read_sql_query('''
-        SELECT quantity
-        FROM inventory
-        WHERE product_id = ?
-    ''', conn, params=(product_id,))
-    
-    # Check if the DataFrame is empty
-    if current_inventory_df.empty or current_inventory_df['quantity'].isnull().values[0]:
-        current_inventory = 0
-    else:
-        current_inventory = current_inventory_df['quantity'].values[0]
-
-    # Calculate remaining inventory
-    remaining_inventory = current_inventory - total_sales
-    conn.close()
-    return remaining_inventory
+    with create_db_connection() as conn:
+        row = conn.execute('SELECT remaining FROM stock_balances WHERE product_id = ?', (int(product_id),)).fetchone()
+    return row[0] if row else 0
+
+# Received, delivered, returned shells and remaining stock of every product
+def get_stock_balances():
+    with create_db_connection() as conn:
+        return pd.read_sql_query('''
+            SELECT p.product_name, COALESCE(b.received, 0) AS received, COALESCE(b.delivered, 0) AS delivered,
+                   COALESCE(b.returned, 0) AS returned, COALESCE(b.remaining, 0) AS remaining, b.last_movement
+            FROM products p
+            LEFT JOIN stock_balances b ON b.product_id = p.product_id
+            ORDER BY p.product_name
+        ''', conn)
+
+# The same balances counting only the movements up to as_of_date ('YYYY-MM-DD', included)
+def get_stock_as_of(as_of_date):
+    with create_db_connection() as conn:
+        return pd.read_sql_query('''
+            SELECT p.product_name,
+                   COALESCE(SUM(CASE m.kind WHEN 'receipt' THEN m.quantity END), 0) AS received,
+                   COALESCE(SUM(CASE m.kind WHEN 'delivery' THEN m.quantity END), 0) AS delivered,
+                   COALESCE(SUM(CASE m.kind WHEN 'return' THEN m.quantity END), 0) AS returned,
+                   COALESCE(SUM(CASE m.kind WHEN 'receipt' THEN m.quantity WHEN 'delivery' THEN -m.quantity END), 0) AS remaining
+            FROM products p
+            LEFT JOIN stock_movements m ON m.product_id = p.product_id AND m.movement_date <= ?
+            GROUP BY p.product_id
+            ORDER BY p.product_name
+        ''', conn, params=(as_of_date,))
 
 
 def generate_summary(data):
-    data['Ngày'] = pd.to_datetime(data['Ngày'])
-    daily_summary = data.groupby(['Ngày', 'Loại sản phẩm'])[['Số lượng Giao', 'Vỏ về']].sum().reset_index()
-    return daily_summary
+    return rollup.product_summary(data, 'Day')
 
 def run_inventory_management_app(data_xe_may, data_oto):
-    init_db()
+    storage.init_db()
 
-    # Populate customer and product tables
-    unique_customers_xe_may = data_xe_may['Khách hàng ( Hoặc số địa chỉ)'].unique()
-    unique_customers_oto = data_oto['Khách hàng ( Hoặc số địa chỉ)'].unique()
-    populate_customers(unique_customers_xe_may)
-    populate_customers(unique_customers_oto)
-
-    conn = create_db_connection()
-    cursor = conn.cursor()
+    # Add the customers of the deliveries that are not known yet
+    customers.sync_customers(customers.customer_labels(data_xe_may, data_oto))
 
     # Add product
     st.subheader("Add Product")
@@ -199,12 +137,11 @@ def run_inventory_management_app(data_xe_may, data_oto):
 
     # Add sales data
     st.subheader("Insert Sales Data from CSV")
-    if st.button("Insert Sales Data for Xe May"):
-        insert_sales_data(data_xe_may)
-        st.success("Sales data for Xe May inserted successfully")
-    if st.button("Insert Sales Data for Oto"):
-        insert_sales_data(data_oto)
-        st.success("Sales data for Oto inserted successfully")
+    for label, source in (("Xe May", 'moto'), ("Oto", 'truck')):
+        if st.button(f"Insert Sales Data for {label}"):
+            result = insert_sales_data(source)
+            st.success(f"Sales data for {label} inserted successfully: {result['inserted']} new rows, "
+                       f"{result['updated']} updated, {result['removed']} removed, {result['skipped']} skipped")
 
     # Manage Inventory
     st.subheader("Manage Inventory")
@@ -225,57 +162,22 @@ def run_inventory_management_app(data_xe_may, data_oto):
     inventory_df = get_inventory()
     st.write(inventory_df)
 
-    # Calculate remaining inventory
-    st.subheader("Calculate Remaining Inventory")
-    selected_product = st.selectbox("Select Product to Calculate Remaining Inventory", product_df['product_name'])
-    product_id_row = product_df[product_df['product_name'] == selected_product]
-    if not product_id_row.empty:
-        product_id = product_id_row['product_id'].values[0]
-        remaining_inventory = calculate_remaining_inventory(product_id)
-        st.write(f"Remaining inventory for '{selected_product}': {remaining_inventory}")
-    else:
-        st.error(f"Product '{selected_product}' not found")
+    # Remaining stock of every product, from the maintained balances
+    st.subheader("Remaining Inventory")
+    st.write(get_stock_balances())
+
+    as_of_date = st.date_input("Remaining Inventory as of", value=None)
+    if as_of_date is not None:
+        st.write(get_stock_as_of(as_of_date.strftime('%Y-%m-%d')))
 
     # Debt Management
     st.subheader("Debt Management - Xe May")
-    daily_summary_xe_may = generate_summary(data_xe_may)
     period = st.selectbox("Select Period", ["Day", "Week", "Month", "Year"])
 
-    if period == "Day":
-        daily_summary_xe_may_filtered = daily_summary_xe_may
-    elif period == "Week":
-        # Group by week and product
-        daily_summary_xe_may.set_index('Ngày', inplace=True)
-        daily_summary_xe_may_filtered = daily_summary_xe_may.groupby([pd.Grouper(freq='W'), 'Loại sản phẩm']).sum().reset_index()
-    elif period == "Month":
-        # Group by month and product
-        daily_summary_xe_may.set_index('Ngày', inplace=True)
-        daily_summary_xe_may_filtered = daily_summary_xe_may.groupby([pd.Grouper(freq='M'), 'Loại sản phẩm']).sum().reset_index()
-    elif period == "Year":
-        # Group by year and product
-        daily_summary_xe_may.set_index('Ngày', inplace=True)
-        daily_summary_xe_may_filtered = daily_summary_xe_may.groupby([pd.Grouper(freq='Y'), 'Loại sản phẩm']).sum().reset_index()
-
+    # Grouped by period and product from the daily rollup of the deliveries
+    daily_summary_xe_may_filtered = rollup.product_summary(data_xe_may, period)
     st.write(daily_summary_xe_may_filtered)
 
     st.subheader("Debt Management - Oto")
-    daily_summary_oto = generate_summary(data_oto)
-
-    if period == "Day":
-        daily_summary_oto_filtered = daily_summary_oto
-    elif period == "Week":
-        # Group by week and product
-        daily_summary_oto.set_index('Ngày', inplace=True)
-        daily_summary_oto_filtered = daily_summary_oto.groupby([pd.Grouper(freq='W'), 'Loại sản phẩm']).sum().reset_index()
-    elif period == "Month":
-        # Group by month and product
-        daily_summary_oto.set_index('Ngày', inplace=True)
-        daily_summary_oto_filtered = daily_summary_oto.groupby([pd.Grouper(freq='M'), 'Loại sản phẩm']).sum().reset_index()
-    elif period == "Year":
-        # Group by year and product
-        daily_summary_oto.set_index('Ngày', inplace=True)
-        daily_summary_oto_filtered = daily_summary_oto.groupby([pd.Grouper(freq='Y'), 'Loại sản phẩm']).sum().reset_index()
-
+    daily_summary_oto_filtered = rollup.product_summary(data_oto, period)
     st.write(daily_summary_oto_filtered)
-
-    conn.close()
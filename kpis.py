@@ -0,0 +1,104 @@
+import pandas as pd
+import customers
+import storage
+
+# Delivery KPIs, read from the kpi_monthly table instead of grouping the full delivery history.
+# kpi_monthly holds one row per (dimension, source, month, key) with that month's totals. Triggers on
+# Orders (storage._create_kpi_tables) record every (source, month) whose deliveries change in kpi_dirty,
+# and refresh_kpis recomputes only those months.
+
+# Name of the customer of an Orders row as the delivery sheets write it
+ORDER_CUSTOMER = "CASE WHEN o.street_name IS NOT NULL THEN o.customer_code || ' - ' || o.street_name ELSE o.customer_code END"
+
+# Dimension -> SQL for its key; drivers are handled separately since a delivery can have two.
+# A customer is counted under the customer its name is an alias of (see customers.py).
+KPI_DIMENSIONS = {
+    'customer': f'COALESCE(c.customer_name, {ORDER_CUSTOMER})',
+    'product': 'o.product_type',
+}
+
+
+# Orders rows of the dirty months; dates are 'YYYY-MM-DD', so a month is the range [month-01, month-32)
+# and the (source, date) index of Orders is used
+DIRTY_ORDERS = '''
+    kpi_dirty d
+    JOIN Orders o ON o.source = d.source AND o.date >= d.month || '-01' AND o.date < d.month || '-32'
+'''
+
+
+def refresh_kpis():
+    """ recompute the kpi_monthly rows of every (source, month) marked in kpi_dirty; returns the number of months """
+    with storage.transaction() as conn:
+        dirty_months = conn.execute('SELECT COUNT(*) FROM kpi_dirty').fetchone()[0]
+        if not dirty_months:
+            return 0
+        conn.execute('DELETE FROM kpi_monthly WHERE (source, month) IN (SELECT source, month FROM kpi_dirty)')
+        for dimension, key in KPI_DIMENSIONS.items():
+            conn.execute(f'''
+                INSERT INTO kpi_monthly (dimension, source, month, key, deliveries, quantity, returned, amount_paid)
+                SELECT ?, d.source, d.month, {key} AS kpi_key, COUNT(*),
+                       SUM(o.quantity_delivered), SUM(o.bottle_returned), SUM(o.amount_paid)
+                FROM {DIRTY_ORDERS}
+                {customers.customer_join(ORDER_CUSTOMER)}
+                WHERE {key} IS NOT NULL
+                GROUP BY d.source, d.month, kpi_key
+            ''', (dimension,))
+        # Each driver of a delivery is credited with the whole delivery
+        conn.execute(f'''
+            INSERT INTO kpi_monthly (dimension, source, month, key, deliveries, quantity, returned, amount_paid)
+            SELECT 'driver', source, month, driver, COUNT(*), SUM(quantity_delivered), SUM(bottle_returned), SUM(amount_paid)
+            FROM (
+                SELECT d.source, d.month, o.driver_1 AS driver, o.quantity_delivered, o.bottle_returned, o.amount_paid
+                FROM {DIRTY_ORDERS}
+                WHERE o.driver_1 IS NOT NULL
+                UNION ALL
+                SELECT d.source, d.month, o.driver_2, o.quantity_delivered, o.bottle_returned, o.amount_paid
+                FROM {DIRTY_ORDERS}
+                WHERE o.driver_2 IS NOT NULL AND o.driver_2 IS NOT o.driver_1
+            )
+            GROUP BY source, month, driver
+        ''')
+        conn.execute('DELETE FROM kpi_dirty')
+    return dirty_months
+
+
+def _source_condition(sources):
+    return f"source IN ({', '.join('?' * len(sources))})", list(sources)
+
+
+def kpi_totals(dimension, sources, start_month, end_month):
+    """ totals per key of one dimension from start_month to end_month ('YYYY-MM', both included),
+    with the shell return ratio, largest volume first """
+    condition, params = _source_condition(sources)
+    with storage.connection() as conn:
+        totals = pd.read_sql_query(f'''
+            SELECT key, SUM(deliveries) AS deliveries, SUM(quantity) AS quantity,
+                   SUM(returned) AS returned, SUM(amount_paid) AS amount_paid
+            FROM kpi_monthly
+            WHERE dimension = ? AND {condition} AND month >= ? AND month <= ?
+            GROUP BY key
+            ORDER BY quantity DESC
+        ''', conn, params=[dimension] + params + [start_month, end_month])
+    totals['return_ratio'] = totals['returned'] / totals['quantity'].where(totals['quantity'] != 0)
+    return totals
+
+
+def kpi_trend(dimension, sources, start_month, end_month):
+    """ delivered quantity per month and key of one dimension, months as rows """
+    condition, params = _source_condition(sources)
+    with storage.connection() as conn:
+        trend = pd.read_sql_query(f'''
+            SELECT month, key, SUM(quantity) AS quantity
+            FROM kpi_monthly
+            WHERE dimension = ? AND {condition} AND month >= ? AND month <= ?
+            GROUP BY month, key
+        ''', conn, params=[dimension] + params + [start_month, end_month])
+    return trend.pivot(index='month', columns='key', values='quantity').fillna(0)
+
+
+def kpi_months(sources):
+    """ the months ('YYYY-MM') that have KPIs for any of sources, oldest first """
+    condition, params = _source_condition(sources)
+    with storage.connection() as conn:
+        return [month for (month,) in conn.execute(
+            f"SELECT DISTINCT month FROM kpi_monthly WHERE dimension = 'product' AND {condition} ORDER BY month", params)]
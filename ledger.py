@@ -0,0 +1,147 @@
+from datetime import datetime
+import pandas as pd
+import customers
+import storage
+
+# Customer receivables. Every delivery in Orders is posted to the append-only receivables_ledger as
+# quantity x the customer's price for the product on the delivery date (amount_due, see price_history)
+# and the amount it paid (amount_paid).
+# receivables_posted keeps what each Orders row currently contributes, so posting a row again appends a
+# reversal of its previous entry followed by the new one, and receivable_balances holds the running
+# totals per customer. Deliveries are posted under the customer their label is an alias of, or under the
+# label itself when it has not been synced yet. Triggers (storage._create_receivables_tables) mark the
+# Orders rows to post in receivables_dirty; post_receivables only reads those.
+
+# Customer label of an Orders row, the names customers.customer_labels gives to customers.sync_customers:
+# '<customer> - <street>' for motorbike deliveries, the customer alone for truck deliveries and
+# motorbike deliveries without a street
+ORDER_CUSTOMER = ("CASE WHEN o.source = 'moto' AND o.street_name IS NOT NULL "
+                  "THEN o.customer_code || ' - ' || o.street_name ELSE o.customer_code END")
+
+LEDGER_COLUMNS = 'order_id, customer_name, date, quantity, amount_due, amount_paid, posted_at'
+# Entries that change nothing are not written
+NONZERO = 'quantity != 0 OR amount_due != 0 OR amount_paid != 0'
+
+
+def post_receivables():
+    """ post the Orders rows marked in receivables_dirty and fold the new ledger entries into the
+    customer balances; returns the number of ledger entries written """
+    with storage.transaction() as conn:
+        if conn.execute('SELECT 1 FROM receivables_dirty LIMIT 1').fetchone() is None:
+            return 0
+        last_entry = conn.execute('SELECT COALESCE(MAX(entry_id), 0) FROM receivables_ledger').fetchone()[0]
+        posted_at = datetime.now()
+
+        # What the rows that are still in Orders post now, at the customer's price on the delivery date
+        conn.execute(f'''
+            CREATE TEMP TABLE receivables_new AS
+            SELECT order_id, customer_name, product_name, date, quantity, price,
+                   COALESCE(quantity * price, 0) AS amount_due, amount_paid
+            FROM (
+                SELECT o.order_id, COALESCE(c.customer_name, {ORDER_CUSTOMER}) AS customer_name, o.product_type AS product_name, o.date,
+                       COALESCE(o.quantity_delivered, 0) AS quantity, COALESCE(o.amount_paid, 0) AS amount_paid,
+                       (SELECT h.price FROM price_history h
+                        WHERE h.customer_id = c.customer_id AND h.product_id = p.product_id AND h.effective_from <= o.date
+                        ORDER BY h.effective_from DESC LIMIT 1) AS price
+                FROM receivables_dirty d
+                JOIN Orders o ON o.order_id = d.order_id
+                {customers.customer_join(ORDER_CUSTOMER)}
+                LEFT JOIN products p ON p.product_name = o.product_type
+                WHERE {ORDER_CUSTOMER} IS NOT NULL
+            )
+        ''')
+        # A row that would post exactly what it posted before is left as it is
+        conn.execute('''
+            DELETE FROM receivables_dirty WHERE order_id IN (
+                SELECT n.order_id FROM receivables_new n JOIN receivables_posted p ON p.order_id = n.order_id
+                WHERE p.customer_name = n.customer_name AND p.product_name IS n.product_name AND p.date = n.date
+                  AND p.quantity = n.quantity AND p.price IS n.price
+                  AND p.amount_due = n.amount_due AND p.amount_paid = n.amount_paid
+            )
+        ''')
+
+        # Reverse what the rows posted before
+        conn.execute(f'''
+            INSERT INTO receivables_ledger ({LEDGER_COLUMNS})
+            SELECT p.order_id, p.customer_name, p.date, -p.quantity, -p.amount_due, -p.amount_paid, ?
+            FROM receivables_dirty d JOIN receivables_posted p ON p.order_id = d.order_id
+            WHERE {NONZERO}
+        ''', (posted_at,))
+        conn.execute('DELETE FROM receivables_posted WHERE order_id IN (SELECT order_id FROM receivables_dirty)')
+
+        # Post them again
+        conn.execute('''
+            INSERT INTO receivables_posted (order_id, customer_name, product_name, date, quantity, price, amount_due, amount_paid)
+            SELECT n.order_id, n.customer_name, n.product_name, n.date, n.quantity, n.price, n.amount_due, n.amount_paid
+            FROM receivables_dirty d JOIN receivables_new n ON n.order_id = d.order_id
+        ''')
+        conn.execute('DROP TABLE receivables_new')
+        conn.execute(f'''
+            INSERT INTO receivables_ledger ({LEDGER_COLUMNS})
+            SELECT p.order_id, p.customer_name, p.date, p.quantity, p.amount_due, p.amount_paid, ?
+            FROM receivables_dirty d JOIN receivables_posted p ON p.order_id = d.order_id
+            WHERE {NONZERO}
+        ''', (posted_at,))
+
+        # Fold the new entries into the balances; reversals do not move the last dates back
+        conn.execute('''
+            INSERT INTO receivable_balances (customer_name, quantity, amount_due, amount_paid, balance,
+                                             last_delivery, last_payment, updated_at)
+            SELECT customer_name, SUM(quantity), SUM(amount_due), SUM(amount_paid), SUM(amount_due) - SUM(amount_paid),
+                   MAX(CASE WHEN quantity > 0 THEN date END), MAX(CASE WHEN amount_paid > 0 THEN date END), ?
+            FROM receivables_ledger
+            WHERE entry_id > ?
+            GROUP BY customer_name
+            ON CONFLICT (customer_name) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                amount_due = amount_due + excluded.amount_due,
+                amount_paid = amount_paid + excluded.amount_paid,
+                balance = balance + excluded.balance,
+                last_delivery = COALESCE(MAX(last_delivery, excluded.last_delivery), last_delivery, excluded.last_delivery),
+                last_payment = COALESCE(MAX(last_payment, excluded.last_payment), last_payment, excluded.last_payment),
+                updated_at = excluded.updated_at
+        ''', (posted_at, last_entry))
+        conn.execute('DELETE FROM receivables_dirty')
+        return conn.execute('SELECT COUNT(*) FROM receivables_ledger WHERE entry_id > ?', (last_entry,)).fetchone()[0]
+
+
+def get_balance(customer_name):
+    """ the balance row of one customer as a dict, or None when nothing was delivered to it """
+    with storage.connection() as conn:
+        balances = pd.read_sql_query('SELECT * FROM receivable_balances WHERE customer_name = ?', conn,
+                                     params=(customer_name,))
+    return balances.iloc[0].to_dict() if not balances.empty else None
+
+
+def top_balances(limit=20):
+    """ the customers with the largest outstanding balance """
+    with storage.connection() as conn:
+        return pd.read_sql_query('SELECT * FROM receivable_balances ORDER BY balance DESC LIMIT ?', conn,
+                                 params=(limit,))
+
+
+def total_balance():
+    with storage.connection() as conn:
+        return conn.execute('SELECT COALESCE(SUM(balance), 0) FROM receivable_balances').fetchone()[0]
+
+
+def customer_ledger(customer_name, limit=200):
+    """ the latest ledger entries of one customer, newest first """
+    with storage.connection() as conn:
+        return pd.read_sql_query(f'''
+            SELECT entry_id, {LEDGER_COLUMNS} FROM receivables_ledger
+            WHERE customer_name = ?
+            ORDER BY entry_id DESC
+            LIMIT ?
+        ''', conn, params=(customer_name, limit))
+
+
+def unpriced_deliveries(customer_name):
+    """ the products delivered to a customer that has no price for them, with the quantity posted at 0 """
+    with storage.connection() as conn:
+        return pd.read_sql_query('''
+            SELECT product_name, COUNT(*) AS deliveries, SUM(quantity) AS quantity
+            FROM receivables_posted
+            WHERE customer_name = ? AND price IS NULL AND quantity != 0
+            GROUP BY product_name
+        ''', conn, params=(customer_name,))
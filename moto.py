@@ -1,5 +1,8 @@
 import streamlit as st
-import pandas as pd
+import filter_index
+import paged_table
+import delivery_stats
+import rollup
 
 # urls = [
 #     'https://docs.google.com/spreadsheets/d/e/2PACX-1vQjF-vOUyngQKPRXkYvKwIDMAAoK5Jm_RGblSz2FLJsRDmu8IwfwJpfgcPgAY16FmXMN3tBKIPslHem/pub?gid=568267471&single=true&output=csv',
@@ -46,101 +49,48 @@ import pandas as pd
 #     print(combined_data)
 #     return combined_data
 
-def display_statistics(filtered_data, period):
-    # Ensure datetime conversion for necessary columns
-    # Ensure datetime conversion for necessary columns
-    if 'Ngày' in filtered_data.columns:
-        filtered_data['Ngày'] = pd.to_datetime(filtered_data['Ngày'], errors='coerce')
-
-    if period == 'day':
-        filtered_data['Period'] = filtered_data['Ngày'].dt.date
-    elif period == 'week':
-        # Ensure week starts on Monday and ends on Sunday
-        filtered_data['Week_Start'] = filtered_data['Ngày'].dt.to_period('W').apply(lambda r: r.start_time)
-        filtered_data['Week_End'] = filtered_data['Week_Start'] + pd.Timedelta(days=6)
-        filtered_data['Period'] = filtered_data['Week_Start'].dt.strftime('%d/%m') + ' - ' + filtered_data['Week_End'].dt.strftime('%d/%m')
-    elif period == 'month':
-        filtered_data['Month_Start'] = filtered_data['Ngày'].dt.to_period('M').dt.start_time
-        filtered_data['Month_End'] = filtered_data['Month_Start'] + pd.offsets.MonthEnd(1)
-        filtered_data['Period'] = filtered_data['Month_Start'].dt.strftime('%d/%m') + ' - ' + filtered_data['Month_End'].dt.strftime('%d/%m')
-    elif period == 'quarter':
-        filtered_data['Quarter_Start'] = filtered_data['Ngày'].dt.to_period('Q').dt.start_time
-        filtered_data['Quarter_End'] = filtered_data['Quarter_Start'] + pd.offsets.QuarterEnd(startingMonth=3)
-        filtered_data['Period'] = filtered_data['Quarter_Start'].dt.strftime('%d/%m') + ' - ' + filtered_data['Quarter_End'].dt.strftime('%d/%m')
-    elif period == 'year':
-        filtered_data['Year_Start'] = filtered_data['Ngày'].dt.to_period('A').dt.start_time
-        filtered_data['Year_End'] = filtered_data['Year_Start'] + pd.offsets.YearEnd()
-        filtered_data['Period'] = filtered_data['Year_Start'].dt.strftime('%d/%m') + ' - ' + filtered_data['Year_End'].dt.strftime('%d/%m')
-    else:
-        raise ValueError("Unsupported period type specified.")
-
-    grouped = filtered_data.dropna(subset=['Period']).groupby('Period')
-
-    stats = grouped.agg({
-        'Số lượng Giao': 'sum',
-        'Thanh Toán': 'sum',
-        'Phương Thức Thanh Toán': lambda x: x.value_counts().to_dict()
-    }).reset_index()
-
-    # Convert the Period column to datetime for proper sorting
-    if period == 'week':
-        stats['Period_Start'] = pd.to_datetime(stats['Period'].str.split(' - ').str[0], format='%d/%m')
-    elif period == 'month':
-        stats['Period_Start'] = pd.to_datetime(stats['Period'].str.split(' - ').str[0], format='%d/%m')
-    elif period == 'quarter':
-        stats['Period_Start'] = pd.to_datetime(stats['Period'].str.split(' - ').str[0], format='%d/%m')
-    elif period == 'year':
-        stats['Period_Start'] = pd.to_datetime(stats['Period'].str.split(' - ').str[0], format='%d/%m')
-
-    if period in ['week', 'month', 'quarter', 'year']:
-        stats = stats.sort_values(by='Period_Start', ascending=False).drop(columns='Period_Start')
-    else:
-        stats = stats.sort_values(by='Period', ascending=False)
-
-    return stats
-
-
-
 def display_moto_data(data):
 
     #data = load_data_from_urls(urls)
 
     st.sidebar.title("Bộ lọc dữ liệu cho Xe Máy")
-    period = st.sidebar.selectbox("Chọn khoảng thời gian", ['day', 'week', 'month', 'quarter', 'year'])
+    period = st.sidebar.selectbox("Chọn khoảng thời gian", delivery_stats.PERIODS)
     date_range = st.sidebar.date_input("Chọn khoảng ngày", [])
 
-    customer_filter = st.sidebar.multiselect("Chọn khách hàng", options=data['Khách hàng'].unique())
-    product_type_filter = st.sidebar.multiselect("Chọn loại sản phẩm", options=data['Loại sản phẩm'].unique())
-    street_filter = st.sidebar.multiselect("Chọn Tên đường", options=data['Tên đường'].unique())
-    payment_method_filter = st.sidebar.multiselect("Chọn Phương Thức Thanh Toán", options=data['Phương Thức Thanh Toán'].unique())
-
-    filtered_data = data
-    if date_range:
-        start_date = pd.Timestamp(date_range[0])  # Convert to Timestamp
-        end_date = pd.Timestamp(date_range[1])    # Convert to Timestamp
-        filtered_data = filtered_data[(filtered_data['Ngày'] >= start_date) & (filtered_data['Ngày'] <= end_date)]
-    
-    if customer_filter:
-        filtered_data = filtered_data[filtered_data['Khách hàng'].isin(customer_filter)]
-    if product_type_filter:
-        filtered_data = filtered_data[filtered_data['Loại sản phẩm'].isin(product_type_filter)]
-    if street_filter:
-        filtered_data = filtered_data[filtered_data['Tên đường'].isin(street_filter)]
-    if payment_method_filter:
-        filtered_data = filtered_data[filtered_data['Phương Thức Thanh Toán'].isin(payment_method_filter)]
+    index = filter_index.get_filter_index(data, ['Khách hàng', 'Loại sản phẩm', 'Tên đường', 'Phương Thức Thanh Toán'])
+    customer_filter = st.sidebar.multiselect("Chọn khách hàng", options=index.options('Khách hàng'))
+    product_type_filter = st.sidebar.multiselect("Chọn loại sản phẩm", options=index.options('Loại sản phẩm'))
+    street_filter = st.sidebar.multiselect("Chọn Tên đường", options=index.options('Tên đường'))
+    payment_method_filter = st.sidebar.multiselect("Chọn Phương Thức Thanh Toán", options=index.options('Phương Thức Thanh Toán'))
+
+    # The date range only applies once both ends have been picked
+    date_range = date_range if len(date_range) == 2 else None
+    filters = {
+        'Khách hàng': customer_filter,
+        'Loại sản phẩm': product_type_filter,
+        'Tên đường': street_filter,
+        'Phương Thức Thanh Toán': payment_method_filter,
+    }
+    rows = index.rows(date_range, filters)
+    filtered_data = data if rows is None else data.take(rows)
 
     # Convert 'Ngày' to the desired format for display
     #filtered_data['Ngày'] = filtered_data['Ngày'].dt.strftime('%d/%m/%Y')
 
     # Display statistics
-    stats = display_statistics(filtered_data, period)
+    # Served from the daily rollup unless a filter is on a column the rollup does not keep
+    cube = rollup.find_cube(data, filters)
+    if cube is not None:
+        stats = rollup.statistics(cube, period, date_range, filters)
+    else:
+        stats = delivery_stats.display_statistics(filtered_data, period)
     st.write(f"Thống kê theo {period}", stats)
 
-    # Display the DataFrame in a scrollable container
+    # Display the filtered rows one page at a time
     if filtered_data.empty:
         st.write("No data matches the filters.")
     else:
-        st.dataframe(filtered_data, height=600)  # Show filtered data
+        paged_table.display_paged_table(data, rows, 'moto')
 
     # Show overall statistics regardless of filtering
     overall_stats = filtered_data.agg({
@@ -0,0 +1,78 @@
+import math
+import numpy as np
+import pandas as pd
+import streamlit as st
+import frame_cache
+
+# One page of a filtered delivery frame at a time. The rows to show come from filter_index as row
+# positions, so only the rows of the page are taken from the frame and sent to the browser; the sort
+# order of a column is computed once per frame and reused for every filter, page and rerun.
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+def _sort_key(values):
+    """ integer keys that order the values of a column ascending, missing values last """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # By value rather than by the order the categories were first seen in
+        categories = values.cat.categories
+        category_rank = np.empty(len(categories), dtype=np.int64)
+        category_rank[np.argsort(categories.astype(str), kind='stable')] = np.arange(len(categories))
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, category_rank[codes], len(categories)), len(categories)
+    codes, uniques = pd.factorize(values, sort=True)
+    return np.where(codes >= 0, codes, len(uniques)), len(uniques)
+
+
+def _sort_order(data, column, descending):
+    """ row positions of data in the stable sort by column """
+    def build():
+        key, missing = _sort_key(data[column])
+        if descending:
+            key = np.where(key < missing, missing - 1 - key, missing)
+        return np.argsort(key, kind='stable')
+    return frame_cache.get_or_build(data, ('sort_order', column, descending), build)
+
+
+def page_rows(data, rows, sort_column=None, descending=False, page=1, page_size=PAGE_SIZES[0]):
+    """ (page of data, total number of rows) for the row positions rows (all rows when None), sorted by
+    sort_column, or in the frame's order when it is None. page counts from 1. """
+    total = len(data) if rows is None else len(rows)
+    start = (page - 1) * page_size
+    if sort_column is None:
+        selected = np.arange(start, min(start + page_size, total)) if rows is None else rows[start:start + page_size]
+        return data.take(selected), total
+
+    order = _sort_order(data, sort_column, descending)
+    if rows is not None:
+        # The sorted positions that are among rows, in one pass without sorting rows again
+        selected_rows = np.zeros(len(data), dtype=bool)
+        selected_rows[rows] = True
+        order = order[selected_rows[order]]
+    selected = order[start:start + page_size]
+    return data.take(selected), total
+
+
+def display_paged_table(data, rows, key, default_sort='Ngày'):
+    """ the rows of data at positions rows (all rows when None) one page at a time, with the page size,
+    sort column and page number picked above the table; key keeps the widgets of each page apart """
+    columns = list(data.columns)
+    col1, col2, col3, col4 = st.columns(4)
+    page_size = col1.selectbox("Số dòng mỗi trang", PAGE_SIZES, key=f'{key}_page_size')
+    sort_column = col2.selectbox("Sắp xếp theo", columns,
+                                 index=columns.index(default_sort) if default_sort in columns else 0,
+                                 key=f'{key}_sort_column')
+    descending = col3.radio("Thứ tự", ["Giảm dần", "Tăng dần"], key=f'{key}_sort_order') == "Giảm dần"
+
+    total = len(data) if rows is None else len(rows)
+    pages = max(1, math.ceil(total / page_size))
+    page = col4.number_input("Trang", min_value=1, value=1, step=1, key=f'{key}_page')
+    # The page picked before a filter changed may be past the last page now
+    page = min(int(page), pages)
+
+    if (sort_column, descending) == (default_sort, True):
+        # The delivery frames are already sorted newest first
+        sort_column = None
+    table, total = page_rows(data, rows, sort_column, descending, page, page_size)
+    st.dataframe(table, height=600)
+    st.caption(f"Trang {page}/{pages} - {total:,} dòng")
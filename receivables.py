@@ -0,0 +1,51 @@
+from datetime import datetime
+import streamlit as st
+import formatting
+import ledger
+import storage
+
+# Page of the customer receivables (see ledger.py)
+
+
+def _days_since(date):
+    return (datetime.now() - datetime.strptime(date, '%Y-%m-%d')).days if date else None
+
+
+def display_receivables():
+    st.title("Công nợ khách hàng")
+
+    storage.init_db()
+    ledger.post_receivables()
+
+    st.metric("Tổng công nợ", formatting.format_currency(ledger.total_balance()))
+
+    st.header("Khách hàng nợ nhiều nhất")
+    top = st.slider("Số khách hàng hiển thị", 5, 100, 20)
+    debtors = ledger.top_balances(top)
+    st.dataframe(debtors.rename(columns={
+        'customer_name': 'Khách hàng', 'quantity': 'Số lượng', 'amount_due': 'Phải thu', 'amount_paid': 'Đã trả',
+        'balance': 'Còn nợ', 'last_delivery': 'Giao gần nhất', 'last_payment': 'Trả gần nhất', 'updated_at': 'Cập nhật'}))
+
+    st.header("Chi tiết khách hàng")
+    customer_name = st.text_input("Khách hàng", value=debtors['customer_name'].iloc[0] if not debtors.empty else '')
+    if not customer_name:
+        return
+    balance = ledger.get_balance(customer_name)
+    if balance is None:
+        st.write("Không có giao hàng cho khách hàng này.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Còn nợ", formatting.format_currency(balance['balance']))
+    days = _days_since(balance['last_payment'])
+    col2.metric("Ngày từ lần trả gần nhất", days if days is not None else "Chưa trả")
+    days = _days_since(balance['last_delivery'])
+    col3.metric("Ngày từ lần giao gần nhất", days if days is not None else "-")
+
+    unpriced = ledger.unpriced_deliveries(customer_name)
+    if not unpriced.empty:
+        st.warning("Một số sản phẩm chưa có giá cho khách hàng này, phần giao hàng đó chưa được tính nợ.")
+        st.write(unpriced)
+
+    st.subheader("Sổ công nợ")
+    st.dataframe(ledger.customer_ledger(customer_name))
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import delivery_stats
+import frame_cache
+
+# Keys of the detailed daily cube besides the date, when the frame has them. The moto customer label
+# already includes the street, so the extra customer and street keys do not grow the cube.
+CUBE_DIMENSIONS = ['Loại sản phẩm', 'Khách hàng', 'Khách hàng ( Hoặc số địa chỉ)', 'Tên đường',
+                   'Phương Thức Thanh Toán']
+# Keys of the summary cube, which is rolled up from the detailed one and has no customer dimension
+SUMMARY_DIMENSIONS = ['Loại sản phẩm', 'Phương Thức Thanh Toán']
+CUBE_MEASURES = ['Số lượng Giao', 'Thanh Toán', 'Vỏ về']
+# Number of delivery rows summed into a cube row
+COUNT_COLUMN = 'Số đơn'
+
+# Inventory period choices and the pandas Grouper frequency of each (labels are the period end)
+PRODUCT_PERIOD_FREQUENCIES = {'Week': 'W', 'Month': 'ME', 'Year': 'YE'}
+
+
+def _roll_up(data, dates, dimensions, measures, counts=None):
+    keys = [dates] + [data[column] for column in dimensions if column in data.columns]
+    grouped = data[[column for column in measures if column in data.columns]].groupby(keys, observed=True, dropna=False)
+    cube = grouped.sum()
+    cube[COUNT_COLUMN] = grouped.size() if counts is None else counts.groupby(keys, observed=True, dropna=False).sum()
+    return cube.reset_index()
+
+
+def build_daily_cubes(data):
+    """ (summary cube, detailed cube) of data: one row per day and combination of the cube's dimensions,
+    with the summed CUBE_MEASURES and the number of delivery rows behind it """
+    detailed = _roll_up(data, data['Ngày'].dt.normalize(), CUBE_DIMENSIONS, CUBE_MEASURES)
+    summary = _roll_up(detailed, detailed['Ngày'], SUMMARY_DIMENSIONS, CUBE_MEASURES, detailed[COUNT_COLUMN])
+    return summary, detailed
+
+
+def get_daily_cubes(data):
+    """ the daily cubes of data, smallest first, computed once per data load """
+    return frame_cache.get_or_build(data, 'daily_cubes', lambda: build_daily_cubes(data))
+
+
+def find_cube(data, filters):
+    """ the smallest daily cube of data that keeps every column with an active filter, or None """
+    for cube in get_daily_cubes(data):
+        if covers(cube, filters):
+            return cube
+    return None
+
+
+def covers(cube, filters):
+    """ True when every active filter is on a key of the cube """
+    return all(column in cube.columns for column, selected in filters.items() if selected)
+
+
+def select(cube, date_range=None, filters=None):
+    """ the cube rows inside date_range (both ends included) and matching filters ({column: [values]}) """
+    keep = np.ones(len(cube), dtype=bool)
+    if date_range:
+        keep &= ((cube['Ngày'] >= pd.Timestamp(date_range[0])) & (cube['Ngày'] <= pd.Timestamp(date_range[1]))).to_numpy()
+    for column, selected in (filters or {}).items():
+        if selected:
+            keep &= cube[column].isin(selected).to_numpy()
+    return cube if keep.all() else cube[keep]
+
+
+def statistics(cube, period, date_range=None, filters=None):
+    """ delivery_stats.display_statistics of the deliveries matching the filters, computed from the cube """
+    selected = select(cube, date_range, filters)
+    return delivery_stats.display_statistics(selected, period, selected[COUNT_COLUMN])
+
+
+def build_product_days(data):
+    cube = get_daily_cubes(data)[0]
+    return cube.groupby(['Ngày', 'Loại sản phẩm'], observed=True)[['Số lượng Giao', 'Vỏ về']].sum().reset_index()
+
+
+def product_summary(data, period):
+    """ delivered quantity and returned shells per product and period ('Day', 'Week', 'Month' or 'Year'),
+    derived from the daily cube """
+    product_days = frame_cache.get_or_build(data, 'product_days', lambda: build_product_days(data))
+    if period == 'Day':
+        return product_days
+    grouper = pd.Grouper(key='Ngày', freq=PRODUCT_PERIOD_FREQUENCIES[period])
+    return product_days.groupby([grouper, 'Loại sản phẩm'], observed=True).sum().reset_index()
@@ -0,0 +1,114 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+from datetime import datetime
+import calendar
+import attendance
+import formatting
+import storage
+
+# Bảng lương theo (nhân viên, tháng) được lưu trong bảng payroll, các tháng đã tính xong trong
+# payroll_months. Trigger trên attendance và employees (storage._create_payroll_table) xóa dòng lương
+# của đúng nhân viên và tháng bị thay đổi, nên chỉ những dòng đó phải tính lại.
+
+# Tổng ngày công của các (nhân viên, tháng 'YYYY-MM') có chấm công nhưng chưa có dòng lương
+STALE_PAYROLL_QUERY = '''
+    SELECT attendance.employee_id, substr(attendance.date, 1, 7) AS month, SUM(attendance.presence) AS presence
+    FROM attendance
+    JOIN employees ON attendance.employee_id = employees.employee_id
+    LEFT JOIN payroll ON payroll.employee_id = attendance.employee_id AND payroll.month = substr(attendance.date, 1, 7)
+    WHERE attendance.date >= ? AND attendance.date < ? AND payroll.employee_id IS NULL
+    GROUP BY attendance.employee_id, substr(attendance.date, 1, 7)
+'''
+
+PAYROLL_QUERY = '''
+    SELECT payroll.month, employees.employee_name, payroll.presence, payroll.work_days,
+           payroll.base_salary, payroll.allowance, payroll.insurance, payroll.net_pay
+    FROM payroll
+    JOIN employees ON payroll.employee_id = employees.employee_id
+    WHERE payroll.month >= ? AND payroll.month <= ?
+    ORDER BY payroll.month, employees.employee_name
+'''
+
+# Các tháng 'YYYY-MM' từ tháng đầu đến tháng cuối (tính cả hai tháng)
+def month_keys(start_year, start_month, end_year, end_month):
+    months = pd.period_range(f"{start_year:04d}-{start_month:02d}", f"{end_year:04d}-{end_month:02d}", freq='M')
+    return [str(month) for month in months]
+
+# Lương của các dòng chấm công đã cộng theo tháng: ngày công / số ngày làm việc x lương cơ bản
+# + phụ cấp - bảo hiểm, tính cho tất cả các dòng cùng lúc
+def compute_pay(presence, work_days, base_salary, allowance, insurance):
+    return np.asarray(presence) / np.asarray(work_days) * np.asarray(base_salary) + np.asarray(allowance) - np.asarray(insurance)
+
+# Tính và lưu lương còn thiếu của các tháng 'YYYY-MM' trong months; trả về số dòng đã tính
+def refresh_payroll(months):
+    with storage.transaction() as conn:
+        done = {month for (month,) in conn.execute('SELECT month FROM payroll_months WHERE month >= ? AND month <= ?',
+                                                    (months[0], months[-1]))}
+        todo = [month for month in months if month not in done]
+        if not todo:
+            return 0
+        conn.executemany('INSERT OR IGNORE INTO payroll_months (month) VALUES (?)', [(month,) for month in todo])
+
+        start = f"{todo[0]}-01"
+        end = attendance.month_range(*todo[-1].split('-'))[1]
+        stale = pd.read_sql_query(STALE_PAYROLL_QUERY, conn, params=(start, end))
+        if stale.empty:
+            return 0
+        employees = pd.read_sql_query('SELECT employee_id, base_salary, allowance, insurance FROM employees', conn)
+        stale = stale.merge(employees, on='employee_id')
+
+        # Số ngày làm việc (không tính chủ nhật) của từng tháng, lấy từ lịch tháng đã tính sẵn
+        work_days = {month: attendance.month_calendar(*map(int, month.split('-')))[2] for month in stale['month'].unique()}
+        stale['work_days'] = stale['month'].map(work_days)
+        stale['net_pay'] = compute_pay(stale['presence'], stale['work_days'], stale['base_salary'],
+                                       stale['allowance'], stale['insurance'])
+
+        columns = ['employee_id', 'month', 'presence', 'work_days', 'base_salary', 'allowance', 'insurance', 'net_pay']
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO payroll ({', '.join(columns)}, computed_at)
+            VALUES ({', '.join('?' * len(columns))}, ?)
+        ''', [row + (datetime.now(),) for row in stale[columns].astype(object).itertuples(index=False, name=None)])
+    return len(stale)
+
+# Bảng lương của mọi nhân viên có chấm công trong các tháng từ (năm, tháng) đầu đến (năm, tháng) cuối.
+# Chỉ những (nhân viên, tháng) chưa có hoặc đã thay đổi mới được tính lại.
+def get_payroll(start_year, start_month, end_year, end_month):
+    months = month_keys(start_year, start_month, end_year, end_month)
+    if not months:
+        return pd.DataFrame()
+    storage.init_db()
+    refresh_payroll(months)
+    with storage.connection() as conn:
+        return pd.read_sql_query(PAYROLL_QUERY, conn, params=(months[0], months[-1]))
+
+# Hiển thị giao diện bảng tính lương
+def display_payroll():
+    st.title("Bảng Tính Lương")
+
+    now = datetime.now()
+    years = list(range(2024, now.year + 1))
+    col1, col2 = st.columns(2)
+    with col1:
+        start_month = st.selectbox("Từ tháng", list(range(1, 13)), index=now.month - 1, format_func=lambda x: calendar.month_name[x])
+        start_year = st.selectbox("Từ năm", years, index=len(years) - 1)
+    with col2:
+        end_month = st.selectbox("Đến tháng", list(range(1, 13)), index=now.month - 1, format_func=lambda x: calendar.month_name[x])
+        end_year = st.selectbox("Đến năm", years, index=len(years) - 1)
+
+    payroll = get_payroll(start_year, start_month, end_year, end_month)
+    if payroll.empty:
+        st.write("Chưa có dữ liệu chấm công trong khoảng thời gian này.")
+        return
+
+    st.header("Bảng lương")
+    display = payroll.rename(columns={
+        'month': 'Tháng', 'employee_name': 'Nhân viên', 'presence': 'Ngày công', 'work_days': 'Ngày làm việc',
+        'base_salary': 'Lương cơ bản', 'allowance': 'Phụ cấp', 'insurance': 'Bảo hiểm', 'net_pay': 'Thực lĩnh'})
+    for column in ['Lương cơ bản', 'Phụ cấp', 'Bảo hiểm', 'Thực lĩnh']:
+        display[column] = display[column].map(formatting.format_currency)
+    st.write(display)
+
+    st.header("Tổng lương theo tháng")
+    totals = payroll.groupby('month')['net_pay'].sum().map(formatting.format_currency)
+    st.write(totals.rename_axis('Tháng').rename('Thực lĩnh'))
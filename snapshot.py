@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+# Typed columnar copies of loaded frames in Arrow/Feather files, read back through a memory map on a cold
+# start instead of rebuilding the frames from the database or the sheets. Category, nullable integer and
+# datetime columns come back with the dtypes they were written with. pyarrow is optional: without it no
+# snapshot is written and reading one returns None.
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = feather = None
+
+SNAPSHOT_DIR = 'snapshots'
+# Schema metadata key of the state a snapshot was written with
+STATE_KEY = b'snapshot_state'
+
+
+def available():
+    return feather is not None
+
+
+def snapshot_name(prefix, key, version):
+    """ a file-name-safe name for the snapshot of key (e.g. the cache key of a set of sheet URLs). version is that
+    of the frames' schema, so a snapshot written before the schema changed is not read back. """
+    return f"{prefix}_v{version}_{hashlib.sha1(repr(key).encode()).hexdigest()[:12]}"
+
+
+def snapshot_path(name, part, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, f'{name}.{part}.feather')
+
+
+def write_snapshot(name, frames, directory=SNAPSHOT_DIR, state=None):
+    """ write each frame of {part: DataFrame} to its own file; returns False when pyarrow is missing.
+    state, a string describing what the frames were built from, is kept in the file metadata for
+    has_snapshot to compare. Files are uncompressed so they can be memory-mapped, and replaced atomically. """
+    if feather is None:
+        return False
+    os.makedirs(directory, exist_ok=True)
+    for part, frame in frames.items():
+        path = snapshot_path(name, part, directory)
+        table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+        if state is not None:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), STATE_KEY: state.encode()})
+        feather.write_feather(table, path + '.tmp', compression='uncompressed')
+        os.replace(path + '.tmp', path)
+    return True
+
+
+def _state(path):
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(STATE_KEY, b'').decode() or None
+
+
+def has_snapshot(name, parts, directory=SNAPSHOT_DIR, state=None):
+    """ whether every part of the snapshot has a file, written with state when state is given """
+    if feather is None or not all(os.path.exists(snapshot_path(name, part, directory)) for part in parts):
+        return False
+    try:
+        return state is None or all(_state(snapshot_path(name, part, directory)) == state for part in parts)
+    except (OSError, pa.ArrowInvalid):
+        return False
+
+
+def read_snapshot(name, parts, directory=SNAPSHOT_DIR, state=None):
+    """ {part: DataFrame} of a snapshot, or None when pyarrow is missing or a part has no readable file
+    (written with state, when state is given) """
+    if not has_snapshot(name, parts, directory, state):
+        return None
+    paths = {part: snapshot_path(name, part, directory) for part in parts}
+    try:
+        return {part: feather.read_table(path, memory_map=True).to_pandas() for part, path in paths.items()}
+    except (OSError, pa.ArrowInvalid) as e:
+        print(f"Error reading snapshot {name}: {e}")
+        return None
@@ -0,0 +1,794 @@
+import os
+import threading
+import db
+
+# The one database of the app. Its schema is versioned with PRAGMA user_version: MIGRATIONS[i]
+# upgrades a database at version i to version i + 1, so every migration runs exactly once.
+DB_FILE = 'ngocvu.db'
+
+# Databases of the app before they were merged into DB_FILE (read by the merge migration, never written)
+# delivery_data.db goes first so its product and customer ids are kept
+LEGACY_FILES = {
+    'delivery_data': 'delivery_data.db',
+    'customer_pricing': 'customer_pricing.db',
+    'company': 'company.db',
+    'ngocvu_data': 'ngocvu_data.db',
+    'time_tracking': 'time_tracking.db',
+}
+
+# Local copy of the delivery sheets, kept up to date by delivery_store.sync_sheet_chunks
+sql_create_orders_table = """ CREATE TABLE IF NOT EXISTS Orders (
+                                order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                date TEXT NOT NULL,
+                                customer_code TEXT,
+                                street_name TEXT,
+                                product_type TEXT,
+                                bottle_type TEXT,
+                                quantity_delivered INTEGER,
+                                bottle_returned INTEGER,
+                                amount_paid REAL,
+                                payment_method TEXT,
+                                driver_1 TEXT,
+                                driver_2 TEXT,
+                                source TEXT,
+                                sheet_url TEXT,
+                                sheet_row INTEGER,
+                                row_hash INTEGER
+                            ); """
+
+# One row per synced Google Sheet: how far the local Orders copy has caught up
+sql_create_sheet_sync_table = """ CREATE TABLE IF NOT EXISTS SheetSync (
+                                    sheet_url TEXT PRIMARY KEY,
+                                    source TEXT NOT NULL,
+                                    row_count INTEGER NOT NULL,
+                                    last_date TEXT,
+                                    sheet_hash TEXT NOT NULL,
+                                    columns TEXT,
+                                    synced_at TIMESTAMP
+                                ); """
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _create_schema(conn):
+    """ version 1: every table of the app in one database """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id INTEGER PRIMARY KEY,
+            customer_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            product_id INTEGER PRIMARY KEY,
+            product_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS prices (
+            price_id INTEGER PRIMARY KEY,
+            customer_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            price REAL,
+            last_updated TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
+            FOREIGN KEY (product_id) REFERENCES products (product_id),
+            UNIQUE (customer_id, product_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            product_id INTEGER PRIMARY KEY,
+            quantity INTEGER,
+            last_updated TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (product_id)
+        )
+    ''')
+    # source_key: natural key of the delivery row a sale came from (NULL for sales entered before it existed)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            sale_id INTEGER PRIMARY KEY,
+            product_id INTEGER,
+            quantity INTEGER,
+            sale_date DATE,
+            source_key TEXT,
+            FOREIGN KEY (product_id) REFERENCES products (product_id)
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_source_key ON sales (source_key)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            employee_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_name TEXT NOT NULL,
+            base_salary REAL NOT NULL,
+            allowance REAL NOT NULL,
+            insurance REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER,
+            date TEXT,
+            presence REAL,
+            FOREIGN KEY (employee_id) REFERENCES employees (employee_id),
+            UNIQUE(employee_id, date)
+        )
+    ''')
+    conn.execute(sql_create_orders_table)
+    conn.execute(sql_create_sheet_sync_table)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_sheet_row ON Orders (sheet_url, sheet_row)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_source_date ON Orders (source, date)')
+
+
+def _legacy_tables(conn, alias):
+    return {name for (name,) in conn.execute(f"SELECT name FROM {alias}.sqlite_master WHERE type = 'table'")}
+
+
+def _legacy_columns(conn, alias, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {alias}.table_info({table})')]
+
+
+def _merge_customers_and_products(conn, alias, tables):
+    if 'customers' in tables:
+        conn.execute(f'INSERT OR IGNORE INTO customers (customer_name) SELECT customer_name FROM {alias}.customers')
+    if 'products' in tables:
+        conn.execute(f'INSERT OR IGNORE INTO products (product_name) SELECT product_name FROM {alias}.products')
+
+
+def _merge_prices(conn, alias, tables):
+    """ prices keyed by customer and product name; the most recently updated price wins """
+    if 'prices' not in tables:
+        return
+    if 'product_id' in _legacy_columns(conn, alias, 'prices'):
+        product_name = f'(SELECT product_name FROM {alias}.products lp WHERE lp.product_id = pr.product_id)'
+    else:
+        product_name = 'pr.product_name'
+    conn.execute(f'''
+        INSERT OR IGNORE INTO products (product_name)
+        SELECT {product_name} FROM {alias}.prices pr WHERE {product_name} IS NOT NULL
+    ''')
+    conn.execute(f'''
+        INSERT INTO prices (customer_id, product_id, price, last_updated)
+        SELECT c.customer_id, p.product_id, pr.price, pr.last_updated
+        FROM {alias}.prices pr
+        JOIN {alias}.customers lc ON lc.customer_id = pr.customer_id
+        JOIN customers c ON c.customer_name = lc.customer_name
+        JOIN products p ON p.product_name = {product_name}
+        WHERE true
+        ON CONFLICT(customer_id, product_id) DO UPDATE SET
+        price = excluded.price,
+        last_updated = excluded.last_updated
+        WHERE excluded.last_updated > prices.last_updated OR prices.last_updated IS NULL
+    ''')
+
+
+def _merge_inventory_and_sales(conn, alias, tables):
+    if 'inventory' in tables:
+        last_updated = 'li.last_updated' if 'last_updated' in _legacy_columns(conn, alias, 'inventory') else 'NULL'
+        # delivery_data.db could hold several rows per product; the last one is the current quantity
+        order_column = 'inventory_id' if 'inventory_id' in _legacy_columns(conn, alias, 'inventory') else 'product_id'
+        conn.execute(f'''
+            INSERT OR REPLACE INTO inventory (product_id, quantity, last_updated)
+            SELECT p.product_id, li.quantity, {last_updated}
+            FROM {alias}.inventory li
+            JOIN {alias}.products lp ON lp.product_id = li.product_id
+            JOIN products p ON p.product_name = lp.product_name
+            ORDER BY li.{order_column}
+        ''')
+    if 'sales' in tables:
+        source_key = 'ls.source_key' if 'source_key' in _legacy_columns(conn, alias, 'sales') else 'NULL'
+        conn.execute(f'''
+            INSERT OR IGNORE INTO sales (product_id, quantity, sale_date, source_key)
+            SELECT p.product_id, ls.quantity, ls.sale_date, {source_key}
+            FROM {alias}.sales ls
+            JOIN {alias}.products lp ON lp.product_id = ls.product_id
+            JOIN products p ON p.product_name = lp.product_name
+            ORDER BY ls.sale_id
+        ''')
+
+
+def _merge_employees(conn, alias, tables):
+    if 'employees' in tables:
+        conn.execute(f'''
+            INSERT OR IGNORE INTO employees (employee_id, employee_name, base_salary, allowance, insurance)
+            SELECT employee_id, employee_name, base_salary, allowance, insurance FROM {alias}.employees
+        ''')
+    if 'attendance' in tables:
+        conn.execute(f'''
+            INSERT OR IGNORE INTO attendance (employee_id, date, presence)
+            SELECT employee_id, date, presence FROM {alias}.attendance
+        ''')
+    # time_tracking.db: presence by employee name, from before the attendance table
+    if 'time_tracking' in tables:
+        conn.execute(f'''
+            INSERT OR IGNORE INTO attendance (employee_id, date, presence)
+            SELECT e.employee_id, t.date, t.presence
+            FROM {alias}.time_tracking t
+            JOIN employees e ON e.employee_name = t.employee_name
+        ''')
+
+
+def _merge_orders(conn, alias, tables):
+    for table in ('Orders', 'SheetSync'):
+        if table not in tables:
+            continue
+        current = _legacy_columns(conn, 'main', table)
+        columns = ', '.join(column for column in _legacy_columns(conn, alias, table) if column in current)
+        conn.execute(f'INSERT OR IGNORE INTO {table} ({columns}) SELECT {columns} FROM {alias}.{table}')
+
+
+def _attach_legacy_files(conn):
+    """ attach the LEGACY_FILES that exist, under their aliases; ATTACH is not allowed inside a transaction,
+    so migrate calls this before the merge migration begins """
+    for alias, path in LEGACY_FILES.items():
+        if os.path.exists(path) and os.path.abspath(path) != os.path.abspath(DB_FILE):
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+
+
+def _merge_legacy_files(conn):
+    """ version 2: copy the data of the attached LEGACY_FILES into the new tables, all in one transaction.
+    Customers and products are matched by name, so the copies in customer_pricing.db and
+    delivery_data.db become one list. The unused Customers and Streets tables of ngocvu_data.db are
+    not carried over. """
+    attached = {name for (_, name, _) in conn.execute('PRAGMA database_list')}
+    for alias in [alias for alias in LEGACY_FILES if alias in attached]:
+        tables = _legacy_tables(conn, alias)
+        _merge_customers_and_products(conn, alias, tables)
+        _merge_prices(conn, alias, tables)
+        _merge_inventory_and_sales(conn, alias, tables)
+        _merge_employees(conn, alias, tables)
+        _merge_orders(conn, alias, tables)
+        print(f"Merged {LEGACY_FILES[alias]} into {DB_FILE}")
+
+
+def _index_attendance_by_date(conn):
+    """ version 3: month lookups of attendance are a range on date; the index also covers
+    employee_id and presence so they never read the table itself """
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date, employee_id, presence)')
+
+
+def _create_payroll_table(conn):
+    """ version 4: computed pay per employee and month ('YYYY-MM'), see salary.py, and the months whose
+    payroll is complete. The triggers drop the rows and months whose inputs change, so
+    salary.refresh_payroll only recomputes those. """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payroll (
+            employee_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            presence REAL,
+            work_days INTEGER,
+            base_salary REAL,
+            allowance REAL,
+            insurance REAL,
+            net_pay REAL,
+            computed_at TIMESTAMP,
+            PRIMARY KEY (employee_id, month),
+            FOREIGN KEY (employee_id) REFERENCES employees (employee_id)
+        )
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS payroll_months (month TEXT PRIMARY KEY)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS payroll_attendance_insert AFTER INSERT ON attendance BEGIN
+            DELETE FROM payroll_months WHERE month = substr(NEW.date, 1, 7);
+            DELETE FROM payroll WHERE employee_id = NEW.employee_id AND month = substr(NEW.date, 1, 7);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS payroll_attendance_update AFTER UPDATE ON attendance BEGIN
+            DELETE FROM payroll_months WHERE month IN (substr(OLD.date, 1, 7), substr(NEW.date, 1, 7));
+            DELETE FROM payroll WHERE employee_id = OLD.employee_id AND month = substr(OLD.date, 1, 7);
+            DELETE FROM payroll WHERE employee_id = NEW.employee_id AND month = substr(NEW.date, 1, 7);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS payroll_attendance_delete AFTER DELETE ON attendance BEGIN
+            DELETE FROM payroll_months WHERE month = substr(OLD.date, 1, 7);
+            DELETE FROM payroll WHERE employee_id = OLD.employee_id AND month = substr(OLD.date, 1, 7);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS payroll_employee_update AFTER UPDATE ON employees BEGIN
+            DELETE FROM payroll_months WHERE month IN (SELECT month FROM payroll WHERE employee_id = OLD.employee_id);
+            DELETE FROM payroll WHERE employee_id = OLD.employee_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS payroll_employee_delete AFTER DELETE ON employees BEGIN
+            DELETE FROM payroll WHERE employee_id = OLD.employee_id;
+        END
+    ''')
+
+
+def _create_kpi_tables(conn):
+    """ version 5: monthly delivery KPIs per customer, product and driver (see kpis.py), plus the
+    (source, month) pairs whose Orders rows changed since the KPIs were last refreshed """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS kpi_monthly (
+            dimension TEXT NOT NULL,
+            source TEXT NOT NULL,
+            month TEXT NOT NULL,
+            key TEXT NOT NULL,
+            deliveries INTEGER,
+            quantity INTEGER,
+            returned INTEGER,
+            amount_paid REAL,
+            PRIMARY KEY (dimension, source, month, key)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_kpi_monthly_source_month ON kpi_monthly (source, month)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS kpi_dirty (
+            source TEXT NOT NULL,
+            month TEXT NOT NULL,
+            PRIMARY KEY (source, month)
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS kpi_orders_insert AFTER INSERT ON Orders BEGIN
+            INSERT OR IGNORE INTO kpi_dirty (source, month) VALUES (NEW.source, substr(NEW.date, 1, 7));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS kpi_orders_update AFTER UPDATE ON Orders BEGIN
+            INSERT OR IGNORE INTO kpi_dirty (source, month) VALUES (OLD.source, substr(OLD.date, 1, 7));
+            INSERT OR IGNORE INTO kpi_dirty (source, month) VALUES (NEW.source, substr(NEW.date, 1, 7));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS kpi_orders_delete AFTER DELETE ON Orders BEGIN
+            INSERT OR IGNORE INTO kpi_dirty (source, month) VALUES (OLD.source, substr(OLD.date, 1, 7));
+        END
+    ''')
+    # Orders already stored are computed on the first refresh
+    conn.execute('''
+        INSERT OR IGNORE INTO kpi_dirty (source, month)
+        SELECT DISTINCT source, substr(date, 1, 7) FROM Orders WHERE source IS NOT NULL
+    ''')
+
+
+def _create_receivables_tables(conn):
+    """ version 6: the customer receivables ledger (see ledger.py). receivables_ledger is append-only;
+    receivables_posted holds what each Orders row currently contributes to it and receivable_balances the
+    running total per customer. The triggers mark the Orders rows to post again in receivables_dirty. """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receivables_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            customer_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            amount_due REAL NOT NULL,
+            amount_paid REAL NOT NULL,
+            posted_at TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receivables_ledger_customer ON receivables_ledger (customer_name, entry_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receivables_posted (
+            order_id INTEGER PRIMARY KEY,
+            customer_name TEXT NOT NULL,
+            product_name TEXT,
+            date TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL,
+            amount_due REAL NOT NULL,
+            amount_paid REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receivables_posted_customer ON receivables_posted (customer_name, product_name)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS receivable_balances (
+            customer_name TEXT PRIMARY KEY,
+            quantity INTEGER NOT NULL,
+            amount_due REAL NOT NULL,
+            amount_paid REAL NOT NULL,
+            balance REAL NOT NULL,
+            last_delivery TEXT,
+            last_payment TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_receivable_balances_balance ON receivable_balances (balance)')
+    conn.execute('CREATE TABLE IF NOT EXISTS receivables_dirty (order_id INTEGER PRIMARY KEY)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS receivables_orders_insert AFTER INSERT ON Orders BEGIN
+            INSERT OR IGNORE INTO receivables_dirty (order_id) VALUES (NEW.order_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS receivables_orders_update
+        AFTER UPDATE OF date, customer_code, street_name, product_type, quantity_delivered, amount_paid, source ON Orders BEGIN
+            INSERT OR IGNORE INTO receivables_dirty (order_id) VALUES (NEW.order_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS receivables_orders_delete AFTER DELETE ON Orders BEGIN
+            INSERT OR IGNORE INTO receivables_dirty (order_id) VALUES (OLD.order_id);
+        END
+    ''')
+    # Deliveries posted before their customer had a price are posted again once it gets one
+    for event in ('INSERT', 'UPDATE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS receivables_prices_{event.lower()} AFTER {event} ON prices BEGIN
+                INSERT OR IGNORE INTO receivables_dirty (order_id)
+                SELECT order_id FROM receivables_posted
+                WHERE customer_name = (SELECT customer_name FROM customers WHERE customer_id = NEW.customer_id)
+                  AND product_name = (SELECT product_name FROM products WHERE product_id = NEW.product_id)
+                  AND price IS NULL;
+            END
+        ''')
+    # Orders already stored are posted on the first refresh
+    conn.execute('INSERT OR IGNORE INTO receivables_dirty (order_id) SELECT order_id FROM Orders')
+
+
+def _create_stock_tables(conn):
+    """ version 7: stock movements (see inventory.py) and the running stock balance of every product.
+    A movement is a receipt (a change of the stocked quantity in inventory), a delivery or the shells
+    returned with one (a row of sales); the stock_movement_insert trigger adds each movement to
+    stock_balances in the same transaction. """
+    conn.execute('ALTER TABLE sales ADD COLUMN returned INTEGER')
+    # Sales of a product up to a date, for as-of stock queries
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sales_product_date ON sales (product_id, sale_date)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movements (
+            movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('receipt', 'delivery', 'return')),
+            quantity INTEGER NOT NULL,
+            movement_date TEXT NOT NULL,
+            sale_id INTEGER,
+            recorded_at TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (product_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_product_date ON stock_movements (product_id, movement_date)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_balances (
+            product_id INTEGER PRIMARY KEY,
+            received INTEGER NOT NULL,
+            delivered INTEGER NOT NULL,
+            returned INTEGER NOT NULL,
+            remaining INTEGER NOT NULL,
+            last_movement TEXT,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (product_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_movement_insert AFTER INSERT ON stock_movements BEGIN
+            INSERT INTO stock_balances (product_id, received, delivered, returned, remaining, last_movement, updated_at)
+            VALUES (NEW.product_id,
+                    CASE NEW.kind WHEN 'receipt' THEN NEW.quantity ELSE 0 END,
+                    CASE NEW.kind WHEN 'delivery' THEN NEW.quantity ELSE 0 END,
+                    CASE NEW.kind WHEN 'return' THEN NEW.quantity ELSE 0 END,
+                    CASE NEW.kind WHEN 'receipt' THEN NEW.quantity WHEN 'delivery' THEN -NEW.quantity ELSE 0 END,
+                    NEW.movement_date, NEW.recorded_at)
+            ON CONFLICT (product_id) DO UPDATE SET
+                received = received + excluded.received,
+                delivered = delivered + excluded.delivered,
+                returned = returned + excluded.returned,
+                remaining = remaining + excluded.remaining,
+                last_movement = MAX(last_movement, excluded.last_movement),
+                updated_at = excluded.updated_at;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_inventory_insert AFTER INSERT ON inventory BEGIN
+            INSERT INTO stock_movements (product_id, kind, quantity, movement_date, recorded_at)
+            VALUES (NEW.product_id, 'receipt', COALESCE(NEW.quantity, 0), date('now'), CURRENT_TIMESTAMP);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_inventory_update AFTER UPDATE OF quantity ON inventory
+        WHEN COALESCE(NEW.quantity, 0) != COALESCE(OLD.quantity, 0) BEGIN
+            INSERT INTO stock_movements (product_id, kind, quantity, movement_date, recorded_at)
+            VALUES (NEW.product_id, 'receipt', COALESCE(NEW.quantity, 0) - COALESCE(OLD.quantity, 0), date('now'), CURRENT_TIMESTAMP);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_sales_insert AFTER INSERT ON sales WHEN NEW.product_id IS NOT NULL BEGIN
+            INSERT INTO stock_movements (product_id, kind, quantity, movement_date, sale_id, recorded_at)
+            SELECT NEW.product_id, 'delivery', COALESCE(NEW.quantity, 0), COALESCE(NEW.sale_date, date('now')), NEW.sale_id, CURRENT_TIMESTAMP
+            UNION ALL
+            SELECT NEW.product_id, 'return', NEW.returned, COALESCE(NEW.sale_date, date('now')), NEW.sale_id, CURRENT_TIMESTAMP
+            WHERE COALESCE(NEW.returned, 0) != 0;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_sales_delete AFTER DELETE ON sales WHEN OLD.product_id IS NOT NULL BEGIN
+            INSERT INTO stock_movements (product_id, kind, quantity, movement_date, sale_id, recorded_at)
+            SELECT OLD.product_id, 'delivery', -COALESCE(OLD.quantity, 0), COALESCE(OLD.sale_date, date('now')), OLD.sale_id, CURRENT_TIMESTAMP
+            UNION ALL
+            SELECT OLD.product_id, 'return', -OLD.returned, COALESCE(OLD.sale_date, date('now')), OLD.sale_id, CURRENT_TIMESTAMP
+            WHERE COALESCE(OLD.returned, 0) != 0;
+        END
+    ''')
+    # Stock and sales already stored become the first movements
+    conn.execute('''
+        INSERT INTO stock_movements (product_id, kind, quantity, movement_date, recorded_at)
+        SELECT product_id, 'receipt', COALESCE(quantity, 0), COALESCE(date(last_updated), date('now')), CURRENT_TIMESTAMP
+        FROM inventory
+    ''')
+    conn.execute('''
+        INSERT INTO stock_movements (product_id, kind, quantity, movement_date, sale_id, recorded_at)
+        SELECT product_id, 'delivery', COALESCE(quantity, 0), COALESCE(sale_date, date('now')), sale_id, CURRENT_TIMESTAMP
+        FROM sales
+        WHERE product_id IS NOT NULL
+    ''')
+
+
+def _create_price_history(conn):
+    """ version 8: customer prices by date (see customer_pricing.py). A price applies from its
+    effective_from date until the next one of the same customer and product; prices keeps the price in
+    effect today. Deliveries are posted to the receivables ledger at the price of their own date, so a
+    new dated price marks the deliveries from that date on to post again. """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            customer_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            effective_from TEXT NOT NULL,
+            price REAL,
+            recorded_at TIMESTAMP,
+            PRIMARY KEY (customer_id, product_id, effective_from),
+            FOREIGN KEY (customer_id) REFERENCES customers (customer_id),
+            FOREIGN KEY (product_id) REFERENCES products (product_id)
+        )
+    ''')
+    # Prices set before there was a history applied to every delivery, so they start at the earliest date
+    conn.execute('''
+        INSERT OR IGNORE INTO price_history (customer_id, product_id, effective_from, price, recorded_at)
+        SELECT customer_id, product_id, '0001-01-01', price, last_updated FROM prices
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS receivables_prices_insert')
+    conn.execute('DROP TRIGGER IF EXISTS receivables_prices_update')
+    for event in ('INSERT', 'UPDATE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS receivables_price_history_{event.lower()} AFTER {event} ON price_history BEGIN
+                INSERT OR IGNORE INTO receivables_dirty (order_id)
+                SELECT order_id FROM receivables_posted
+                WHERE customer_name = (SELECT customer_name FROM customers WHERE customer_id = NEW.customer_id)
+                  AND product_name = (SELECT product_name FROM products WHERE product_id = NEW.product_id)
+                  AND date >= NEW.effective_from;
+            END
+        ''')
+
+
+def _create_customer_aliases(conn):
+    """ version 9: the names each customer appears under in the delivery sheets (see customers.py).
+    Receivables are posted under the customer an alias points to, so a new alias posts the deliveries
+    recorded under that name again. """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS customer_aliases (
+            alias TEXT PRIMARY KEY,
+            customer_id INTEGER NOT NULL,
+            FOREIGN KEY (customer_id) REFERENCES customers (customer_id)
+        )
+    ''')
+    # Every customer so far is known under its own name
+    conn.execute('INSERT OR IGNORE INTO customer_aliases (alias, customer_id) SELECT customer_name, customer_id FROM customers')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS receivables_customer_alias_insert AFTER INSERT ON customer_aliases BEGIN
+            INSERT OR IGNORE INTO receivables_dirty (order_id)
+            SELECT order_id FROM receivables_posted WHERE customer_name = NEW.alias;
+        END
+    ''')
+
+
+def _add_order_extra_columns(conn):
+    """ version 10: the sheet columns Orders has no column of its own for, as a JSON object per row
+    (see delivery_store.py) """
+    conn.execute('ALTER TABLE Orders ADD COLUMN extra TEXT')
+
+
+def _post_receivable_changes_only(conn):
+    """ version 11: a sync writes every column of a changed Orders row, so UPDATE OF fired for edits that
+    do not touch the receivables (drivers, bottles returned, notes). Orders rows are now only marked to post
+    again when a column the ledger reads actually changed. """
+    conn.execute('DROP TRIGGER IF EXISTS receivables_orders_update')
+    conn.execute('''
+        CREATE TRIGGER receivables_orders_update
+        AFTER UPDATE OF date, customer_code, street_name, product_type, quantity_delivered, amount_paid, source ON Orders
+        WHEN OLD.date IS NOT NEW.date OR OLD.customer_code IS NOT NEW.customer_code
+          OR OLD.street_name IS NOT NEW.street_name OR OLD.product_type IS NOT NEW.product_type
+          OR OLD.quantity_delivered IS NOT NEW.quantity_delivered OR OLD.amount_paid IS NOT NEW.amount_paid
+          OR OLD.source IS NOT NEW.source
+        BEGIN
+            INSERT OR IGNORE INTO receivables_dirty (order_id) VALUES (NEW.order_id);
+        END
+    ''')
+
+
+def _merge_duplicate_customers(conn):
+    """ version 12: customers stored before names were normalized (see customers.py) can be spellings of one
+    customer. Each group with the same normalized name is merged into its first customer: the others become
+    aliases of it, their prices move to it where it has none of its own for the date, and their deliveries
+    are posted again under it. """
+    # customers imports this module, so it is only imported once the migration runs
+    import customers
+    first_ids = {}
+    merged = []
+    for customer_id, customer_name in conn.execute('SELECT customer_id, customer_name FROM customers ORDER BY customer_id'):
+        key = customers.normalize_name(customer_name)
+        if key in first_ids:
+            merged.append((first_ids[key], customer_id, customer_name))
+        else:
+            first_ids[key] = customer_id
+    into = [(first_id, customer_id) for first_id, customer_id, _ in merged]
+    ids = [(customer_id,) for _, customer_id, _ in merged]
+    conn.executemany('UPDATE customer_aliases SET customer_id = ? WHERE customer_id = ?', into)
+    conn.executemany('''
+        INSERT OR IGNORE INTO price_history (customer_id, product_id, effective_from, price, recorded_at)
+        SELECT ?, product_id, effective_from, price, recorded_at FROM price_history WHERE customer_id = ?
+    ''', into)
+    conn.executemany('DELETE FROM price_history WHERE customer_id = ?', ids)
+    conn.executemany('''
+        INSERT OR IGNORE INTO prices (customer_id, product_id, price, last_updated)
+        SELECT ?, product_id, price, last_updated FROM prices WHERE customer_id = ?
+    ''', into)
+    conn.executemany('DELETE FROM prices WHERE customer_id = ?', ids)
+    conn.executemany('DELETE FROM customers WHERE customer_id = ?', ids)
+    conn.executemany('INSERT OR IGNORE INTO receivables_dirty (order_id) SELECT order_id FROM receivables_posted WHERE customer_name = ?',
+                     [(customer_name,) for _, _, customer_name in merged])
+
+
+def _derive_prices_from_history(conn):
+    """ version 13: prices was a copy of the price in effect on the day it was last written, so a price with a
+    future effective_from never reached it. prices is now a view of the latest price_history row of each
+    customer and product that is in effect today. """
+    # Prices that never got a history apply from the earliest date, as in version 8
+    conn.execute('''
+        INSERT OR IGNORE INTO price_history (customer_id, product_id, effective_from, price, recorded_at)
+        SELECT customer_id, product_id, '0001-01-01', price, last_updated FROM prices p
+        WHERE NOT EXISTS (SELECT 1 FROM price_history h WHERE h.customer_id = p.customer_id AND h.product_id = p.product_id)
+    ''')
+    conn.execute('DROP TABLE prices')
+    conn.execute('''
+        CREATE VIEW prices AS
+        SELECT h.customer_id, h.product_id, h.price, h.recorded_at AS last_updated
+        FROM price_history h
+        WHERE h.effective_from = (
+            SELECT MAX(l.effective_from) FROM price_history l
+            WHERE l.customer_id = h.customer_id AND l.product_id = h.product_id
+              AND l.effective_from <= date('now', 'localtime')
+        )
+    ''')
+
+
+def _follow_sale_updates(conn):
+    """ version 14: a sale whose product, quantity, returned shells or date is changed in place (see
+    inventory.insert_sales_data) reverses its old stock movements and records the new ones, as a delete
+    and an insert of the sale would. """
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stock_sales_update AFTER UPDATE OF product_id, quantity, returned, sale_date ON sales
+        WHEN (OLD.product_id, OLD.quantity, OLD.returned, OLD.sale_date) IS NOT (NEW.product_id, NEW.quantity, NEW.returned, NEW.sale_date) BEGIN
+            INSERT INTO stock_movements (product_id, kind, quantity, movement_date, sale_id, recorded_at)
+            SELECT OLD.product_id, 'delivery', -COALESCE(OLD.quantity, 0), COALESCE(OLD.sale_date, date('now')), OLD.sale_id, CURRENT_TIMESTAMP
+            WHERE OLD.product_id IS NOT NULL
+            UNION ALL
+            SELECT OLD.product_id, 'return', -OLD.returned, COALESCE(OLD.sale_date, date('now')), OLD.sale_id, CURRENT_TIMESTAMP
+            WHERE OLD.product_id IS NOT NULL AND COALESCE(OLD.returned, 0) != 0
+            UNION ALL
+            SELECT NEW.product_id, 'delivery', COALESCE(NEW.quantity, 0), COALESCE(NEW.sale_date, date('now')), NEW.sale_id, CURRENT_TIMESTAMP
+            WHERE NEW.product_id IS NOT NULL
+            UNION ALL
+            SELECT NEW.product_id, 'return', NEW.returned, COALESCE(NEW.sale_date, date('now')), NEW.sale_id, CURRENT_TIMESTAMP
+            WHERE NEW.product_id IS NOT NULL AND COALESCE(NEW.returned, 0) != 0;
+        END
+    ''')
+
+
+def _create_sheet_chunks(conn):
+    """ version 15: the hash of every chunk of rows a sheet was last synced with (see delivery_store.py), so
+    a chunk that has not changed since is skipped before it is prepared and compared row by row """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SheetChunks (
+            sheet_url TEXT NOT NULL,
+            first_row INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            PRIMARY KEY (sheet_url, first_row)
+        )
+    ''')
+
+
+def _resolve_kpi_customers(conn):
+    """ version 16: customer KPIs are keyed on the customer a sheet name is an alias of (see kpis.py), so the
+    spellings merged into one customer are counted together. The months computed under the raw names are
+    refreshed, and a new alias of another customer refreshes the months its name was counted in. """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_kpi_monthly_key ON kpi_monthly (dimension, key)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS kpi_customer_alias_insert AFTER INSERT ON customer_aliases
+        WHEN NEW.alias IS NOT (SELECT customer_name FROM customers WHERE customer_id = NEW.customer_id) BEGIN
+            INSERT OR IGNORE INTO kpi_dirty (source, month)
+            SELECT source, month FROM kpi_monthly WHERE dimension = 'customer' AND key = NEW.alias;
+        END
+    ''')
+    conn.execute("INSERT OR IGNORE INTO kpi_dirty (source, month) SELECT DISTINCT source, month FROM kpi_monthly")
+
+
+MIGRATIONS = [
+    _create_schema,
+    _merge_legacy_files,
+    _index_attendance_by_date,
+    _create_payroll_table,
+    _create_kpi_tables,
+    _create_receivables_tables,
+    _create_stock_tables,
+    _create_price_history,
+    _create_customer_aliases,
+    _add_order_extra_columns,
+    _post_receivable_changes_only,
+    _merge_duplicate_customers,
+    _derive_prices_from_history,
+    _follow_sale_updates,
+    _create_sheet_chunks,
+    _resolve_kpi_customers,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def query_plan(conn, query, params=()):
+    """ the EXPLAIN QUERY PLAN lines of query, e.g. ['SEARCH attendance USING COVERING INDEX ...'] """
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+def migrate(conn):
+    """ apply the migrations the database has not had yet, each in its own transaction. A migration that
+    fails is rolled back entirely, schema changes included, so the database stays at the version before
+    it and the migration can be run again. """
+    version = schema_version(conn)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        if migration is _merge_legacy_files:
+            _attach_legacy_files(conn)
+        try:
+            # sqlite3 only opens a transaction by itself before INSERT/UPDATE/DELETE, not before DDL
+            conn.execute('BEGIN')
+            try:
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {target}')
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            # Databases attached by a migration can only be detached once its transaction is over
+            for (_, name, _) in conn.execute('PRAGMA database_list').fetchall():
+                if name not in ('main', 'temp'):
+                    conn.execute(f'DETACH DATABASE {name}')
+    return schema_version(conn)
+
+
+def init_db(db_file=DB_FILE):
+    """ create or upgrade db_file to the current schema; only the first call per process does any work """
+    with _init_lock:
+        if db_file in _initialized:
+            return
+        with db.connection(db_file) as conn:
+            migrate(conn)
+        _initialized.add(db_file)
+
+
+def connection():
+    """ a pooled connection to the app database, for a with block """
+    init_db()
+    return db.connection(DB_FILE)
+
+
+def transaction():
+    """ a pooled connection to the app database that commits at the end of the with block """
+    init_db()
+    return db.transaction(DB_FILE)
+
+
+if __name__ == '__main__':
+    # One-shot setup: python storage.py creates DB_FILE and merges the legacy databases into it
+    init_db()
+    with db.connection(DB_FILE) as conn:
+        print(f"{DB_FILE} at schema version {schema_version(conn)}")
+        for table in ('customers', 'products', 'prices', 'inventory', 'sales', 'employees', 'attendance', 'Orders'):
+            print(f"  {table}: {conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} rows")
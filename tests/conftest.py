@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import storage
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """ an empty app database (storage.DB_FILE) in a temporary directory that is the working directory,
+    so no legacy database is merged into it and nothing is written next to the code """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, '_initialized', set())
+    storage.init_db()
+    yield tmp_path / storage.DB_FILE
+    db.close_all()
@@ -0,0 +1,25 @@
+import sqlite3
+import pytest
+import attendance
+import storage
+
+
+@pytest.fixture
+def schema():
+    conn = sqlite3.connect(':memory:')
+    storage.migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('query', [attendance.MONTH_ENTRIES_QUERY, attendance.MONTH_SUMMARY_QUERY])
+def test_month_queries_read_attendance_through_the_date_index(schema, query):
+    plan = storage.query_plan(schema, query, attendance.month_range(2024, 1))
+    attendance_steps = [line for line in plan if ' attendance ' in f' {line} ']
+    assert attendance_steps, plan
+    assert all(line.startswith('SEARCH attendance USING COVERING INDEX idx_attendance_date') for line in attendance_steps), plan
+
+
+def test_month_range_ends_at_the_next_month():
+    assert attendance.month_range(2024, 12) == ('2024-12-01', '2025-01-01')
+    assert attendance.month_range('2024', '02') == ('2024-02-01', '2024-03-01')
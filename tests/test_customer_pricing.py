@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import customer_pricing
+import customers
+import storage
+
+
+def add_customer_and_product(customer_names, product_name='O350'):
+    customers.sync_customers(customer_names)
+    with storage.transaction() as conn:
+        conn.execute('INSERT INTO products (product_name) VALUES (?)', (product_name,))
+
+
+def test_the_current_price_is_the_latest_one_in_effect_today(app_db):
+    add_customer_and_product(['Anh Nam'])
+    today = datetime.now()
+    customer_pricing.insert_or_update_price('Anh Nam', 'O350', 100, '2024-01-01')
+    customer_pricing.insert_or_update_price('Anh Nam', 'O350', 120, today.strftime('%Y-%m-%d'))
+    customer_pricing.insert_or_update_price('Anh Nam', 'O350', 150, (today + timedelta(days=30)).strftime('%Y-%m-%d'))
+
+    assert customer_pricing.get_prices()['price'].tolist() == [120]
+    assert customer_pricing.get_price_history()['price'].tolist() == [100, 120, 150]
+
+
+def test_customer_deliveries_are_priced_as_of_their_date(app_db):
+    add_customer_and_product(['Chị Lan - Lê Lợi', 'chi lan - le loi', 'Công ty C'])
+    customer_pricing.insert_or_update_price('Chị Lan - Lê Lợi', 'O350', 100, '2024-01-01')
+    customer_pricing.insert_or_update_price('Chị Lan - Lê Lợi', 'O350', 110, '2024-03-01')
+
+    moto = pd.DataFrame({
+        'Ngày': pd.to_datetime(['2024-02-01', '2024-03-05', '2024-03-05']),
+        'Khách hàng': pd.Categorical(['chi lan - le loi', 'Chị Lan - Lê Lợi', 'Anh Nam - Lê Lợi']),
+        'Loại sản phẩm': pd.Categorical(['O350', 'O350', 'O350']),
+        'Số lượng Giao': pd.array([2, 3, 1], dtype='Int16'),
+    })
+    truck = pd.DataFrame({
+        'Ngày': pd.to_datetime(['2024-03-05']),
+        'Khách hàng ( Hoặc số địa chỉ)': pd.Categorical(['Công ty C']),
+        'Loại sản phẩm': pd.Categorical(['O350']),
+        'Số lượng Giao': pd.array([40], dtype='Int16'),
+    })
+
+    deliveries = customer_pricing.customer_deliveries(moto, truck, 'Chị Lan - Lê Lợi')
+    assert deliveries['price'].tolist() == [110, 100]
+    assert deliveries['amount'].tolist() == [330, 200]
+
+    customers.sync_customers(['Quán A'])
+    assert customer_pricing.customer_deliveries(moto, truck, 'Quán A').empty
+
+
+def test_a_price_for_an_unknown_product_is_reported_as_an_error(app_db, monkeypatch):
+    add_customer_and_product(['Anh Nam'])
+    messages = []
+    monkeypatch.setattr(customer_pricing.st, 'error', lambda message: messages.append(('error', message)))
+    monkeypatch.setattr(customer_pricing.st, 'success', lambda message: messages.append(('success', message)))
+
+    customer_pricing.insert_or_update_price('Anh Nam', 'Bình 50kg', 100, '2024-01-01')
+    customer_pricing.insert_or_update_price('Anh Nam', 'O350', 100, '2024-01-01')
+
+    assert [kind for kind, _ in messages] == ['error', 'success']
+    assert customer_pricing.get_price_history()['product_name'].tolist() == ['O350']
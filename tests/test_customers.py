@@ -0,0 +1,49 @@
+import sqlite3
+import pandas as pd
+import customer_pricing
+import customers
+import storage
+
+
+def test_customers_with_the_same_normalized_name_are_merged(tmp_path, monkeypatch):
+    # No legacy database is merged in an empty directory
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect(':memory:')
+    migrations = storage.MIGRATIONS
+    monkeypatch.setattr(storage, 'MIGRATIONS', migrations[:migrations.index(storage._merge_duplicate_customers)])
+    storage.migrate(conn)
+    with conn:
+        conn.executemany('INSERT INTO customers (customer_id, customer_name) VALUES (?, ?)',
+                         [(1, 'Chị Lan - Lê Lợi'), (2, 'Anh Nam'), (3, 'chi lan - le loi'), (4, 'Chị  Lan - Lê Lợi ')])
+        conn.execute('INSERT INTO customer_aliases (alias, customer_id) SELECT customer_name, customer_id FROM customers')
+        conn.execute("INSERT INTO products (product_id, product_name) VALUES (1, 'O350'), (2, 'NV')")
+        conn.executemany('INSERT INTO price_history (customer_id, product_id, effective_from, price) VALUES (?, ?, ?, ?)',
+                         [(1, 1, '2024-01-01', 100), (3, 1, '2024-01-01', 90), (3, 2, '2024-01-01', 50)])
+
+    monkeypatch.setattr(storage, 'MIGRATIONS', migrations)
+    storage.migrate(conn)
+
+    assert conn.execute('SELECT customer_id, customer_name FROM customers ORDER BY customer_id').fetchall() == \
+        [(1, 'Chị Lan - Lê Lợi'), (2, 'Anh Nam')]
+    assert dict(conn.execute('SELECT alias, customer_id FROM customer_aliases')) == \
+        {'Chị Lan - Lê Lợi': 1, 'Anh Nam': 2, 'chi lan - le loi': 1, 'Chị  Lan - Lê Lợi ': 1}
+    # The first customer keeps its own price; a product only the merged one had a price for moves over
+    assert conn.execute('SELECT customer_id, product_id, price FROM price_history ORDER BY product_id').fetchall() == \
+        [(1, 1, 100), (1, 2, 50)]
+    conn.close()
+
+
+def test_deliveries_are_priced_under_the_customer_their_name_is_an_alias_of(app_db):
+    customers.sync_customers(['Chị Lan - Lê Lợi', 'chi lan - le loi'])
+    with storage.transaction() as conn:
+        conn.execute("INSERT INTO products (product_name) VALUES ('O350')")
+    customer_pricing.insert_or_update_price('Chị Lan - Lê Lợi', 'O350', 100, '2024-01-01')
+
+    deliveries = pd.DataFrame({
+        'Khách hàng': ['chi lan - le loi', 'Chị Lan - Lê Lợi', 'chi lan - le loi', 'Anh Nam'],
+        'Loại sản phẩm': 'O350',
+        'Ngày': pd.to_datetime(['2024-02-01', '2024-02-01', '2023-12-31', '2024-02-01']),
+    })
+    prices = customer_pricing.price_deliveries(deliveries)
+    assert prices.iloc[:2].tolist() == [100, 100]
+    assert prices.iloc[2:].isna().all()
@@ -0,0 +1,187 @@
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+import data_prepare
+import delivery_store
+import snapshot
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class SheetHandler(BaseHTTPRequestHandler):
+    """ serves tests/fixtures like published sheets. /flaky/<file> answers 500 to its first two requests;
+    files that do not exist answer 404. Requests are counted per path in server.hits. """
+
+    def do_GET(self):
+        hits = self.server.hits
+        hits[self.path] = hits.get(self.path, 0) + 1
+        if self.path.startswith('/flaky/') and hits[self.path] <= 2:
+            self.send_error(500)
+            return
+        path = os.path.join(FIXTURES, os.path.basename(self.path))
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sheet_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SheetHandler)
+    server.hits = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_retries_server_errors(sheet_server):
+    url = sheet_server.url + '/flaky/moto.csv'
+    downloads, report = data_prepare.download_all([url], retries=3, backoff=0)
+
+    with downloads[url] as content, open(os.path.join(FIXTURES, 'moto.csv'), 'rb') as f:
+        assert content.read() == f.read()
+    assert report[url]['ok'] and report[url]['attempts'] == 3
+    assert sheet_server.hits['/flaky/moto.csv'] == 3
+
+
+def test_download_gives_up_after_the_last_retry(sheet_server):
+    url = sheet_server.url + '/flaky/moto.csv'
+    downloads, report = data_prepare.download_all([url], retries=1, backoff=0)
+
+    assert downloads == {}
+    assert not report[url]['ok'] and '500' in report[url]['error']
+    assert sheet_server.hits['/flaky/moto.csv'] == 2
+
+
+def test_download_does_not_retry_a_missing_sheet(sheet_server):
+    url = sheet_server.url + '/missing.csv'
+    downloads, report = data_prepare.download_all([url], retries=3, backoff=0)
+
+    assert downloads == {}
+    assert not report[url]['ok'] and '404' in report[url]['error']
+    assert sheet_server.hits['/missing.csv'] == 1
+
+
+def test_sync_and_load_reports_the_sheet_that_failed(app_db, sheet_server):
+    moto_url = sheet_server.url + '/moto.csv'
+    missing_url = sheet_server.url + '/missing.csv'
+    truck_url = sheet_server.url + '/truck.csv'
+    moto, truck, report = data_prepare.sync_and_load([moto_url, missing_url], [truck_url], backoff=0)
+
+    # The row dated 2023-08-05 is not day/month/year
+    assert len(moto) == 3 and len(truck) == 2
+    assert moto['Khách hàng'].iloc[0] == '17 - Lê Lợi'
+    assert report[moto_url]['ok'] and report[moto_url]['inserted'] == 3 and report[moto_url]['unparsed_dates'] == 1
+    assert report[truck_url]['ok'] and report[truck_url]['inserted'] == 2
+    assert not report[missing_url]['ok'] and '404' in report[missing_url]['error']
+
+    # Syncing the same sheets again writes nothing and keeps the frames already loaded
+    previous = (moto, truck)
+    again_moto, again_truck, report = data_prepare.sync_and_load([moto_url, missing_url], [truck_url], backoff=0,
+                                                                 previous=previous)
+    assert report[moto_url]['skipped'] and report[truck_url]['skipped']
+    assert again_moto is moto and again_truck is truck
+
+
+MOTO_SHEET = '''Ngày,Khách hàng ( Hoặc số địa chỉ),Tên đường,Loại sản phẩm,Số lượng Giao,Vỏ về,Thanh Toán
+05/10/2023,12,Lê Lợi,Bình 12kg,"1,5",2,"120,000"
+06/10/2023,14,Lê Lợi,Bình 12kg,3,1,500000
+'''
+
+
+def test_sheet_chunks_strip_thousands_separators_from_money_only():
+    report = {'unparsed_dates': 0}
+    chunks = [data_prepare.prepare_sheet_chunk(chunk, report)
+              for chunk in data_prepare.read_sheet_chunks(io.BytesIO(MOTO_SHEET.encode()))]
+    sheet = pd.concat(chunks)
+
+    assert sheet['Thanh Toán'].tolist() == [120000.0, 500000.0]
+    # '1,5' is not a quantity of 15
+    assert pd.isna(sheet['Số lượng Giao'].iloc[0])
+    assert sheet['Số lượng Giao'].iloc[1] == 3
+    assert sheet['Vỏ về'].tolist() == [2.0, 1.0]
+    assert report['unparsed_dates'] == 0
+
+
+def test_a_refresh_after_invalidation_waits_for_the_loader(monkeypatch):
+    monkeypatch.setattr(data_prepare, '_cache', {})
+    monkeypatch.setattr(data_prepare, '_initial_tried', set())
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        return 'loaded'
+
+    assert data_prepare.get_cached('key', loader, initial=lambda: 'snapshot') == 'snapshot'
+    assert data_prepare.cache_loaded_at('key') is None
+
+    data_prepare.invalidate_cache()
+    release.set()
+    assert data_prepare.get_cached('key', loader, initial=lambda: 'snapshot') == 'loaded'
+    assert data_prepare.cache_loaded_at('key') is not None
+
+
+def test_a_load_waits_for_the_background_refresh_of_its_key(monkeypatch):
+    monkeypatch.setattr(data_prepare, '_cache', {})
+    monkeypatch.setattr(data_prepare, '_initial_tried', set())
+    started, release = threading.Event(), threading.Event()
+    running, calls = [], []
+
+    def loader():
+        running.append(1)
+        calls.append(len(running))
+        started.set()
+        release.wait(5)
+        running.pop()
+        return 'loaded'
+
+    assert data_prepare.get_cached('key', loader, initial=lambda: 'snapshot') == 'snapshot'
+    assert started.wait(5)
+    data_prepare.invalidate_cache()
+    result = []
+    load = threading.Thread(target=lambda: result.append(data_prepare.get_cached('key', loader)))
+    load.start()
+    load.join(0.2)
+    # The load after the invalidation does not start while the refresh of the same key still runs
+    assert calls == [1]
+
+    release.set()
+    load.join(5)
+    assert result == ['loaded']
+    assert calls == [1, 1]
+
+
+def test_a_snapshot_older_than_the_store_is_not_served(app_db, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(data_prepare, '_refresh_in_background', lambda key, loader: None)
+    sheet = pd.DataFrame({'Ngày': pd.to_datetime(['05/10/2023', '06/10/2023'], format='%d/%m/%Y'),
+                          'Khách hàng ( Hoặc số địa chỉ)': ['12', '14'], 'Tên đường': 'Lê Lợi',
+                          'Loại sản phẩm': 'Bình 12kg', 'Số lượng Giao': [1.0, 3.0]})
+    delivery_store.sync_sheet_chunks('moto', 'moto sheet', [sheet])
+    delivery_store.sync_sheet_chunks('truck', 'truck sheet', [sheet.drop(columns='Tên đường')])
+    name = snapshot.snapshot_name('delivery', data_prepare.delivery_cache_key(['moto sheet'], ['truck sheet']),
+                                  data_prepare.SCHEMA_VERSION)
+    stale = pd.DataFrame({'Ngày': pd.to_datetime(['2023-10-05'])})
+
+    # A snapshot written before the last sync (e.g. writing the one of that sync failed) gives way to the store
+    for state, rows in (('before the last sync', 2), (delivery_store.sync_state(['moto sheet', 'truck sheet']), 1)):
+        snapshot.write_snapshot(name, {'moto': stale, 'truck': stale}, state=state)
+        monkeypatch.setattr(data_prepare, '_cache', {})
+        monkeypatch.setattr(data_prepare, '_initial_tried', set())
+        moto, truck, _ = data_prepare.get_delivery_data(['moto sheet'], ['truck sheet'])
+        assert (len(moto), len(truck)) == (rows, rows)
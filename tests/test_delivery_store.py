@@ -0,0 +1,98 @@
+import sqlite3
+import pandas as pd
+import delivery_store
+
+
+def sheet(dates, quantities):
+    return pd.DataFrame({
+        'Ngày': pd.to_datetime(dates, format='%d/%m/%Y'),
+        'Khách hàng ( Hoặc số địa chỉ)': '17',
+        'Tên đường': 'Lê Lợi',
+        'Loại sản phẩm': 'O350',
+        'Số lượng Giao': quantities,
+    })
+
+
+def stored_quantities(app_db, url):
+    conn = sqlite3.connect(app_db)
+    try:
+        return [quantity for (quantity,) in conn.execute(
+            'SELECT quantity_delivered FROM Orders WHERE sheet_url = ? ORDER BY sheet_row', (url,))]
+    finally:
+        conn.close()
+
+
+def test_each_chunk_is_committed_before_the_next_is_read(app_db):
+    seen = []
+
+    def chunks():
+        yield sheet(['01/10/2023', '02/10/2023'], [1, 2])
+        # Another connection sees the first chunk while the sync is still going
+        seen.append(stored_quantities(app_db, 'sheet'))
+        yield sheet(['03/10/2023'], [3])
+
+    result = delivery_store.sync_sheet_chunks('moto', 'sheet', chunks())
+
+    assert seen == [[1, 2]]
+    assert stored_quantities(app_db, 'sheet') == [1, 2, 3]
+    assert result == {'inserted': 3, 'updated': 0, 'deleted': 0, 'skipped': False, 'rows': 3}
+
+
+def test_a_sync_that_stops_part_way_is_finished_by_the_next(app_db):
+    def failing_chunks():
+        yield sheet(['01/10/2023', '02/10/2023'], [1, 5])
+        raise OSError('connection reset')
+
+    try:
+        delivery_store.sync_sheet_chunks('moto', 'sheet', failing_chunks())
+    except OSError:
+        pass
+    assert stored_quantities(app_db, 'sheet') == [1, 5]
+
+    result = delivery_store.sync_sheet_chunks('moto', 'sheet', [sheet(['01/10/2023', '02/10/2023'], [1, 2]),
+                                                                sheet(['03/10/2023'], [3])])
+    assert stored_quantities(app_db, 'sheet') == [1, 2, 3]
+    assert result == {'inserted': 1, 'updated': 1, 'deleted': 0, 'skipped': False, 'rows': 3}
+
+
+def test_columns_without_an_orders_column_are_kept(app_db):
+    notes = sheet(['01/10/2023', '02/10/2023'], [1, 2]).assign(**{'Ghi chú': ['gọi trước', None]})
+    delivery_store.sync_sheet_chunks('moto', 'sheet', [notes])
+
+    (stored,) = delivery_store.iter_orders('moto', ['sheet'])
+    assert list(stored.columns) == ['Ngày', 'Khách hàng ( Hoặc số địa chỉ)', 'Tên đường', 'Loại sản phẩm',
+                                    'Số lượng Giao', 'Ghi chú']
+    # Newest first
+    assert stored['Ghi chú'].iloc[1] == 'gọi trước' and pd.isna(stored['Ghi chú'].iloc[0])
+
+    notes.loc[1, 'Ghi chú'] = 'đã thu'
+    result = delivery_store.sync_sheet_chunks('moto', 'sheet', [notes])
+    assert (result['inserted'], result['updated']) == (0, 1)
+    (stored,) = delivery_store.iter_orders('moto', ['sheet'])
+    assert stored['Ghi chú'].tolist() == ['đã thu', 'gọi trước']
+
+
+def test_unchanged_chunks_are_not_prepared_again(app_db):
+    prepared = []
+
+    def prepare(chunk):
+        prepared.append(chunk['Ngày'].iloc[0])
+        return chunk.assign(**{'Ngày': pd.to_datetime(chunk['Ngày'], format='%d/%m/%Y'),
+                               'Số lượng Giao': chunk['Số lượng Giao'].astype(float)})
+
+    def text_chunks(last_quantity):
+        return [sheet(['01/10/2023', '02/10/2023'], [1, 2]).assign(**{'Ngày': ['01/10/2023', '02/10/2023']}).astype(str),
+                sheet(['03/10/2023'], [last_quantity]).assign(**{'Ngày': ['03/10/2023']}).astype(str)]
+
+    delivery_store.sync_sheet_chunks('moto', 'sheet', text_chunks(3), prepare)
+    assert prepared == ['01/10/2023', '03/10/2023']
+
+    prepared.clear()
+    result = delivery_store.sync_sheet_chunks('moto', 'sheet', text_chunks(4), prepare)
+    assert prepared == ['03/10/2023']
+    assert (result['updated'], result['skipped']) == (1, False)
+    assert stored_quantities(app_db, 'sheet') == [1, 2, 4]
+
+    prepared.clear()
+    assert delivery_store.sync_sheet_chunks('moto', 'sheet', text_chunks(4), prepare)['skipped']
+    assert prepared == []
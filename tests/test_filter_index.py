@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import filter_index
+
+COLUMNS = ['Loại sản phẩm', 'Khách hàng']
+
+
+def deliveries(rows=500, seed=0):
+    """ delivery rows newest first, like the loaded frames, with some products missing """
+    rng = np.random.default_rng(seed)
+    products = np.array(['Bình 12kg', 'Bình 45kg', 'O350', None], dtype=object)
+    return pd.DataFrame({
+        'Ngày': pd.Timestamp('2024-03-31') - pd.to_timedelta(np.sort(rng.integers(0, 60, rows)), unit='D'),
+        'Loại sản phẩm': products[rng.integers(0, 4, rows)],
+        'Khách hàng': pd.Categorical(rng.choice(['12 Lê Lợi', '14 Lê Lợi', 'Công ty C'], rows)),
+    })
+
+
+def expected_rows(data, date_range=None, filters=None):
+    keep = pd.Series(True, index=data.index)
+    if date_range:
+        keep &= data['Ngày'].between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))
+    for column, selected in (filters or {}).items():
+        if selected:
+            keep &= data[column].isin(selected)
+    return np.flatnonzero(keep.to_numpy())
+
+
+CASES = [
+    (('2024-02-10', '2024-03-01'), None),
+    (None, {'Loại sản phẩm': ['O350']}),
+    (None, {'Loại sản phẩm': ['Bình 12kg', 'O350'], 'Khách hàng': ['Công ty C']}),
+    (('2024-03-01', '2024-03-05'), {'Khách hàng': ['12 Lê Lợi', '14 Lê Lợi']}),
+    (('2024-02-01', '2024-03-31'), {'Loại sản phẩm': ['Bình 45kg'], 'Khách hàng': ['14 Lê Lợi']}),
+    # Nothing selected in a multiselect leaves its column unfiltered
+    (('2024-03-01', '2024-03-31'), {'Loại sản phẩm': [], 'Khách hàng': ['Công ty C']}),
+]
+
+
+def test_rows_match_boolean_filtering():
+    data = deliveries()
+    index = filter_index.FilterIndex(data, COLUMNS)
+    for date_range, filters in CASES:
+        np.testing.assert_array_equal(index.rows(date_range, filters), expected_rows(data, date_range, filters))
+
+
+def test_rows_match_boolean_filtering_when_the_frame_is_not_sorted_by_date():
+    data = deliveries().sample(frac=1, random_state=1).reset_index(drop=True)
+    index = filter_index.FilterIndex(data, COLUMNS)
+    for date_range, filters in CASES:
+        np.testing.assert_array_equal(index.rows(date_range, filters), expected_rows(data, date_range, filters))
+
+
+def test_empty_selections():
+    data = deliveries()
+    index = filter_index.FilterIndex(data, COLUMNS)
+
+    assert index.rows() is None
+    assert index.rows(None, {'Loại sản phẩm': [], 'Khách hàng': []}) is None
+    for date_range, filters in ((('2023-01-01', '2023-12-31'), None),
+                                (None, {'Loại sản phẩm': ['Bình 50kg']}),
+                                (('2024-03-01', '2024-03-31'), {'Khách hàng': ['Nhà hàng B']})):
+        rows = index.rows(date_range, filters)
+        assert len(rows) == 0
+        assert len(expected_rows(data, date_range, filters)) == 0
+
+
+def test_options_are_the_sorted_values_without_missing_ones():
+    index = filter_index.FilterIndex(deliveries(), COLUMNS)
+    assert index.options('Loại sản phẩm') == ['Bình 12kg', 'Bình 45kg', 'O350']
+    assert index.options('Khách hàng') == ['12 Lê Lợi', '14 Lê Lợi', 'Công ty C']
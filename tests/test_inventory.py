@@ -0,0 +1,69 @@
+import sqlite3
+import pandas as pd
+import delivery_store
+import inventory
+import storage
+
+
+def truck_sheet(quantities, returned=0, product='NV'):
+    return pd.DataFrame({
+        'Ngày': pd.to_datetime(['03/10/2024', '04/10/2024', '04/10/2024'][:len(quantities)], format='%d/%m/%Y'),
+        'Khách hàng ( Hoặc số địa chỉ)': 'Công ty C',
+        'Loại sản phẩm': product,
+        'Số lượng Giao': quantities,
+        'Vỏ về': returned,
+    })
+
+
+def stock(app_db):
+    conn = sqlite3.connect(app_db)
+    try:
+        return conn.execute('SELECT delivered, returned, remaining FROM stock_balances').fetchone()
+    finally:
+        conn.close()
+
+
+def test_sales_follow_the_sheet_rows(app_db):
+    inventory.insert_or_update_product('NV')
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet([10, 8, 8])])
+
+    assert inventory.insert_sales_data('truck') == {'inserted': 3, 'updated': 0, 'removed': 0, 'skipped': 0}
+    assert inventory.insert_sales_data('truck') == {'inserted': 0, 'updated': 0, 'removed': 0, 'skipped': 0}
+    assert stock(app_db) == (26, 0, -26)
+
+    # A corrected quantity changes its sale instead of adding one; a row gone from the sheet removes its sale
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet([12, 8], returned=3)])
+    assert inventory.insert_sales_data('truck') == {'inserted': 0, 'updated': 2, 'removed': 1, 'skipped': 0}
+    assert stock(app_db) == (20, 6, -20)
+
+
+def test_legacy_sales_on_the_dates_of_the_sheet_are_replaced(app_db):
+    inventory.insert_or_update_product('NV')
+    with storage.transaction() as conn:
+        conn.executemany('INSERT INTO sales (product_id, quantity, sale_date) SELECT product_id, ?, ? FROM products',
+                         [(10, '2024-10-03'), (5, '2024-09-30')])
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet([10, 8])])
+
+    assert inventory.insert_sales_data('truck')['removed'] == 1
+    # The sale of 30/09, a date the sheet does not cover, stays
+    assert stock(app_db) == (23, 0, -23)
+
+
+def test_an_import_leaves_the_legacy_sales_of_the_other_source_on_the_same_date(app_db):
+    inventory.insert_or_update_product('NV')
+    inventory.insert_or_update_product('O350')
+    with storage.transaction() as conn:
+        conn.execute("INSERT INTO sales (product_id, quantity, sale_date) SELECT product_id, 7, '2024-10-03' FROM products "
+                     "WHERE product_name = 'O350'")
+    delivery_store.sync_sheet_chunks('truck', 'truck sheet', [truck_sheet([10])])
+    delivery_store.sync_sheet_chunks('moto', 'moto sheet', [truck_sheet([7], product='O350')])
+
+    # The legacy O350 sale is the moto delivery of that date, not one of the truck's
+    assert inventory.insert_sales_data('truck')['removed'] == 0
+    assert inventory.insert_sales_data('moto')['removed'] == 1
+    conn = sqlite3.connect(app_db)
+    try:
+        assert dict(conn.execute('SELECT p.product_name, b.remaining FROM stock_balances b JOIN products p USING (product_id)')) == \
+            {'NV': -10, 'O350': -7}
+    finally:
+        conn.close()
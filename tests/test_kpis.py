@@ -0,0 +1,47 @@
+import sqlite3
+import pandas as pd
+import customers
+import delivery_store
+import kpis
+
+
+def truck_sheet(names, dates, quantities):
+    return pd.DataFrame({
+        'Ngày': pd.to_datetime(dates, format='%d/%m/%Y'),
+        'Khách hàng ( Hoặc số địa chỉ)': names,
+        'Loại sản phẩm': 'NV',
+        'Số lượng Giao': quantities,
+    })
+
+
+def customer_totals():
+    totals = kpis.kpi_totals('customer', ['truck'], '2024-01', '2024-12')
+    return dict(zip(totals['key'], totals['quantity']))
+
+
+def test_only_the_dirty_months_are_recomputed(app_db):
+    dates = ['03/10/2024', '04/10/2024', '05/11/2024']
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet(['Công ty C'] * 3, dates, [10, 8, 5])])
+    assert kpis.refresh_kpis() == 2
+    assert kpis.refresh_kpis() == 0
+
+    # October is left as it was computed: a change there would show if it were recomputed
+    conn = sqlite3.connect(app_db)
+    with conn:
+        conn.execute("UPDATE kpi_monthly SET quantity = 100 WHERE month = '2024-10' AND dimension = 'customer'")
+    conn.close()
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet(['Công ty C'] * 3, dates, [10, 8, 7])])
+    assert kpis.refresh_kpis() == 1
+    assert customer_totals() == {'Công ty C': 107}
+
+
+def test_spellings_of_one_customer_are_counted_together(app_db):
+    sheet = truck_sheet(['Công ty C', 'cong ty c', 'Nhà hàng B'], ['03/10/2024'] * 3, [10, 8, 5])
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [sheet])
+    kpis.refresh_kpis()
+    assert customer_totals() == {'Công ty C': 10, 'cong ty c': 8, 'Nhà hàng B': 5}
+
+    # The spelling becomes an alias after its deliveries were counted
+    customers.sync_customers(['Công ty C', 'cong ty c', 'Nhà hàng B'])
+    assert kpis.refresh_kpis() == 1
+    assert customer_totals() == {'Công ty C': 18, 'Nhà hàng B': 5}
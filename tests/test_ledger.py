@@ -0,0 +1,51 @@
+import sqlite3
+import pandas as pd
+import delivery_store
+import ledger
+
+
+def truck_sheet(quantity=10, driver='Hùng', returned=5):
+    return pd.DataFrame({
+        'Ngày': pd.to_datetime(['03/10/2024', '04/10/2024'], format='%d/%m/%Y'),
+        'Khách hàng ( Hoặc số địa chỉ)': ['Công ty C', 'Nhà hàng B'],
+        'Loại sản phẩm': 'NV',
+        'Số lượng Giao': [quantity, 8],
+        'Vỏ về': [returned, 0],
+        'Thanh Toán': [500000.0, None],
+        'Người chở 1': [driver, 'Dũng'],
+    })
+
+
+def ledger_entries(app_db):
+    conn = sqlite3.connect(app_db)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM receivables_ledger').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_edits_outside_the_receivable_columns_post_nothing(app_db):
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet()])
+    assert ledger.post_receivables() == 2
+
+    result = delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet(driver='Dũng', returned=9)])
+    assert result['updated'] == 1
+    assert ledger.post_receivables() == 0
+    assert ledger_entries(app_db) == 2
+
+    # A changed quantity reverses the old entry and posts the new one
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet(quantity=12, driver='Dũng', returned=9)])
+    assert ledger.post_receivables() == 2
+    assert ledger.get_balance('Công ty C')['quantity'] == 12
+
+
+def test_rows_marked_again_without_a_change_post_nothing(app_db):
+    delivery_store.sync_sheet_chunks('truck', 'sheet', [truck_sheet()])
+    ledger.post_receivables()
+
+    conn = sqlite3.connect(app_db)
+    with conn:
+        conn.execute('INSERT INTO receivables_dirty (order_id) SELECT order_id FROM Orders')
+    conn.close()
+    assert ledger.post_receivables() == 0
+    assert ledger_entries(app_db) == 2
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import paged_table
+
+
+def deliveries(rows=300, seed=0):
+    """ delivery rows with repeated values to sort on, a categorical column whose categories are not in
+    sorted order, and missing values """
+    rng = np.random.default_rng(seed)
+    quantities = rng.integers(1, 10, rows).astype(float)
+    quantities[rng.integers(0, rows, 20)] = np.nan
+    return pd.DataFrame({
+        'Ngày': pd.Timestamp('2024-03-31') - pd.to_timedelta(np.sort(rng.integers(0, 30, rows)), unit='D'),
+        'Khách hàng': pd.Categorical(rng.choice(['Quán D', 'Công ty C', None, 'Nhà hàng B'], rows),
+                                     categories=['Quán D', 'Công ty C', 'Nhà hàng B']),
+        'Số lượng Giao': quantities,
+    })
+
+
+def expected_page(data, rows, sort_column, descending, page, page_size):
+    selected = data if rows is None else data.iloc[rows]
+    if sort_column is not None:
+        # By value, missing values last; rows with equal values keep the frame's order
+        selected = selected.sort_values(sort_column, ascending=not descending, kind='stable', na_position='last',
+                                        key=lambda values: values.astype(object) if values.dtype == 'category' else values)
+    start = (page - 1) * page_size
+    return selected.iloc[start:start + page_size]
+
+
+def test_pages_match_sorting_and_slicing_the_selected_rows():
+    data = deliveries()
+    for rows in (None, np.flatnonzero(data['Khách hàng'].isin(['Công ty C', 'Quán D']).to_numpy())):
+        for sort_column in (None, 'Ngày', 'Khách hàng', 'Số lượng Giao'):
+            for descending in (False, True):
+                for page, page_size in ((1, 50), (2, 50), (3, 100), (1, 1000)):
+                    table, total = paged_table.page_rows(data, rows, sort_column, descending, page, page_size)
+                    pd.testing.assert_frame_equal(table, expected_page(data, rows, sort_column, descending,
+                                                                       page, page_size))
+                    assert total == (len(data) if rows is None else len(rows))
+
+
+def test_empty_selections_and_pages_past_the_end_are_empty():
+    data = deliveries()
+    for rows, page in ((np.empty(0, dtype=np.int64), 1), (None, 10), (np.arange(10), 2)):
+        for sort_column in (None, 'Khách hàng'):
+            table, total = paged_table.page_rows(data, rows, sort_column, False, page, 50)
+            assert table.empty
+            assert list(table.columns) == list(data.columns)
+            assert total == (len(data) if rows is None else len(rows))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import delivery_stats
+import rollup
+
+
+def deliveries(rows=400, seed=0):
+    """ truck-like delivery rows over two months, some without a payment method """
+    rng = np.random.default_rng(seed)
+    methods = np.array(['Chuyển khoản', 'Tiền mặt', None], dtype=object)
+    return pd.DataFrame({
+        'Ngày': pd.Timestamp('2024-03-31') - pd.to_timedelta(np.sort(rng.integers(0, 60, rows)), unit='D'),
+        'Khách hàng ( Hoặc số địa chỉ)': rng.choice(['Công ty C', 'Nhà hàng B', 'Quán D'], rows),
+        'Loại sản phẩm': rng.choice(['Bình 12kg', 'Bình 45kg', 'O350'], rows),
+        'Phương Thức Thanh Toán': methods[rng.integers(0, 3, rows)],
+        'Số lượng Giao': rng.integers(1, 20, rows).astype(float),
+        'Thanh Toán': rng.integers(0, 50, rows) * 10_000.0,
+        'Vỏ về': rng.integers(0, 5, rows).astype(float),
+    })
+
+
+def filtered(data, date_range=None, filters=None):
+    keep = pd.Series(True, index=data.index)
+    if date_range:
+        keep &= data['Ngày'].between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))
+    for column, selected in (filters or {}).items():
+        if selected:
+            keep &= data[column].isin(selected)
+    return data[keep]
+
+
+def test_find_cube_picks_the_smallest_cube_with_the_filtered_columns():
+    data = deliveries()
+    summary, detailed = rollup.get_daily_cubes(data)
+    assert len(summary) < len(detailed) < len(data)
+
+    assert rollup.find_cube(data, {}) is summary
+    assert rollup.find_cube(data, {'Loại sản phẩm': ['O350'], 'Khách hàng ( Hoặc số địa chỉ)': []}) is summary
+    assert rollup.find_cube(data, {'Khách hàng ( Hoặc số địa chỉ)': ['Quán D']}) is detailed
+    assert rollup.find_cube(data, {'Ghi chú': ['giao gấp']}) is None
+
+
+def test_statistics_match_the_filtered_rows():
+    data = deliveries()
+    cases = [
+        (None, {}),
+        (('2024-02-15', '2024-03-10'), {'Loại sản phẩm': ['O350', 'Bình 12kg']}),
+        (None, {'Khách hàng ( Hoặc số địa chỉ)': ['Nhà hàng B'], 'Phương Thức Thanh Toán': ['Tiền mặt']}),
+        (('2024-03-01', '2024-03-31'), {'Khách hàng ( Hoặc số địa chỉ)': ['Công ty C'], 'Loại sản phẩm': []}),
+    ]
+    for date_range, filters in cases:
+        rows = filtered(data, date_range, filters)
+        for period in delivery_stats.PERIODS:
+            stats = rollup.statistics(rollup.find_cube(data, filters), period, date_range, filters)
+            pd.testing.assert_frame_equal(stats, delivery_stats.display_statistics(rows, period))
+
+        # The deliveries per month and payment method, straight from the rows
+        counts = pd.crosstab(rows['Ngày'].dt.to_period('M'), rows['Phương Thức Thanh Toán']).sort_index(ascending=False)
+        stats = rollup.statistics(rollup.find_cube(data, filters), 'month', date_range, filters)
+        np.testing.assert_array_equal(stats[list(counts.columns)].to_numpy(), counts.to_numpy())
+        np.testing.assert_array_equal(stats['Số lượng Giao'],
+                                      rows.groupby(rows['Ngày'].dt.to_period('M'))['Số lượng Giao'].sum()[::-1])
+
+
+def test_statistics_of_an_empty_selection_are_empty():
+    data = deliveries()
+    for date_range, filters in ((('2023-01-01', '2023-12-31'), {}),
+                                (None, {'Loại sản phẩm': ['Bình 50kg']}),
+                                (None, {'Khách hàng ( Hoặc số địa chỉ)': ['Quán D'], 'Loại sản phẩm': ['Bình 50kg']})):
+        stats = rollup.statistics(rollup.find_cube(data, filters), 'week', date_range, filters)
+        assert stats.empty
+        assert delivery_stats.display_statistics(filtered(data, date_range, filters), 'week').empty
@@ -0,0 +1,42 @@
+import attendance
+import salary
+
+# March 2024 has 31 days, 5 of them Sundays
+WORK_DAYS_MARCH_2024 = 26
+
+
+def add_employee(name, base_salary, allowance=100_000, insurance=50_000, days=13):
+    attendance.insert_employee(name, base_salary, allowance, insurance)
+    employee_id = {employee_name: employee_id for employee_id, employee_name in attendance.get_employee_names()}[name]
+    attendance.upsert_attendance_batch([(employee_id, f'2024-03-{day:02d}', 1) for day in range(1, days + 1)])
+    return employee_id
+
+
+def net_pay():
+    payroll = salary.get_payroll(2024, 3, 2024, 3)
+    return dict(zip(payroll['employee_name'], payroll['net_pay']))
+
+
+def test_pay_is_the_share_of_working_days_times_base_plus_allowance_less_insurance(app_db):
+    assert salary.compute_pay([13, 26], [26, 26], [2_600_000] * 2, [100_000] * 2, [50_000] * 2).tolist() == \
+        [1_350_000, 2_650_000]
+
+    add_employee('Hùng', 2_600_000)
+    payroll = salary.get_payroll(2024, 3, 2024, 3)
+    assert payroll[['presence', 'work_days', 'net_pay']].values.tolist() == [[13, WORK_DAYS_MARCH_2024, 1_350_000]]
+
+
+def test_payroll_is_computed_once_until_its_inputs_change(app_db):
+    hung = add_employee('Hùng', 2_600_000)
+    add_employee('Dũng', 5_200_000, days=26)
+    assert net_pay() == {'Dũng': 5_250_000, 'Hùng': 1_350_000}
+    assert salary.refresh_payroll(['2024-03']) == 0
+
+    # Only the employee whose attendance changed is computed again
+    attendance.upsert_attendance(hung, '2024-03-14', 1)
+    assert salary.refresh_payroll(['2024-03']) == 1
+    assert net_pay()['Hùng'] == 1_450_000
+
+    attendance.update_employee(hung, 'Hùng', 5_200_000, 100_000, 50_000)
+    assert salary.refresh_payroll(['2024-03']) == 1
+    assert net_pay() == {'Dũng': 5_250_000, 'Hùng': 2_850_000}
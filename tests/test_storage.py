@@ -0,0 +1,37 @@
+import sqlite3
+import pytest
+import storage
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def test_migrate_creates_current_schema(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'app.db')
+    assert storage.migrate(conn) == len(storage.MIGRATIONS)
+    assert 'returned' in _columns(conn, 'sales')
+    # Nothing left to do the second time
+    assert storage.migrate(conn) == len(storage.MIGRATIONS)
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / 'app.db')
+    version = storage.MIGRATIONS.index(storage._create_stock_tables)
+
+    def fail_after_alter(conn):
+        conn.execute('ALTER TABLE sales ADD COLUMN returned INTEGER')
+        conn.execute('CREATE TABLE stock_movements (movement_id INTEGER PRIMARY KEY)')
+        raise RuntimeError('migration failed')
+
+    monkeypatch.setattr(storage, 'MIGRATIONS', storage.MIGRATIONS[:version] + [fail_after_alter])
+    with pytest.raises(RuntimeError):
+        storage.migrate(conn)
+    assert storage.schema_version(conn) == version
+    assert 'returned' not in _columns(conn, 'sales')
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stock_movements'").fetchone() is None
+
+    # The real migration runs cleanly on the database the failed one left
+    monkeypatch.undo()
+    assert storage.migrate(conn) == len(storage.MIGRATIONS)
+    assert 'returned' in _columns(conn, 'sales')